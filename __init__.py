@@ -6,7 +6,15 @@ from .openrouter_node_experimental import OpenRouterNodeExperimental
 from .openrouter_vision_node_experimental import OpenRouterVisionNodeExperimental
 from .comfyui_ollama_node_experimental import OllamaNodeExperimental
 from .comfyui_ollama_vision_node_experimental import OllamaVisionNodeExperimental
-
+from .openrouter_batch_node import OpenRouterBatchNode
+from .comfyui_ollama_batch_node import OllamaBatchNode
+from .comfyui_ollama_preload_node import OllamaPreloadNode
+from .openrouter_model_node import OpenRouterModelSelector
+from .llm_async_node import (
+    OpenRouterSubmitNode, OpenRouterVisionSubmitNode, OllamaSubmitNode, OllamaVisionSubmitNode,
+    LLMAwaitNode,
+)
+
 NODE_CLASS_MAPPINGS = {
     "OpenRouterNode":        OpenRouterNode,
     "OpenRouterVisionNode":  OpenRouterVisionNode,
@@ -16,4 +24,13 @@ NODE_CLASS_MAPPINGS = {
     "OpenRouterVisionNodeExperimental": OpenRouterVisionNodeExperimental,
     "OllamaNodeExperimental":           OllamaNodeExperimental,
     "OllamaVisionNodeExperimental":     OllamaVisionNodeExperimental,
+    "OpenRouterBatchNode":   OpenRouterBatchNode,
+    "OllamaBatchNode":       OllamaBatchNode,
+    "OllamaPreloadNode":     OllamaPreloadNode,
+    "OpenRouterModelSelector": OpenRouterModelSelector,
+    "OpenRouterSubmitNode":       OpenRouterSubmitNode,
+    "OpenRouterVisionSubmitNode": OpenRouterVisionSubmitNode,
+    "OllamaSubmitNode":           OllamaSubmitNode,
+    "OllamaVisionSubmitNode":     OllamaVisionSubmitNode,
+    "LLMAwaitNode":               LLMAwaitNode,
 }
@@ -0,0 +1,143 @@
+# async_requests.py
+#
+# Неблокирующие вызовы нод: submit-нода ставит вызов LLM в фоновый пул
+# и сразу отдаёт handle, await-нода потом ждёт результат. Пока запрос
+# в полёте, ComfyUI выполняет другие ветки графа (сэмплинг, VAE decode),
+# и задержка LLM прячется за работой GPU.
+#
+#   OPENROUTER_ASYNC_WORKERS — размер фонового пула (по умолчанию 8)
+
+import concurrent.futures
+import itertools
+import logging
+import os
+import threading
+import time
+
+from . import metrics, tracing
+
+logger = logging.getLogger("AsyncRequests")
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_WORKERS = 8
+POLL_INTERVAL = 0.1   # как часто await проверяет прерывание из интерфейса
+
+
+class Handle:
+    """A submitted node call: the LLM_HANDLE value passed from submit to await nodes."""
+
+    def __init__(self, handle_id, label, future):
+        self.id = handle_id
+        self.label = label
+        self.future = future
+        self.submitted = time.monotonic()
+
+    def done(self):
+        return self.future.done()
+
+    def __repr__(self):
+        state = "done" if self.done() else "pending"
+        return f"<LLM_HANDLE #{self.id} {self.label} {state}>"
+
+
+def _processing_interrupted():
+    """ComfyUI's interrupt check, or None outside ComfyUI."""
+    try:
+        import comfy.model_management as mm
+        return mm.throw_exception_if_processing_interrupted
+    except Exception:
+        return None
+
+
+class Executor:
+    """Background pool for submitted calls, created on first use."""
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = max(1, int(workers))
+        self._pool = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.submitted = 0
+        self.pending = 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="llm-async")
+            return self._pool
+
+    def submit(self, fn, kwargs, label):
+        """Start fn(**kwargs) in the background; returns a Handle right away."""
+        pool = self._get_pool()
+        with self._lock:
+            self.submitted += 1
+            self.pending += 1
+            handle_id = next(self._ids)
+        future = pool.submit(fn, **kwargs)
+        future.add_done_callback(self._finished)
+        metrics.inc("async_submitted_total", node=label)
+        logger.info("AsyncRequests: submitted #%s (%s)", handle_id, label)
+        return Handle(handle_id, label, future)
+
+    def _finished(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def wait(self, handle, timeout=0.0):
+        """Block until the call behind handle finishes; False if `timeout` (s, 0 = none) ran out.
+
+        Raises ComfyUI's interrupt exception when the user cancels the prompt.
+        """
+        check = _processing_interrupted()
+        started = time.monotonic()
+        deadline = started + timeout if timeout else None
+        with tracing.span("await", handle=handle.id, label=handle.label):
+            while not handle.done():
+                if check is not None:
+                    check()
+                step = POLL_INTERVAL
+                if deadline is not None:
+                    step = min(step, deadline - time.monotonic())
+                    if step <= 0:
+                        return False
+                try:
+                    handle.future.result(timeout=step)
+                except Exception:
+                    pass  # ошибку вызова отдаёт future.result() у вызывающего
+        # Сколько граф реально простоял в ожидании: остальное скрыто за другими нодами
+        waited = time.monotonic() - started
+        metrics.observe("async_wait_seconds", waited, node=handle.label)
+        logger.info("AsyncRequests: #%s ready after %.2fs in flight, waited %.2fs",
+                    handle.id, time.monotonic() - handle.submitted, waited)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "submitted": self.submitted, "pending": self.pending}
+
+
+def _workers_from_env():
+    try:
+        return int(os.environ.get("OPENROUTER_ASYNC_WORKERS", DEFAULT_WORKERS))
+    except ValueError:
+        return DEFAULT_WORKERS
+
+
+_EXECUTOR = Executor(_workers_from_env())
+
+
+def get_executor():
+    return _EXECUTOR
+
+
+def submit(fn, kwargs, label):
+    return _EXECUTOR.submit(fn, kwargs, label)
+
+
+def wait(handle, timeout=0.0):
+    return _EXECUTOR.wait(handle, timeout)
+
+
+def stats():
+    return _EXECUTOR.stats()
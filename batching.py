@@ -0,0 +1,53 @@
+# batching.py
+#
+# Параллельное выполнение запросов с ограничением числа одновременных вызовов.
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from . import tracing
+
+
+def map_ordered(fn, items, max_concurrency):
+    """Apply fn to every item on up to `max_concurrency` threads; results keep input order."""
+    items = list(items)
+    workers = max(1, min(int(max_concurrency), len(items)))
+    if workers == 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-batch") as pool:
+        return list(pool.map(tracing.bind(fn), items))
+
+
+def pack(items, max_count=0, max_bytes=0, size=len):
+    """Split items into as few consecutive groups as possible.
+
+    A group holds at most `max_count` items and `max_bytes` of size(item) in total
+    (0 = no limit); an item bigger than max_bytes on its own gets a group of its own.
+    """
+    groups = []
+    current, current_bytes = [], 0
+    for item in items:
+        n = size(item) if max_bytes else 0
+        if current and ((max_count and len(current) >= max_count)
+                        or (max_bytes and current_bytes + n > max_bytes)):
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append(item)
+        current_bytes += n
+    if current:
+        groups.append(current)
+    return groups
+
+
+def parse_prompts(text):
+    """A JSON array of strings, or one prompt per non-empty line."""
+    stripped = (text or "").strip()
+    if stripped.startswith("["):
+        # "[Scene 1] a cat…" — это обычный список строк, а не JSON
+        try:
+            items = json.loads(stripped)
+        except ValueError:
+            items = None
+        if isinstance(items, list) and all(isinstance(x, str) for x in items):
+            return items
+    return [line.strip() for line in stripped.splitlines() if line.strip()]
@@ -0,0 +1,82 @@
+# benchmarks/bench_balancer.py
+#
+# Распределение запросов OllamaNodeExperimental по нескольким хостам
+# (ollama_balancer) на stub-серверах. Модель заранее загружена только на
+# первом хосте: последовательные запросы должны идти туда (без перезагрузки),
+# а одновременные — расходиться по всем хостам. Код возврата 1, если это не так.
+#
+#   python -m benchmarks.bench_balancer
+#   python -m benchmarks.bench_balancer --hosts 3 --concurrency 16 --latency 0.5
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import tempfile
+
+from .common import load_module
+from .stub_server import StubConfig, StubServer
+
+MODEL = "stub/model"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sequential", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    cache_dir = tempfile.TemporaryDirectory(prefix="openrouter-bench-")
+    os.environ["OPENROUTER_CACHE_DIR"] = cache_dir.name
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    stubs = [StubServer(StubConfig(latency=args.latency)).start() for _ in range(args.hosts)]
+    try:
+        stubs[0].loaded.add(f"{MODEL}:latest")
+        ip_port = ",".join(stub.host for stub in stubs)
+        balancer = load_module("ollama_balancer").get_balancer()
+        for stub in stubs:
+            balancer.probe(stub.host)
+        node = load_module("comfyui_ollama_node_experimental").OllamaNodeExperimental()
+
+        def call(i):
+            return node.call_ollama(ip_port=ip_port, model_name=MODEL, system_prompt="s",
+                                    user_prompt=f"balance #{i}", cache_mode="bypass")[0]
+
+        def counts():
+            return [stub.counters.get("requests", 0) for stub in stubs]
+
+        for i in range(args.sequential):
+            call(i)
+        sequential = counts()
+        for stub in stubs:
+            stub.reset_counters()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            errors = sum(out.startswith("Error")
+                         for out in pool.map(call, range(1000, 1000 + args.concurrency)))
+        concurrent_counts = counts()
+    finally:
+        for stub in stubs:
+            stub.stop()
+        cache_dir.cleanup()
+
+    results = {
+        "params":     vars(args),
+        # без конкуренции — на хост с загруженной моделью
+        "sequential": sequential,
+        # под нагрузкой — на все хосты
+        "concurrent": concurrent_counts,
+        "errors":     errors,
+    }
+    print(json.dumps(results, indent=2))
+    ok = (sequential[0] == args.sequential and errors == 0
+          and (args.concurrency < args.hosts or all(concurrent_counts)))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# benchmarks/bench_body.py
+#
+# Память на сборку тела vision-запроса: старый путь (base64 -> str -> data URL
+# -> json.dumps -> .encode, плюс ключ кэша по json.dumps) против потокового
+# (request_body.JSONBody поверх байтов base64). Пик tracemalloc сверх уже
+# закодированных картинок, в МиБ и в "копиях" размера base64.
+# Со --stub — ещё и сквозной вызов OpenRouterVisionNode на stub-сервере.
+#
+#   python -m benchmarks.bench_body
+#   python -m benchmarks.bench_body --sides 2048 4096 --batch 1 4 --stub
+
+import argparse
+import base64
+import gc
+import hashlib
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from .common import load_module
+from .stub_server import StubConfig, StubServer
+
+MIB = 1024.0 * 1024.0
+
+
+def make_images(count, side, seed=0):
+    """Encoded noise images: PNG of noise is about as large as the raw pixels."""
+    image_utils = load_module("image_utils")
+    rng = __import__("random").Random(seed)
+    return [image_utils.EncodedImage(base64.b64encode(rng.randbytes(side * side * 3)),
+                                     "image/png", (side, side))
+            for _ in range(count)]
+
+
+def _payload(content):
+    return {
+        "model": "stub/model",
+        "messages": [
+            {"role": "system", "content": "You are a benchmark."},
+            {"role": "user", "content": content},
+        ],
+        "max_tokens": 256,
+    }
+
+
+def _content(urls):
+    return [{"type": "text", "text": "Describe the images."}] + [
+        {"type": "image_url", "image_url": {"url": url}} for url in urls]
+
+
+def legacy(images):
+    """What the nodes did before request_body: every step copies the base64."""
+    payload = _payload(_content([img.data_url for img in images]))
+    h = hashlib.sha256(b"http://stub")
+    h.update(json.dumps(payload, sort_keys=True, separators=(",", ":"),
+                        ensure_ascii=False).encode("utf-8"))
+    key = h.hexdigest()
+    body = json.dumps(payload).encode("utf-8")
+    return key, len(body)
+
+
+def streamed(images):
+    request_body = load_module("request_body")
+    response_cache = load_module("response_cache")
+    payload = _payload(_content([img.url_blob() for img in images]))
+    key = response_cache.make_key("http://stub", payload)
+    body = request_body.JSONBody(payload)
+    sent = sum(len(chunk) for chunk in body)   # то, что уходит в сокет
+    return key, sent
+
+
+def measure(fn, images, repeat):
+    fn(images)  # прогрев: импорты
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn(images)
+        ms = (time.perf_counter() - t0) * 1000.0 / repeat
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    b64 = sum(len(img.b64_bytes) for img in images)
+    return {
+        "peak_mib":   round((peak - base) / MIB, 2),
+        "copies":     round((peak - base) / b64, 2),
+        "ms":         round(ms, 2),
+    }
+
+
+def _serve(conn):
+    with StubServer(StubConfig()) as stub:
+        conn.send(stub.openrouter_base)
+        while conn.recv() == "counters":
+            conn.send(dict(stub.counters))
+
+
+class RemoteStub:
+    """Stub server in a child process: tracemalloc here sees only the client side."""
+
+    def __init__(self):
+        import multiprocessing
+        self._conn, child = multiprocessing.Pipe()
+        self._proc = multiprocessing.Process(target=_serve, args=(child,), daemon=True)
+        self._proc.start()
+        self.openrouter_base = self._conn.recv()
+
+    @property
+    def counters(self):
+        self._conn.send("counters")
+        return self._conn.recv()
+
+    def stop(self):
+        self._conn.send("stop")
+        self._proc.join()
+
+
+def run_stub(stub, side, batch, repeat):
+    """Peak memory of a whole OpenRouterVisionNode call, images_per_request=0."""
+    import numpy as np
+
+    node = load_module("openrouter_vision_node").OpenRouterVisionNode()
+    rng = np.random.default_rng(0)
+    img = rng.random((batch, side, side, 3), dtype=np.float32)
+    kwargs = dict(api_key="sk-bench", model_name="stub/model", system_prompt="",
+                  cache_mode="bypass", max_side=side, image_format="PNG",
+                  images_per_request=0)
+
+    def call(i):
+        out = node.call_openrouter(user_prompt=f"bench #{i}", img=img, **kwargs)[0]
+        if out.startswith("Error"):
+            raise RuntimeError(out)
+
+    # Прогрев и кэш закодированных кадров: меряем запрос, а не PNG.
+    # Если кадры не влезают в кэш (ENCODED_CACHE_BYTES), в пик попадёт и кодирование
+    call(-1)
+    sent = stub.counters.get("request_bytes", 0)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for i in range(repeat):
+            call(i)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    body = (stub.counters["request_bytes"] - sent) / repeat
+    return {
+        "body_mib": round(body / MIB, 2),
+        "peak_mib": round((peak - base) / MIB, 2),
+        "copies":   round((peak - base) / body, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sides", type=int, nargs="+", default=[1024, 2048, 4096])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stub", action="store_true", help="also measure a full node call on the stub server")
+    parser.add_argument("--out", help="write JSON here as well")
+    args = parser.parse_args()
+
+    # Кэши пакета (каталог моделей models_<хэш адреса>.json, ответы) — во временный
+    # каталог: порт stub-сервера каждый раз новый, и файлы копились бы в настоящем кэше
+    cache_dir = tempfile.TemporaryDirectory(prefix="openrouter-bench-")
+    os.environ["OPENROUTER_CACHE_DIR"] = cache_dir.name
+    stub = None
+    if args.stub:
+        # До загрузки модулей пакета: openrouter_api читает адрес при импорте
+        stub = RemoteStub()
+        os.environ["OPENROUTER_API_BASE"] = stub.openrouter_base
+
+    results = {"builder": [], "node": []}
+    for side in args.sides:
+        for batch in args.batch:
+            images = make_images(batch, side)
+            assert legacy(images)[0] == streamed(images)[0], "cache keys differ"
+            results["builder"].append({
+                "side": side, "batch": batch,
+                "b64_mib": round(sum(len(i.b64_bytes) for i in images) / MIB, 2),
+                "legacy": measure(legacy, images, args.repeat),
+                "streamed": measure(streamed, images, args.repeat),
+            })
+            del images
+            if stub is not None:
+                results["node"].append({"side": side, "batch": batch,
+                                        **run_stub(stub, side, batch, args.repeat)})
+    if stub is not None:
+        stub.stop()
+    cache_dir.cleanup()
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
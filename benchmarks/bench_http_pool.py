@@ -0,0 +1,75 @@
+# benchmarks/bench_http_pool.py
+#
+# Сравнение urllib.request.urlopen (новое соединение на каждый запрос)
+# и общего пула http_pool на локальном stub-сервере.
+#
+#   python -m benchmarks.bench_http_pool --requests 500
+
+import argparse
+import http.server
+import json
+import socket
+import threading
+import urllib.request
+
+from .common import load_module, summarize, timed
+
+BODY = json.dumps({"choices": [{"message": {"content": "ok"}}]}).encode("utf-8")
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        type(self).connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    http_pool = load_module("http_pool")
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    data = json.dumps({"model": "stub", "messages": []}).encode("utf-8")
+
+    def make_req():
+        return urllib.request.Request(url, data=data, method="POST",
+                                      headers={"Content-Type": "application/json"})
+
+    def via_urllib():
+        with urllib.request.urlopen(make_req()) as resp:
+            resp.read()
+
+    def via_pool():
+        with http_pool.urlopen(make_req()) as resp:
+            resp.read()
+
+    results = {}
+    for name, fn in (("urllib", via_urllib), ("http_pool", via_pool)):
+        _Handler.connections = 0
+        results[name] = summarize(timed(fn, args.requests))
+        results[name]["connections"] = _Handler.connections
+
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/bench_import.py
+#
+# Время импорта пакета (то, что ComfyUI платит при старте) в чистом
+# процессе, по `python -X importtime`: общее время, самые тяжёлые модули
+# и какие тяжёлые зависимости (PIL, NumPy, torch) подтянулись.
+#
+#   python -m benchmarks.bench_import --repeat 5
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from .common import PACKAGE_DIR, PACKAGE_NAME
+
+HEAVY = ("PIL", "numpy", "torch")
+
+_CHILD = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+from benchmarks.common import load_package
+t0 = time.perf_counter()
+pkg = load_package()
+ms = (time.perf_counter() - t0) * 1000.0
+print(json.dumps({{"ms": ms, "nodes": len(pkg.NODE_CLASS_MAPPINGS),
+                  "heavy": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+
+def _parse_importtime(stderr):
+    """{module: (self_us, cumulative_us)} from -X importtime output."""
+    out = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # строка заголовка
+        out[parts[2].strip()] = (self_us, cumulative_us)
+    return out
+
+
+def measure_once():
+    code = _CHILD.format(root=PACKAGE_DIR, heavy=HEAVY)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, check=True, cwd=PACKAGE_DIR)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["modules"] = _parse_importtime(proc.stderr)
+    return result
+
+
+def measure(repeat=3, top=10):
+    runs = [measure_once() for _ in range(repeat)]
+    last = runs[-1]
+    # Всё, что импортировано после benchmarks.common, — цена пакета
+    modules = {name: t for name, t in last["modules"].items()
+               if not name.startswith("benchmarks")}
+    heaviest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    return {
+        "repeat":    repeat,
+        "wall_ms":   round(statistics.median(r["ms"] for r in runs), 2),
+        "min_ms":    round(min(r["ms"] for r in runs), 2),
+        "nodes":     last["nodes"],
+        "heavy":     last["heavy"],
+        "modules":   len(modules),
+        "package_modules": sum(1 for name in modules if name.startswith(PACKAGE_NAME + ".")),
+        "top_self_ms": {name: round(t[0] / 1000.0, 2) for name, t in heaviest},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(measure(args.repeat, args.top), indent=2))
+
+
+if __name__ == "__main__":
+    main()
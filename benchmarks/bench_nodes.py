@@ -0,0 +1,192 @@
+# benchmarks/bench_nodes.py
+#
+# Сквозной бенчмарк нод на локальном stub-сервере (benchmarks/stub_server.py),
+# без сети: задержка, пропускная способность, ошибки и память каждой ноды
+# при заданной конкурентности. Результат — JSON, пригодный для сравнения
+# между коммитами.
+#
+#   python -m benchmarks.bench_nodes --calls 200 --concurrency 16
+#   python -m benchmarks.bench_nodes --nodes OllamaNode --latency 0.2 --rate-429 0.05
+#   python -m benchmarks.bench_nodes --out results.json
+#   python -m benchmarks.bench_nodes --trace trace.json   # Chrome trace + время по стадиям
+
+import argparse
+import concurrent.futures
+import gc
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+from . import bench_import
+from .common import load_module, summarize
+from .stub_server import StubConfig, StubServer
+
+# (модуль, класс, тип: text/vision, бэкенд)
+NODES = (
+    ("openrouter_node",                         "OpenRouterNode",                   "text",   "openrouter"),
+    ("openrouter_node_experimental",            "OpenRouterNodeExperimental",       "text",   "openrouter"),
+    ("openrouter_vision_node",                  "OpenRouterVisionNode",             "vision", "openrouter"),
+    ("openrouter_vision_node_experimental",     "OpenRouterVisionNodeExperimental", "vision", "openrouter"),
+    ("comfyui_ollama_node",                     "OllamaNode",                       "text",   "ollama"),
+    ("comfyui_ollama_node_experimental",        "OllamaNodeExperimental",           "text",   "ollama"),
+    ("comfyui_ollama_vision_node",              "OllamaVisionNode",                 "vision", "ollama"),
+    ("comfyui_ollama_vision_node_experimental", "OllamaVisionNodeExperimental",     "vision", "ollama"),
+)
+
+
+def make_image(frames, side, seed):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    return rng.random((frames, side, side, 3), dtype=np.float32)
+
+
+def make_call(node, kind, backend, stub, args):
+    fn = getattr(node, node.FUNCTION)
+    common = dict(model_name="stub/model", system_prompt="You are a benchmark.",
+                  cache_mode="bypass", max_attempts=args.max_attempts,
+                  read_timeout=30.0, deadline=60.0)
+    if backend == "openrouter":
+        common["api_key"] = "sk-bench"
+        if args.stream:
+            common["stream"] = True
+    else:
+        common["ip_port"] = stub.host
+    if args.rpm:
+        common["rpm"] = args.rpm
+    counter = iter(range(1 << 62))
+
+    def call():
+        # Уникальный промпт на вызов — иначе singleflight склеит запросы
+        i = next(counter)
+        kwargs = dict(common, user_prompt=f"bench prompt #{i}")
+        if kind == "vision":
+            kwargs["img"] = make_image(args.frames, args.image_side, i)
+        return fn(**kwargs)[0]
+
+    return call
+
+
+def run_scenario(call, calls, concurrency):
+    latencies = []
+    errors = 0
+
+    def one():
+        t0 = time.perf_counter()
+        out = call()
+        return (time.perf_counter() - t0) * 1000.0, out
+
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for ms, out in pool.map(lambda _: one(), range(calls)):
+            latencies.append(ms)
+            # Ноды не бросают исключения, а возвращают строку "Error..."
+            if not isinstance(out, str) or out.startswith("Error"):
+                errors += 1
+    wall = time.perf_counter() - t0
+    result = summarize(latencies)
+    result.update(errors=errors, wall_s=round(wall, 3), throughput=round(calls / wall, 2))
+    return result
+
+
+def run_memory(call, calls):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()  # прогрев: импорты, пулы, кэши
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in range(calls):
+            call()
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "calls":            calls,
+        "peak_kib":         round((peak - base) / 1024.0, 1),
+        "retained_kib":     round((current - base) / 1024.0, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", nargs="*", help="class names to run (default: all)")
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--memory-calls", type=int, default=20, help="0 disables the memory pass")
+    parser.add_argument("--import-repeat", type=int, default=3, help="0 skips the import timing")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--chunks", type=int, default=8)
+    parser.add_argument("--chunk-delay", type=float, default=0.005)
+    parser.add_argument("--load-delay", type=float, default=0.0, help="Ollama model load time")
+    parser.add_argument("--stream", action="store_true", help="streaming for OpenRouter nodes")
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=2)
+    parser.add_argument("--image-side", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON results to this file")
+    parser.add_argument("--trace", help="write a Chrome trace of the run to this file")
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        rate_429=args.rate_429, retry_after=args.retry_after,
+                        chunks=args.chunks, chunk_delay=args.chunk_delay,
+                        load_delay=args.load_delay, seed=args.seed)
+    # Кэши пакета (каталог моделей models_<хэш адреса>.json, ответы) — во временный
+    # каталог: порт stub-сервера каждый раз новый, и файлы копились бы в настоящем кэше
+    cache_dir = tempfile.TemporaryDirectory(prefix="openrouter-bench-")
+    os.environ["OPENROUTER_CACHE_DIR"] = cache_dir.name
+    stub = StubServer(config).start()
+    # До импорта нод: URL OpenRouter читается при загрузке openrouter_api
+    os.environ["OPENROUTER_API_BASE"] = stub.openrouter_base
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    results = {
+        "python":  platform.python_version(),
+        "stub":    config.as_dict(),
+        "params":  {k: v for k, v in vars(args).items() if k not in ("nodes", "out", "trace")},
+        "nodes":   {},
+    }
+    if args.import_repeat:
+        # В отдельном процессе, до того как этот процесс сам загрузит модули
+        results["import"] = bench_import.measure(args.import_repeat)
+    tracing = load_module("tracing")
+    if args.trace:
+        tracing.enable()
+    try:
+        for module_name, class_name, kind, backend in NODES:
+            if args.nodes and class_name not in args.nodes:
+                continue
+            node = getattr(load_module(module_name), class_name)()
+            call = make_call(node, kind, backend, stub, args)
+            stub.reset_counters()
+            entry = run_scenario(call, args.calls, args.concurrency)
+            entry["stub"] = dict(stub.counters)
+            if args.memory_calls:
+                entry["memory"] = run_memory(call, args.memory_calls)
+            results["nodes"][class_name] = entry
+    finally:
+        stub.stop()
+        cache_dir.cleanup()
+    if args.trace:
+        tracing.dump(args.trace)
+        results["trace"] = tracing.summary()
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# benchmarks/bench_preprocess.py
+#
+# Подготовка кадров для vision-нод: старый путь (_to_pil + thumbnail)
+# против image_utils.to_pil_list. Пиковая память — по tracemalloc
+# (numpy сообщает ему о своих буферах).
+#
+#   python -m benchmarks.bench_preprocess
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from .common import load_module
+
+
+def legacy_to_pil(img):
+    """The pre-image_utils conversion, kept here as the baseline."""
+    arr = np.squeeze(np.array(img))
+    if np.issubdtype(arr.dtype, np.floating):
+        arr = (arr * 255).clip(0, 255).astype(np.uint8)
+    if arr.ndim == 3 and arr.shape[0] in (1, 3, 4):
+        arr = np.transpose(arr, (1, 2, 0))
+    mode = {1: "L", 3: "RGB", 4: "RGBA"}[arr.shape[2]] if arr.ndim == 3 else "L"
+    return Image.fromarray(arr, mode)
+
+
+def legacy(batch):
+    out = []
+    for frame in batch:  # старый код не принимал батчи — кадры по одному
+        pil = legacy_to_pil(frame[None])
+        pil.thumbnail((512, 512))
+        out.append(pil)
+    return out
+
+
+def measure(fn, batch, repeat):
+    tracemalloc.start()
+    fn(batch)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(batch)
+    ms = (time.perf_counter() - t0) * 1000.0 / repeat / len(batch)
+    return {"ms_per_frame": round(ms, 2), "peak_mb": round(peak / 2**20, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    image_utils = load_module("image_utils")
+    rng = np.random.default_rng(0)
+    cases = {
+        "4k_single":    rng.random((1, 2160, 3840, 3), dtype=np.float32),
+        "1080p_batch8": rng.random((8, 1080, 1920, 3), dtype=np.float32),
+        "512_batch16":  rng.random((16, 512, 512, 3), dtype=np.float32),
+    }
+    results = {}
+    for name, batch in cases.items():
+        results[name] = {
+            "legacy":      measure(legacy, batch, args.repeat),
+            "image_utils": measure(image_utils.to_pil_list, batch, args.repeat),
+            "input_mb":    round(batch.nbytes / 2**20, 1),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# benchmarks/common.py
+#
+# Общие помощники для бенчмарков: загрузка модулей пакета без ComfyUI
+# и простые замеры времени.
+
+import importlib
+import importlib.util
+import os
+import sys
+import time
+import types
+
+PACKAGE_NAME = "comfyui_openrouter"
+PACKAGE_DIR  = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name):
+    """Import `<package>.<name>` without running the package __init__."""
+    if PACKAGE_NAME not in sys.modules:
+        pkg = types.ModuleType(PACKAGE_NAME)
+        pkg.__path__ = [PACKAGE_DIR]
+        sys.modules[PACKAGE_NAME] = pkg
+    return importlib.import_module(f"{PACKAGE_NAME}.{name}")
+
+
+def load_package():
+    """Import the package __init__ the way ComfyUI does (registers every node)."""
+    if PACKAGE_NAME in sys.modules and hasattr(sys.modules[PACKAGE_NAME], "NODE_CLASS_MAPPINGS"):
+        return sys.modules[PACKAGE_NAME]
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, os.path.join(PACKAGE_DIR, "__init__.py"),
+        submodule_search_locations=[PACKAGE_DIR],
+    )
+    pkg = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = pkg
+    spec.loader.exec_module(pkg)
+    return pkg
+
+
+def timed(fn, repeat):
+    """Run fn() `repeat` times, return per-call latencies in ms."""
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000.0)
+    return out
+
+
+def summarize(samples):
+    s = sorted(samples)
+    n = len(s)
+    return {
+        "n":    n,
+        "mean": sum(s) / n,
+        "p50":  s[n // 2],
+        "p95":  s[min(n - 1, int(n * 0.95))],
+        "max":  s[-1],
+    }
@@ -0,0 +1,265 @@
+# benchmarks/stub_server.py
+#
+# Локальный stub-сервер OpenRouter/Ollama для бенчмарков без сети:
+#   POST /api/v1/chat/completions  — OpenRouter (JSON или SSE при "stream")
+#   POST /v1/chat/completions      — Ollama, OpenAI-совместимый
+#   POST /api/chat                 — Ollama, нативный NDJSON-поток
+#   GET  /api/v1/models            — каталог OpenRouter (с ETag / 304)
+#   GET  /api/ps, POST /api/generate (без prompt: загрузка/выгрузка модели)
+# Задержка, jitter, доля ошибок 5xx и 429 и скорость потока настраиваются.
+
+import http.server
+import json
+import random
+import socket
+import threading
+import time
+
+MODELS = [
+    {"id": "stub/model", "name": "Stub (vision)", "context_length": 32768,
+     "architecture": {"input_modalities": ["text", "image"], "output_modalities": ["text"]},
+     "pricing": {"prompt": "0.000001", "completion": "0.000002"}},
+    {"id": "stub/text", "name": "Stub (text)", "context_length": 8192,
+     "architecture": {"modality": "text->text"},
+     "pricing": {"prompt": "0", "completion": "0"}},
+]
+MODELS_ETAG = '"stub-models-1"'
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod".split()
+
+
+def _model(name):
+    # Как Ollama: "llava" и "llava:latest" — одна модель
+    name = name or ""
+    return name if ":" in name else f"{name}:latest"
+
+
+class StubConfig:
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, rate_429=0.0,
+                 retry_after=0.2, chunks=8, chunk_delay=0.005, load_delay=0.0, seed=0):
+        self.latency = latency          # секунд до ответа (или до первого чанка)
+        self.jitter = jitter            # ± равномерный разброс задержки
+        self.error_rate = error_rate    # доля ответов 503
+        self.rate_429 = rate_429        # доля ответов 429 с Retry-After
+        self.retry_after = retry_after
+        self.chunks = chunks            # слов в ответе / чанков в потоке
+        self.chunk_delay = chunk_delay  # пауза между чанками потока
+        self.load_delay = load_delay    # загрузка модели, которой нет в /api/ps
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub = None  # StubServer, задаётся в подклассе
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stub.count("connections")
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, obj, headers=()):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/v1/models":
+            self.stub.count("catalog_requests")
+            if self.headers.get("If-None-Match") == MODELS_ETAG:
+                self.send_response(304)
+                self.send_header("ETag", MODELS_ETAG)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self._send_json(200, {"data": MODELS}, [("ETag", MODELS_ETAG)])
+        elif self.path == "/api/ps":
+            self._send_json(200, {"models": [{"name": m} for m in sorted(self.stub.loaded)]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        payload = json.loads(raw or b"{}")
+        stub = self.stub
+
+        if self.path == "/api/generate" and "prompt" not in payload:
+            model = _model(payload.get("model"))
+            if payload.get("keep_alive") == 0:
+                stub.count("unloads")
+                stub.loaded.discard(model)
+            else:
+                stub.count("loads")
+                time.sleep(stub.config.load_delay if model not in stub.loaded else 0.0)
+                stub.loaded.add(model)
+            self._send_json(200, {"model": model, "done": True, "response": ""})
+            return
+        if self.path not in ("/api/v1/chat/completions", "/v1/chat/completions", "/api/chat"):
+            self._send_json(404, {"error": "not found"})
+            return
+        stub.count("requests")
+        stub.count("request_bytes", len(raw))
+
+        time.sleep(stub.delay())
+        roll = stub.roll()
+        cfg = stub.config
+        if roll < cfg.rate_429:
+            stub.count("status_429")
+            self._send_json(429, {"error": {"message": "rate limited"}},
+                            [("Retry-After", str(cfg.retry_after))])
+            return
+        if roll < cfg.rate_429 + cfg.error_rate:
+            stub.count("status_503")
+            self._send_json(503, {"error": {"message": "upstream unavailable"}})
+            return
+
+        # Считаем до отправки: клиент может закончить раньше, чем мы вернёмся
+        stub.count("status_200")
+        model = _model(payload.get("model"))
+        if self.path == "/api/chat" and model not in stub.loaded:
+            time.sleep(cfg.load_delay)
+        if self.path == "/api/chat" and payload.get("keep_alive") == 0:
+            stub.loaded.discard(model)
+        else:
+            stub.loaded.add(model)
+        words = [WORDS[i % len(WORDS)] for i in range(cfg.chunks)]
+        usage = {"prompt_tokens": len(raw) // 4, "completion_tokens": len(words)}
+        prefix = stub.seen_prefix(payload)
+        if prefix and self.path != "/api/chat":
+            # Как у провайдеров с кэшем префикса: повторный system_prompt не пересчитывается
+            usage["prompt_tokens_details"] = {"cached_tokens": prefix // 4}
+        if self.path == "/api/chat":
+            # Ollama по умолчанию стримит, если "stream" не выключен явно
+            if payload.get("stream", True):
+                self._ndjson(words, usage)
+            else:
+                self._send_json(200, {"message": {"role": "assistant", "content": " ".join(words)},
+                                      "done": True, **self._ollama_usage(usage)})
+        elif payload.get("stream"):
+            self._sse(words, usage)
+        else:
+            self._send_json(200, {
+                "choices": [{"message": {"role": "assistant", "content": " ".join(words)},
+                             "finish_reason": "stop"}],
+                "usage":   usage,
+            })
+
+    @staticmethod
+    def _ollama_usage(usage):
+        return {"prompt_eval_count": usage["prompt_tokens"], "eval_count": usage["completion_tokens"],
+                "total_duration": 1, "load_duration": 0, "eval_duration": 1}
+
+    def _chunked(self, content_type, pieces):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for piece in pieces:
+            data = piece.encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+            time.sleep(self.stub.config.chunk_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _sse(self, words, usage):
+        def events():
+            for i, word in enumerate(words):
+                delta = {"content": (" " if i else "") + word}
+                yield "data: " + json.dumps({"choices": [{"delta": delta}]}) + "\n\n"
+            yield "data: " + json.dumps({"choices": [{"delta": {}, "finish_reason": "stop"}],
+                                         "usage": usage}) + "\n\n"
+            yield "data: [DONE]\n\n"
+        self._chunked("text/event-stream", events())
+
+    def _ndjson(self, words, usage):
+        def lines():
+            for i, word in enumerate(words):
+                msg = {"role": "assistant", "content": (" " if i else "") + word}
+                yield json.dumps({"message": msg, "done": False}) + "\n"
+            yield json.dumps({"message": {"role": "assistant", "content": ""}, "done": True,
+                              **self._ollama_usage(usage)}) + "\n"
+        self._chunked("application/x-ndjson", lines())
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь listen() по умолчанию — 5: при конкурентности выше лишние SYN
+    # отбрасываются, и клиент ждёт повторной отправки ~1 с
+    request_queue_size = 128
+
+
+class StubServer:
+    """Threaded stub server on 127.0.0.1 with counters of what it served."""
+
+    def __init__(self, config=None):
+        self.config = config or StubConfig()
+        self.loaded = set()
+        self._prefixes = set()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.counters = {}
+        handler = type("Handler", (_Handler,), {"stub": self})
+        self._server = _Server(("127.0.0.1", 0), handler)
+        self._thread = None
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self._server.server_port}"
+
+    @property
+    def openrouter_base(self):
+        return f"http://{self.host}/api/v1"
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def delay(self):
+        with self._lock:
+            jitter = self._rng.uniform(-self.config.jitter, self.config.jitter)
+        return max(0.0, self.config.latency + jitter)
+
+    def roll(self):
+        with self._lock:
+            return self._rng.random()
+
+    def seen_prefix(self, payload):
+        """Length of the system prompt if an identical one was already served, else 0."""
+        messages = payload.get("messages") or []
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        system = json.dumps(messages[0], sort_keys=True)
+        with self._lock:
+            if system in self._prefixes:
+                return len(system)
+            self._prefixes.add(system)
+        return 0
+
+    def reset_counters(self):
+        with self._lock:
+            self.counters = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,70 @@
+# comfyui_ollama_batch_node.py
+#
+# Пакетная текстовая нода: список user-промптов с общим system-промптом
+# и параметрами выполняется параллельно (не больше max_concurrency
+# запросов одновременно). Ошибка отдельного промпта не роняет весь пакет —
+# на его месте в ответах будет строка "Error: ...".
+
+import logging
+
+from . import response_cache, batching, tracing
+from .comfyui_ollama_node import OllamaNode
+
+logger = logging.getLogger("OllamaBatchNode")
+logger.setLevel(logging.DEBUG)
+
+
+class OllamaBatchNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        # Параметры те же, что у OllamaNode
+        optional = OllamaNode.INPUT_TYPES()["optional"]
+        return {
+            "required": {
+                "ip_port":       ("STRING", {"multiline": False}),  # e.g. "localhost:11434"
+                "model_name":    ("STRING", {"multiline": False}),
+                "system_prompt": ("STRING", {"multiline": True}),
+                # по одному промпту на строку или JSON-массив строк
+                "user_prompts":  ("STRING", {"multiline": True}),
+            },
+            "optional": {
+                "max_concurrency": ("INT", {"default": 2, "min": 1, "max": 64}),
+                **optional,
+            }
+        }
+
+    RETURN_TYPES   = ("STRING", "STRING")
+    RETURN_NAMES   = ("response", "responses")
+    OUTPUT_IS_LIST = (False, True)
+    FUNCTION       = "call_ollama"
+    CATEGORY       = "Ollama"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return response_cache.is_changed(**kwargs)
+
+    @tracing.traced("OllamaBatchNode")
+    def call_ollama(self, ip_port, model_name, system_prompt, user_prompts,
+                    max_concurrency=2, **params):
+        prompts = batching.parse_prompts(user_prompts)
+
+        node = OllamaNode()
+
+        def run_one(prompt):
+            try:
+                return node.call_ollama(ip_port, model_name, system_prompt, prompt, **params)[0]
+            except Exception as e:
+                logger.error("OllamaBatchNode: prompt failed", exc_info=True)
+                return f"Error: {e}"
+
+        logger.info("OllamaBatchNode: %s prompt(s), max_concurrency=%s", len(prompts), max_concurrency)
+        responses = batching.map_ordered(run_one, prompts, max_concurrency)
+        failed = sum(r.startswith("Error:") for r in responses)
+        if failed:
+            logger.warning("OllamaBatchNode: %s/%s prompt(s) failed", failed, len(responses))
+        return ("\n".join(responses), responses)
+
+# Регистрация ноды
+NODE_CLASS_MAPPINGS = {
+    "OllamaBatchNode": OllamaBatchNode
+}
@@ -4,6 +4,10 @@ import urllib.request
 import json
 import logging
 
+from . import (
+    response_cache, retry, ollama_balancer, singleflight, rate_limit, metrics, token_budget, tracing,
+)
+
 # Настраиваем логгер для этой ноды
 logger = logging.getLogger("OllamaNode")
 logger.setLevel(logging.DEBUG)
@@ -17,6 +21,12 @@ class OllamaNode:
                 "model_name":    ("STRING", {"multiline": False}),
                 "system_prompt": ("STRING", {"multiline": True}),
                 "user_prompt":   ("STRING", {"multiline": True}),
+            },
+            "optional": {
+                "cache_mode": (response_cache.CACHE_MODES, {"default": "use"}),
+                **token_budget.BUDGET_INPUTS,
+                **rate_limit.RATE_INPUTS,
+                **retry.RETRY_INPUTS,
             }
         }
 
@@ -25,11 +35,27 @@ class OllamaNode:
     FUNCTION     = "call_ollama"
     CATEGORY     = "Ollama"
 
-    def call_ollama(self, ip_port, model_name, system_prompt, user_prompt):
-        url = f"http://{ip_port}/v1/chat/completions"
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return response_cache.is_changed(**kwargs)
+
+    @tracing.traced("OllamaNode")
+    def call_ollama(self, ip_port, model_name, system_prompt, user_prompt, cache_mode="use",
+                    truncate="off", max_prompt_tokens=0,
+                    rpm=0, tpm=0,
+                    max_attempts=3, connect_timeout=10.0, read_timeout=120.0, deadline=300.0):
+        path = "/v1/chat/completions"
         headers = {
             "Content-Type":  "application/json",
         }
+        # Длина контекста модели здесь неизвестна: проверяем только по max_prompt_tokens
+        try:
+            user_prompt = token_budget.fit_prompt(
+                system_prompt, user_prompt, token_budget.ollama_limit(0, max_prompt_tokens),
+                truncate, "OllamaNode")
+        except token_budget.PromptTooLong as e:
+            return (f"Error: {e}",)
+
         payload = {
             "model":    model_name,
             "messages": [
@@ -37,38 +63,48 @@ class OllamaNode:
                 {"role": "user",   "content": user_prompt}
             ]
         }
-        data = json.dumps(payload).encode("utf-8")
+        with tracing.span("serialize"):
+            data = json.dumps(payload).encode("utf-8")
 
-        for attempt in range(1, 4):
-            logger.info(f"OllamaNode: Attempt {attempt}/3")
-            logger.debug(f"OllamaNode: POST {url} (payload {len(data)} bytes)")
+        cache_key = response_cache.make_key(f"http://{ip_port}{path}", payload)
+        cached = response_cache.lookup(cache_key, cache_mode)
+        if cached is not None:
+            return (cached,)
 
-            req = urllib.request.Request(url, data=data, headers=headers, method="POST")
-            try:
-                with urllib.request.urlopen(req) as resp:
-                    status = getattr(resp, "status", resp.getcode())
-                    logger.info(f"OllamaNode: HTTP {status}")
+        policy = retry.policy_from_inputs(max_attempts, connect_timeout, read_timeout, deadline)
 
-                    raw = resp.read().decode("utf-8")
-                    logger.debug(f"OllamaNode: Raw response: {raw}")
+        tokens = rate_limit.estimate_tokens(payload)
 
-                    resp_json = json.loads(raw)
-                    content = resp_json["choices"][0]["message"]["content"]
-                    logger.info(f"OllamaNode: Got content length={len(content)}")
-                    return (content,)
+        def send(attempt, timeout):
+            with ollama_balancer.acquire(ip_port, model_name) as host:
+                url = f"http://{host}{path}"
+                logger.info("OllamaNode: Attempt %s/%s", attempt, policy.max_attempts)
+                logger.debug("OllamaNode: POST %s (payload %s bytes)", url, len(data))
+
+                req = urllib.request.Request(url, data=data, headers=headers, method="POST")
+                limiter = rate_limit.get_limiter(rate_limit.ollama_key(host), rpm, tpm)
+                m = metrics.request("ollama", model_name, len(data), attempt)
+                with m, limiter.urlopen(req, timeout=timeout, tokens=tokens) as resp:
+                    m.first_byte(resp)
+                    status = getattr(resp, "status", resp.getcode())
+                    logger.info("OllamaNode: HTTP %s", status)
 
-            except urllib.error.HTTPError as e:
-                err = f"HTTPError {e.code}: {e.reason}"
-                logger.warning(f"OllamaNode: {err} on attempt {attempt}")
-                if attempt == 3:
-                    return (f"Error: {err}",)
+                    raw = resp.read()
+                    logger.debug("OllamaNode: response %d bytes", len(raw))
+                    with tracing.span("parse"):
+                        resp_json = json.loads(raw)
+                    m.usage(resp_json.get("usage"))
+                    content = resp_json["choices"][0]["message"]["content"]
+                    logger.info("OllamaNode: Got content length=%s", len(content))
+                    return content
 
-            except Exception as e:
-                logger.warning(f"OllamaNode: Exception on attempt {attempt}: {e}", exc_info=True)
-                if attempt == 3:
-                    return (f"Error: {e}",)
+        try:
+            content = singleflight.do(cache_key, lambda: policy.run(send, logger, "OllamaNode"))
+        except Exception as e:
+            return (f"Error: {retry.describe_error(e)}",)
 
-        return ("Error: exhausted retries",)
+        response_cache.store(cache_key, content, cache_mode)
+        return (content,)
 
 # Регистрация ноды
 NODE_CLASS_MAPPINGS = {
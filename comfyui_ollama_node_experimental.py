@@ -4,6 +4,12 @@ import urllib.request
 import urllib.error
 import json
 import logging
+import time
+
+from . import (
+    response_cache, streaming, ollama_api, retry, ollama_balancer, ollama_residency,
+    singleflight, rate_limit, metrics, token_budget, tracing,
+)
 
 # Настраиваем логгер для этой ноды
 logger = logging.getLogger("OllamaNodeExperimental")
@@ -24,6 +30,15 @@ class OllamaNodeExperimental:
                 "temperature": ("FLOAT", {"default": 0.7}),
                 "top_p":       ("FLOAT", {"default": 0.9}),
                 "hold_model":  ("BOOLEAN", {"default": True, "label": "Hold model"}),
+                "cache_mode":  (response_cache.CACHE_MODES, {"default": "use"}),
+                **ollama_api.RUNTIME_INPUTS,
+                **ollama_residency.RESIDENCY_INPUTS,
+                **token_budget.BUDGET_INPUTS,
+                **rate_limit.RATE_INPUTS,
+                **retry.RETRY_INPUTS,
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
 
@@ -32,77 +47,96 @@ class OllamaNodeExperimental:
     FUNCTION     = "call_ollama"
     CATEGORY     = "Ollama"
 
-    @staticmethod
-    def _stop_model(ip_port, model_name):
-        url = f"http://{ip_port}/api/stop"
-        headers = {"Content-Type": "application/json"}
-        body = json.dumps({"name": model_name}).encode("utf-8")
-        req = urllib.request.Request(url, data=body, headers=headers, method="POST")
-        try:
-            urllib.request.urlopen(req)
-            logger.info(f"OllamaNode: Stopped model {model_name}")
-        except Exception as e:
-            logger.warning(f"OllamaNode: Failed to stop model {model_name}: {e}")
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return response_cache.is_changed(**kwargs)
 
+    @tracing.traced("OllamaNodeExperimental")
     def call_ollama(self, ip_port, model_name, system_prompt, user_prompt,
-                    max_tokens=1024, temperature=0.7, top_p=0.9, hold_model=True):
-        url = f"http://{ip_port}/v1/chat/completions"
+                    max_tokens=1024, temperature=0.7, top_p=0.9, hold_model=True,
+                    cache_mode="use", keep_alive="5m", num_ctx=0, num_batch=0,
+                    num_thread=0, num_gpu=-1, max_resident=0,
+                    truncate="off", max_prompt_tokens=0,
+                    rpm=0, tpm=0,
+                    max_attempts=3, connect_timeout=10.0, read_timeout=120.0, deadline=300.0,
+                    unique_id=None):
+        # Нативный /api/chat: в отличие от /v1/chat/completions он учитывает options и keep_alive
+        path = "/api/chat"
         headers = {
             "Content-Type":  "application/json",
         }
+        # Ollama молча отбрасывает начало промпта, не влезающее в num_ctx, — решаем сами, что оставить
+        try:
+            user_prompt = token_budget.fit_prompt(
+                system_prompt, user_prompt,
+                token_budget.ollama_limit(num_ctx, max_prompt_tokens, max_tokens), truncate,
+                "OllamaExperimental")
+        except token_budget.PromptTooLong as e:
+            return (f"Error: {e}",)
+
         payload = {
             "model":    model_name,
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user",   "content": user_prompt}
             ],
-            "options": {
-                "num_predict": max_tokens,
-                "temperature": temperature,
-                "top_p":       top_p,
-            }
+            "options": ollama_api.build_options(max_tokens, temperature, top_p,
+                                                num_ctx, num_batch, num_thread, num_gpu),
         }
-        if not hold_model:
-            payload["options"]["keep_alive"] = 0
-        data = json.dumps(payload).encode("utf-8")
-
-        for attempt in range(1, 4):
-            logger.info(
-                f"OllamaExperimental: Attempt {attempt}/3 "
-                f"(max_tokens={max_tokens}, temperature={temperature}, top_p={top_p})"
-            )
-            logger.debug(f"OllamaNode: POST {url} (payload {len(data)} bytes)")
-
-            req = urllib.request.Request(url, data=data, headers=headers, method="POST")
-            try:
-                with urllib.request.urlopen(req) as resp:
-                    status = getattr(resp, "status", resp.getcode())
-                    logger.info(f"OllamaNode: HTTP {status}")
 
-                    raw = resp.read().decode("utf-8")
-                    logger.debug(f"OllamaNode: Raw response: {raw}")
+        cache_key = response_cache.make_key(f"http://{ip_port}{path}", payload)
+        cached = response_cache.lookup(cache_key, cache_mode)
+        if cached is not None:
+            return (cached,)
+
+        payload["stream"] = True
+        keep_alive = ollama_api.keep_alive_value(keep_alive)
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        with tracing.span("serialize"):
+            data = json.dumps(payload).encode("utf-8")
 
-                    resp_json = json.loads(raw)
-                    content = resp_json["choices"][0]["message"]["content"]
-                    logger.info(f"OllamaNode: Got content length={len(content)}")
-                    return (content,)
+        policy = retry.policy_from_inputs(max_attempts, connect_timeout, read_timeout, deadline)
 
-            except urllib.error.HTTPError as e:
-                err = f"HTTPError {e.code}: {e.reason}"
-                logger.warning(f"OllamaNode: {err} on attempt {attempt}")
-                if attempt == 3:
-                    return (f"Error: {err}",)
+        tokens = rate_limit.estimate_tokens(payload)
 
-            except Exception as e:
-                logger.warning(f"OllamaNode: Exception on attempt {attempt}: {e}", exc_info=True)
-                if attempt == 3:
-                    return (f"Error: {e}",)
+        def send(attempt, timeout):
+            with ollama_balancer.acquire(ip_port, model_name) as host:
+                ollama_residency.touch(host, model_name, max_resident)
+                url = f"http://{host}{path}"
+                logger.info(
+                    "OllamaExperimental: Attempt %s/%s (max_tokens=%s, temperature=%s, top_p=%s)",
+                    attempt, policy.max_attempts, max_tokens, temperature, top_p,
+                )
+                logger.debug("OllamaNode: POST %s (payload %s bytes)", url, len(data))
+
+                req = urllib.request.Request(url, data=data, headers=headers, method="POST")
+                started = time.perf_counter()
+                limiter = rate_limit.get_limiter(rate_limit.ollama_key(host), rpm, tpm)
+                m = metrics.request("ollama", model_name, len(data), attempt)
+                with m, limiter.urlopen(req, timeout=timeout, tokens=tokens) as resp:
+                    m.first_byte(resp)
+                    status = getattr(resp, "status", resp.getcode())
+                    logger.info("OllamaNode: HTTP %s", status)
 
-            finally:
-                if not hold_model:
-                    self._stop_model(ip_port, model_name)
+                    content, final = streaming.read_ollama_stream(resp, unique_id,
+                                                                  "OllamaExperimental", started,
+                                                                  timeout.expires)
+                    ollama_api.log_timings("OllamaExperimental", final)
+                    m.usage(final)
+                    logger.info("OllamaNode: Got content length=%s", len(content))
+                    return content
+
+        try:
+            # hold_model=False: выгрузка после последнего запроса к модели, а не после каждой попытки
+            with ollama_residency.use(ip_port, model_name, hold_model, max_resident):
+                content = singleflight.do(cache_key,
+                                          lambda: policy.run(send, logger, "OllamaExperimental"))
+        except Exception as e:
+            return (f"Error: {retry.describe_error(e)}",)
 
-        return ("Error: exhausted retries",)
+        response_cache.store(cache_key, content, cache_mode)
+        return (content,)
 
 # Регистрация ноды
 NODE_CLASS_MAPPINGS = {
@@ -0,0 +1,67 @@
+# comfyui_ollama_preload_node.py
+#
+# Прогрев модели Ollama до начала пакета: модель загружается на все хосты
+# из ip_port с заданным keep_alive, так что первый запрос не ждёт загрузки.
+# Выход model_name подключается ко входу model_name следующих нод —
+# это заодно гарантирует, что прогрев выполнится раньше них.
+
+import logging
+
+from . import ollama_api, ollama_balancer, ollama_residency, batching
+
+logger = logging.getLogger("OllamaPreloadNode")
+logger.setLevel(logging.DEBUG)
+
+
+class OllamaPreloadNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "ip_port":    ("STRING", {"multiline": False}),  # e.g. "localhost:11434"
+                "model_name": ("STRING", {"multiline": False}),
+            },
+            "optional": {
+                **ollama_api.RUNTIME_INPUTS,
+                **ollama_residency.RESIDENCY_INPUTS,
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("model_name", "status")
+    FUNCTION     = "preload"
+    CATEGORY     = "Ollama"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # Прогреваем при каждом запуске: модель могла выгрузиться, а keep_alive — истечь
+        return float("nan")
+
+    def preload(self, ip_port, model_name, keep_alive="5m", num_ctx=0, num_batch=0,
+                num_thread=0, num_gpu=-1, max_resident=0):
+        try:
+            hosts = ollama_balancer.parse_endpoints(ip_port)
+        except ValueError as e:
+            return (model_name, f"Error: {e}")
+
+        # Те же runtime-опции, что у запросов: иначе Ollama перезагрузит модель
+        options = ollama_api.runtime_options(num_ctx, num_batch, num_thread, num_gpu)
+        keep_alive = ollama_api.keep_alive_value(keep_alive)
+        residency = ollama_residency.get_residency()
+
+        def load(host):
+            try:
+                seconds = residency.load(host, model_name, keep_alive, options, max_resident)
+                return f"{host}: loaded in {seconds:.1f}s"
+            except Exception as e:
+                logger.warning("OllamaPreload: %s on %s failed: %s", model_name, host, e)
+                return f"{host}: Error: {e}"
+
+        lines = batching.map_ordered(load, hosts, len(hosts))
+        return (model_name, "\n".join(lines))
+
+
+# Регистрация ноды
+NODE_CLASS_MAPPINGS = {
+    "OllamaPreloadNode": OllamaPreloadNode
+}
@@ -3,12 +3,12 @@
 import urllib.request
 import urllib.error
 import json
-import io
-import base64
 import logging
 
-from PIL import Image
-import numpy as np
+from . import (
+    response_cache, image_utils, batching, retry, ollama_balancer, singleflight,
+    rate_limit, metrics, request_body, tracing,
+)
 
 logger = logging.getLogger("OllamaVisionNode")
 logger.setLevel(logging.DEBUG)
@@ -26,56 +26,88 @@ class OllamaVisionNode:
             },
             "optional": {
                 "max_tokens": ("INT", {"default": 1024}),
+                "cache_mode":  (response_cache.CACHE_MODES, {"default": "use"}),
+                "max_concurrency": ("INT", {"default": 2, "min": 1, "max": 64}),
+                **image_utils.ENCODE_INPUTS,
+                **image_utils.MULTI_IMAGE_INPUTS,
+                **image_utils.DEDUP_INPUTS,
+                **rate_limit.RATE_INPUTS,
+                **retry.RETRY_INPUTS,
             }
         }
 
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("response",)
-    FUNCTION     = "call_ollama"
-    CATEGORY     = "Ollama"
-
-    @staticmethod
-    def _to_pil(img):
-        if isinstance(img, Image.Image):
-            return img
-        if hasattr(img, "cpu"):
-            arr = img.cpu().detach().numpy()
-        else:
-            arr = np.array(img)
-        arr = np.squeeze(arr)
-        if np.issubdtype(arr.dtype, np.floating):
-            arr = (arr * 255).clip(0, 255).astype(np.uint8)
-        if arr.ndim == 3 and arr.shape[0] in (1, 3, 4):
-            arr = np.transpose(arr, (1, 2, 0))
-        if arr.ndim == 3:
-            ch = arr.shape[2]
-            mode = {1:"L",3:"RGB",4:"RGBA"}.get(ch)
-            if not mode:
-                raise TypeError(f"Unsupported channels: {ch}")
-        elif arr.ndim == 2:
-            mode = "L"
-        else:
-            raise TypeError(f"Cannot handle shape: {arr.shape}")
-        return Image.fromarray(arr, mode)
-
-    def call_ollama(self, ip_port, model_name, system_prompt, user_prompt, img, max_tokens=1024):
+    RETURN_TYPES   = ("STRING", "STRING")
+    RETURN_NAMES   = ("response", "responses")
+    OUTPUT_IS_LIST = (False, True)
+    FUNCTION       = "call_ollama"
+    CATEGORY       = "Ollama"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return response_cache.is_changed(**kwargs)
+
+    @tracing.traced("OllamaVisionNode")
+    def call_ollama(self, ip_port, model_name, system_prompt, user_prompt, img, max_tokens=1024,
+                    cache_mode="use", max_concurrency=2,
+                    max_side=512, image_format="JPEG", quality=75, target_bytes=0,
+                    images_per_request=1, max_request_bytes=0, img_2=None, img_3=None, img_4=None,
+                    dedup_frames=False, dedup_distance=4,
+                    rpm=0, tpm=0,
+                    max_attempts=3, connect_timeout=10.0, read_timeout=120.0, deadline=300.0):
         try:
-            pil = self._to_pil(img)
+            frames = image_utils.split_frames(
+                [i for i in (img, img_2, img_3, img_4) if i is not None], max_side)
         except Exception as e:
             logger.error("Conversion to PIL failed", exc_info=True)
-            return (f"Error converting image: {e}",)
+            err = f"Error converting image: {e}"
+            return (err, [err])
+
+        # Почти одинаковые кадры (статичная сцена видео) не отправляем
+        index = None
+        if dedup_frames:
+            total = len(frames)
+            frames, index = image_utils.dedup_frames(frames, dedup_distance)
+            logger.info("OllamaVisionNode: %s of %s frame(s) skipped as near-duplicates",
+                        total - len(frames), total)
 
-        pil.thumbnail((512, 512))
-        buf = io.BytesIO()
-        pil.save(buf, format="JPEG", quality=75)
-        data_url = "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode()
-        logger.debug(f"OllamaVisionNode: data_url length={len(data_url)}")
+        policy = retry.policy_from_inputs(max_attempts, connect_timeout, read_timeout, deadline)
+        encoding = (image_format, quality, target_bytes)
+        try:
+            groups = image_utils.group_frames(frames, images_per_request, max_request_bytes, encoding,
+                                              max_concurrency, backend="ollama", model=model_name)
+        except Exception as e:
+            logger.error("OllamaVisionNode Image encoding failed", exc_info=True)
+            err = f"Error encoding image: {e}"
+            return (err, [err])
+        logger.info("OllamaVisionNode: %s frame(s) in %s request(s), max_concurrency=%s",
+                    len(frames), len(groups), max_concurrency)
+        responses = batching.map_ordered(
+            lambda group: self._describe(ip_port, model_name, system_prompt, user_prompt,
+                                         group, encoding, max_tokens, cache_mode,
+                                         policy, (rpm, tpm)),
+            groups, max_concurrency,
+        )
+        if index is not None and images_per_request == 1:
+            # Ответ на каждый исходный кадр: дубликат получает ответ своего кадра-представителя
+            responses = [responses[i] for i in index]
+        return ("\n".join(responses), responses)
+
+    def _describe(self, ip_port, model_name, system_prompt, user_prompt, group, encoding,
+                  max_tokens, cache_mode, policy, rate):
+        # Encode (кадр уменьшается в image_utils, результат кэшируется)
+        try:
+            data_urls = [image_utils.encode(frame, *encoding, backend="ollama", model=model_name).url_blob()
+                         for frame in group]
+        except Exception as e:
+            logger.error("OllamaVisionNode Image encoding failed", exc_info=True)
+            return f"Error encoding image: {e}"
+        logger.debug("OllamaVisionNode: %s image(s), data_url length=%s",
+                     len(data_urls), sum(map(len, data_urls)))
 
         messages = [
             {"role": "system", "content": [{"type":"text","text":system_prompt}]},
-            {"role": "user",   "content": [
-                {"type":"text","text":user_prompt},
-                {"type":"image_url","image_url":{"url":data_url}}
+            {"role": "user",   "content": [{"type":"text","text":user_prompt}] + [
+                {"type":"image_url","image_url":{"url":data_url}} for data_url in data_urls
             ]}
         ]
         payload = {
@@ -83,30 +115,43 @@ class OllamaVisionNode:
             "messages":   messages,
             "max_tokens": max_tokens,
         }
-        body = json.dumps(payload).encode("utf-8")
+        with tracing.span("serialize"):
+            body = request_body.JSONBody(payload)
 
-        url = f"http://{ip_port}/v1/chat/completions"
+        path = "/v1/chat/completions"
         headers = {"Content-Type": "application/json"}
 
-        for attempt in range(1, 4):
-            logger.info(f"OllamaVisionNode: Attempt {attempt}/3 (max_tokens={max_tokens})")
-            req = urllib.request.Request(url, data=body, headers=headers, method="POST")
-            try:
-                with urllib.request.urlopen(req) as resp:
-                    j = json.loads(resp.read().decode("utf-8"))
+        cache_key = response_cache.make_key(f"http://{ip_port}{path}", payload)
+        cached = response_cache.lookup(cache_key, cache_mode)
+        if cached is not None:
+            return cached
+
+        tokens = rate_limit.estimate_tokens(payload)
+
+        def send(attempt, timeout):
+            with ollama_balancer.acquire(ip_port, model_name) as host:
+                url = f"http://{host}{path}"
+                logger.info("OllamaVisionNode: Attempt %s/%s (max_tokens=%s)", attempt, policy.max_attempts, max_tokens)
+                req = urllib.request.Request(url, data=body, headers=headers, method="POST")
+                limiter = rate_limit.get_limiter(rate_limit.ollama_key(host), *rate)
+                m = metrics.request("ollama", model_name, len(body), attempt)
+                with m, limiter.urlopen(req, timeout=timeout, tokens=tokens) as resp:
+                    m.first_byte(resp)
+                    raw = resp.read()
+                    with tracing.span("parse"):
+                        j = json.loads(raw)
+                    m.usage(j.get("usage"))
                     text = j["choices"][0]["message"]["content"]
-                    logger.info(f"OllamaVisionNode: Got content length={len(text)}")
-                    return (text,)
-            except urllib.error.HTTPError as e:
-                err = f"HTTPError {e.code}: {e.reason}"
-                logger.warning(f"OllamaVisionNode: {err} on attempt {attempt}")
-                if attempt == 3:
-                    return (f"Error: {err}",)
-            except Exception as e:
-                logger.warning(f"OllamaVisionNode: Exception on attempt {attempt}: {e}", exc_info=True)
-                if attempt == 3:
-                    return (f"Error: {e}",)
-        return ("Error: exhausted retries",)
+                    logger.info("OllamaVisionNode: Got content length=%s", len(text))
+                    return text
+
+        try:
+            text = singleflight.do(cache_key, lambda: policy.run(send, logger, "OllamaVisionNode"))
+        except Exception as e:
+            return f"Error: {retry.describe_error(e)}"
+
+        response_cache.store(cache_key, text, cache_mode)
+        return text
 
 # Регистрация ноды
 NODE_CLASS_MAPPINGS = {
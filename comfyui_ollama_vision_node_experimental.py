@@ -2,13 +2,13 @@
 
 import urllib.request
 import urllib.error
-import json
-import io
-import base64
 import logging
+import time
 
-from PIL import Image
-import numpy as np
+from . import (
+    response_cache, image_utils, batching, streaming, ollama_api, retry,
+    ollama_balancer, ollama_residency, singleflight, rate_limit, metrics, request_body, tracing,
+)
 
 logger = logging.getLogger("OllamaVisionNodeExperimental")
 logger.setLevel(logging.DEBUG)
@@ -29,112 +29,155 @@ class OllamaVisionNodeExperimental:
                 "temperature": ("FLOAT", {"default": 0.7}),
                 "top_p":       ("FLOAT", {"default": 0.9}),
                 "hold_model":  ("BOOLEAN", {"default": True, "label": "Hold model"}),
+                "cache_mode":  (response_cache.CACHE_MODES, {"default": "use"}),
+                "max_concurrency": ("INT", {"default": 2, "min": 1, "max": 64}),
+                **ollama_api.RUNTIME_INPUTS,
+                **ollama_residency.RESIDENCY_INPUTS,
+                **image_utils.ENCODE_INPUTS,
+                **image_utils.MULTI_IMAGE_INPUTS,
+                **image_utils.DEDUP_INPUTS,
+                **rate_limit.RATE_INPUTS,
+                **retry.RETRY_INPUTS,
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
 
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("response",)
-    FUNCTION     = "call_ollama"
-    CATEGORY     = "Ollama"
-
-    @staticmethod
-    def _to_pil(img):
-        if isinstance(img, Image.Image):
-            return img
-        if hasattr(img, "cpu"):
-            arr = img.cpu().detach().numpy()
-        else:
-            arr = np.array(img)
-        arr = np.squeeze(arr)
-        if np.issubdtype(arr.dtype, np.floating):
-            arr = (arr * 255).clip(0, 255).astype(np.uint8)
-        if arr.ndim == 3 and arr.shape[0] in (1, 3, 4):
-            arr = np.transpose(arr, (1, 2, 0))
-        if arr.ndim == 3:
-            ch = arr.shape[2]
-            mode = {1:"L",3:"RGB",4:"RGBA"}.get(ch)
-            if not mode:
-                raise TypeError(f"Unsupported channels: {ch}")
-        elif arr.ndim == 2:
-            mode = "L"
-        else:
-            raise TypeError(f"Cannot handle shape: {arr.shape}")
-        return Image.fromarray(arr, mode)
-
-    @staticmethod
-    def _stop_model(ip_port, model_name):
-        url = f"http://{ip_port}/api/stop"
-        headers = {"Content-Type": "application/json"}
-        body = json.dumps({"name": model_name}).encode("utf-8")
-        req = urllib.request.Request(url, data=body, headers=headers, method="POST")
-        try:
-            urllib.request.urlopen(req)
-            logger.info(f"OllamaVisionNode: Stopped model {model_name}")
-        except Exception as e:
-            logger.warning(f"OllamaVisionNode: Failed to stop model {model_name}: {e}")
+    RETURN_TYPES   = ("STRING", "STRING")
+    RETURN_NAMES   = ("response", "responses")
+    OUTPUT_IS_LIST = (False, True)
+    FUNCTION       = "call_ollama"
+    CATEGORY       = "Ollama"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return response_cache.is_changed(**kwargs)
 
+    @tracing.traced("OllamaVisionNodeExperimental")
     def call_ollama(self, ip_port, model_name, system_prompt, user_prompt, img,
-                    max_tokens=1024, temperature=0.7, top_p=0.9, hold_model=True):
+                    max_tokens=1024, temperature=0.7, top_p=0.9, hold_model=True,
+                    cache_mode="use", max_concurrency=2, keep_alive="5m", num_ctx=0,
+                    num_batch=0, num_thread=0, num_gpu=-1, max_resident=0,
+                    max_side=512, image_format="JPEG", quality=75, target_bytes=0,
+                    images_per_request=1, max_request_bytes=0, img_2=None, img_3=None, img_4=None,
+                    dedup_frames=False, dedup_distance=4,
+                    rpm=0, tpm=0,
+                    max_attempts=3, connect_timeout=10.0, read_timeout=120.0, deadline=300.0,
+                    unique_id=None):
         try:
-            pil = self._to_pil(img)
+            frames = image_utils.split_frames(
+                [i for i in (img, img_2, img_3, img_4) if i is not None], max_side)
         except Exception as e:
             logger.error("Conversion to PIL failed", exc_info=True)
-            return (f"Error converting image: {e}",)
+            err = f"Error converting image: {e}"
+            return (err, [err])
 
-        pil.thumbnail((512, 512))
-        buf = io.BytesIO()
-        pil.save(buf, format="JPEG", quality=75)
-        data_url = "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode()
-        logger.debug(f"OllamaVisionNode: data_url length={len(data_url)}")
+        # Почти одинаковые кадры (статичная сцена видео) не отправляем
+        index = None
+        if dedup_frames:
+            total = len(frames)
+            frames, index = image_utils.dedup_frames(frames, dedup_distance)
+            logger.info("OllamaVisionExperimental: %s of %s frame(s) skipped as near-duplicates",
+                        total - len(frames), total)
+
+        options = ollama_api.build_options(max_tokens, temperature, top_p,
+                                           num_ctx, num_batch, num_thread, num_gpu)
+        keep_alive = ollama_api.keep_alive_value(keep_alive)
+
+        policy = retry.policy_from_inputs(max_attempts, connect_timeout, read_timeout, deadline)
+        encoding = (image_format, quality, target_bytes)
+        try:
+            groups = image_utils.group_frames(frames, images_per_request, max_request_bytes, encoding,
+                                              max_concurrency, backend="ollama", model=model_name)
+        except Exception as e:
+            logger.error("OllamaVisionExperimental: Image encoding failed", exc_info=True)
+            err = f"Error encoding image: {e}"
+            return (err, [err])
+        logger.info("OllamaVisionExperimental: %s frame(s) in %s request(s), max_concurrency=%s",
+                    len(frames), len(groups), max_concurrency)
+        # hold_model=False: модель выгружается после последнего кадра, а не после каждого запроса
+        with ollama_residency.use(ip_port, model_name, hold_model, max_resident):
+            responses = batching.map_ordered(
+                lambda group: self._describe(ip_port, model_name, system_prompt, user_prompt, group,
+                                             encoding, options, keep_alive, max_resident, cache_mode,
+                                             unique_id, policy, (rpm, tpm)),
+                groups, max_concurrency,
+            )
+        if index is not None and images_per_request == 1:
+            # Ответ на каждый исходный кадр: дубликат получает ответ своего кадра-представителя
+            responses = [responses[i] for i in index]
+        return ("\n".join(responses), responses)
+
+    def _describe(self, ip_port, model_name, system_prompt, user_prompt, group, encoding,
+                  options, keep_alive, max_resident, cache_mode, unique_id, policy, rate):
+        try:
+            # /api/chat принимает картинки как base64 без префикса data URL
+            images_b64 = [image_utils.encode(frame, *encoding, backend="ollama", model=model_name).b64_blob()
+                          for frame in group]
+        except Exception as e:
+            logger.error("OllamaVisionExperimental: Image encoding failed", exc_info=True)
+            return f"Error encoding image: {e}"
+        logger.debug("OllamaVisionNode: %s image(s), base64 length=%s",
+                     len(images_b64), sum(map(len, images_b64)))
 
         messages = [
-            {"role": "system", "content": [{"type":"text","text":system_prompt}]},
-            {"role": "user",   "content": [
-                {"type":"text","text":user_prompt},
-                {"type":"image_url","image_url":{"url":data_url}}
-            ]}
+            {"role": "system", "content": system_prompt},
+            {"role": "user",   "content": user_prompt, "images": images_b64},
         ]
         payload = {
-            "model":      model_name,
-            "messages":   messages,
-            "options": {
-                "num_predict": max_tokens,
-                "temperature": temperature,
-                "top_p":       top_p,
-            }
+            "model":    model_name,
+            "messages": messages,
+            "options":  options,
         }
-        if not hold_model:
-            payload["options"]["keep_alive"] = 0
-        body = json.dumps(payload).encode("utf-8")
 
-        url = f"http://{ip_port}/v1/chat/completions"
+        path = "/api/chat"
         headers = {"Content-Type": "application/json"}
 
-        for attempt in range(1, 4):
-            logger.info(
-                f"OllamaVisionExperimental: Attempt {attempt}/3 "
-                f"(max_tokens={max_tokens}, temperature={temperature}, top_p={top_p})"
-            )
-            req = urllib.request.Request(url, data=body, headers=headers, method="POST")
-            try:
-                with urllib.request.urlopen(req) as resp:
-                    j = json.loads(resp.read().decode("utf-8"))
-                    text = j["choices"][0]["message"]["content"]
-                    logger.info(f"OllamaVisionNode: Got content length={len(text)}")
-                    return (text,)
-            except urllib.error.HTTPError as e:
-                err = f"HTTPError {e.code}: {e.reason}"
-                logger.warning(f"OllamaVisionNode: {err} on attempt {attempt}")
-                if attempt == 3:
-                    return (f"Error: {err}",)
-            except Exception as e:
-                logger.warning(f"OllamaVisionNode: Exception on attempt {attempt}: {e}", exc_info=True)
-                if attempt == 3:
-                    return (f"Error: {e}",)
-            finally:
-                if not hold_model:
-                    self._stop_model(ip_port, model_name)
-        return ("Error: exhausted retries",)
+        cache_key = response_cache.make_key(f"http://{ip_port}{path}", payload)
+        cached = response_cache.lookup(cache_key, cache_mode)
+        if cached is not None:
+            return cached
+
+        payload["stream"] = True
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        with tracing.span("serialize"):
+            body = request_body.JSONBody(payload)
+
+        tokens = rate_limit.estimate_tokens(payload)
+
+        def send(attempt, timeout):
+            with ollama_balancer.acquire(ip_port, model_name) as host:
+                ollama_residency.touch(host, model_name, max_resident)
+                url = f"http://{host}{path}"
+                logger.info(
+                    "OllamaVisionExperimental: Attempt %s/%s (max_tokens=%s, temperature=%s, top_p=%s)",
+                    attempt, policy.max_attempts, options["num_predict"], options["temperature"],
+                    options["top_p"],
+                )
+                req = urllib.request.Request(url, data=body, headers=headers, method="POST")
+                started = time.perf_counter()
+                limiter = rate_limit.get_limiter(rate_limit.ollama_key(host), *rate)
+                m = metrics.request("ollama", model_name, len(body), attempt)
+                with m, limiter.urlopen(req, timeout=timeout, tokens=tokens) as resp:
+                    m.first_byte(resp)
+                    text, final = streaming.read_ollama_stream(resp, unique_id,
+                                                               "OllamaVisionExperimental", started,
+                                                               timeout.expires)
+                    ollama_api.log_timings("OllamaVisionExperimental", final)
+                    m.usage(final)
+                    logger.info("OllamaVisionNode: Got content length=%s", len(text))
+                    return text
+
+        try:
+            text = singleflight.do(cache_key, lambda: policy.run(
+                send, logger, "OllamaVisionExperimental"))
+        except Exception as e:
+            return f"Error: {retry.describe_error(e)}"
+
+        response_cache.store(cache_key, text, cache_mode)
+        return text
 
 # Регистрация ноды
 NODE_CLASS_MAPPINGS = {
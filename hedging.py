@@ -0,0 +1,153 @@
+# hedging.py
+#
+# Цепочка запасных моделей и hedged-запросы для OpenRouter.
+# Модели пробуются по порядку: следующая запускается, если предыдущая
+# упала с ошибкой, или (hedging) если она отвечает дольше порога —
+# тогда запрос дублируется и берётся первый успешный ответ,
+# остальные запросы обрываются.
+#
+# Порог — заданный percentile наблюдаемой задержки модели, пока истории
+# мало — hedge_after секунд.
+
+import logging
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+from . import http_pool, retry, tracing
+
+logger = logging.getLogger("Hedging")
+logger.setLevel(logging.DEBUG)
+
+WINDOW = 200        # последних задержек на модель
+MIN_SAMPLES = 20    # меньше — используем hedge_after как есть
+
+# Опциональные входы OpenRouter-нод
+HEDGE_INPUTS = {
+    # по одной модели на строку, пробуются по порядку после model_name
+    "fallback_models":  ("STRING",  {"multiline": True, "default": ""}),
+    # 0 — без дублирования, запасные модели только при ошибке
+    "hedge_after":      ("FLOAT",   {"default": 0.0, "min": 0.0, "max": 600.0, "step": 0.5}),
+    "hedge_percentile": ("FLOAT",   {"default": 95.0, "min": 50.0, "max": 99.9, "step": 0.5}),
+    # отдать цепочку OpenRouter (поле "models") вместо перебора на клиенте
+    "server_fallback":  ("BOOLEAN", {"default": False}),
+}
+
+
+def parse_models(model_name, fallback_models):
+    """model_name followed by the unique non-empty lines (or commas) of fallback_models."""
+    models = [model_name.strip()]
+    for line in (fallback_models or "").replace(",", "\n").splitlines():
+        line = line.strip()
+        if line and line not in models:
+            models.append(line)
+    return models
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per model."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = self._samples[model] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, model, p):
+        with self._lock:
+            samples = sorted(self._samples.get(model) or ())
+        if len(samples) < MIN_SAMPLES:
+            return None
+        idx = min(len(samples) - 1, max(0, math.ceil(p / 100.0 * len(samples)) - 1))
+        return samples[idx]
+
+
+_TRACKER = LatencyTracker()
+
+
+def get_tracker():
+    return _TRACKER
+
+
+def hedge_delay(model, hedge_after, percentile):
+    """Seconds to wait for `model` before hedging, or None when hedging is off."""
+    if not hedge_after or hedge_after <= 0:
+        return None
+    observed = _TRACKER.percentile(model, percentile)
+    return hedge_after if observed is None else observed
+
+
+def run(models, call, hedge_after=0.0, percentile=95.0, label="Hedge"):
+    """Run call(model, cancel) over the fallback chain; return the first successful result.
+
+    `cancel` is an http_pool.CancelToken the call must pass to urlopen so a
+    losing request can be aborted. Raises the last error if every model fails.
+    """
+    if len(models) == 1:
+        return call(models[0], None)
+
+    results = queue.Queue()
+    tokens = []
+    launched_at = []
+
+    def branch(i, model, token):
+        started = time.monotonic()
+        try:
+            with tracing.span("hedge_branch", model=model, branch=i):
+                value = call(model, token)
+        except BaseException as e:
+            results.put((i, None, e))
+            return
+        _TRACKER.record(model, time.monotonic() - started)
+        results.put((i, value, None))
+
+    def launch():
+        i = len(tokens)
+        token = http_pool.CancelToken()
+        tokens.append(token)
+        launched_at.append(time.monotonic())
+        threading.Thread(target=tracing.bind(branch), args=(i, models[i], token),
+                         name="llm-hedge", daemon=True).start()
+
+    launch()
+    pending = 1
+    last_error = None
+    try:
+        while pending:
+            timeout = None
+            if len(tokens) < len(models):
+                delay = hedge_delay(models[len(tokens) - 1], hedge_after, percentile)
+                if delay is not None:
+                    timeout = max(0.0, launched_at[-1] + delay - time.monotonic())
+            try:
+                i, value, err = results.get(timeout=timeout)
+            except queue.Empty:
+                logger.info("%s: %s slower than %.1fs, hedging with %s",
+                            label, models[len(tokens) - 1], delay, models[len(tokens)])
+                launch()
+                pending += 1
+                continue
+            pending -= 1
+            if err is None:
+                if i > 0:
+                    logger.info("%s: answered by fallback model %s", label, models[i])
+                return value
+            last_error = err
+            if len(tokens) < len(models):
+                logger.warning("%s: %s failed (%s), falling back to %s",
+                               label, models[i], retry.describe_error(err), models[len(tokens)])
+                launch()
+                pending += 1
+        raise last_error
+    finally:
+        # Проигравшие запросы обрываем, чтобы не занимать соединения и токены
+        for token in tokens:
+            token.cancel()
@@ -0,0 +1,357 @@
+# http_pool.py
+#
+# Общий пул keep-alive соединений для всех нод.
+# urllib.request.urlopen открывает новое соединение на каждый вызов
+# (DNS + TCP + TLS), здесь же соединения переиспользуются между попытками,
+# нодами и промптами в очереди.
+
+import gzip
+import http.client
+import io
+import logging
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from . import request_body, tracing
+
+logger = logging.getLogger("HTTPPool")
+logger.setLevel(logging.DEBUG)
+
+MAX_IDLE_PER_HOST = 8
+IDLE_TIMEOUT = 60.0
+DRAIN_BYTES = 64 * 1024   # столько хвоста ответа дочитываем при close, чтобы сохранить соединение
+DRAIN_TIMEOUT = 0.25
+
+# Ошибки, которые означают, что сервер закрыл простаивающее keep-alive
+# соединение: запрос безопасно повторить на свежем соединении.
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """Lets another thread abort the request bound to it (e.g. the loser of a hedge)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.cancelled = False
+
+    def bind(self, conn):
+        with self._lock:
+            if self.cancelled:
+                raise RequestCancelled("request cancelled")
+            self._conn = conn
+
+    def unbind(self):
+        with self._lock:
+            self._conn = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            conn, self._conn = self._conn, None
+        # shutdown() будит поток, заблокированный в recv() на этом сокете
+        sock = getattr(conn, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def _split_timeout(timeout):
+    """timeout may be a number or a (connect, read) pair."""
+    if isinstance(timeout, tuple):
+        return timeout
+    return timeout, timeout
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    read_timeout = None
+
+    def connect(self):
+        with tracing.span("connect", host=self.host):
+            super().connect()
+        # Заголовки и тело уходят отдельными send(): без TCP_NODELAY
+        # Nagle + delayed ACK добавляют ~40 мс к каждому запросу.
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(self.read_timeout)
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    read_timeout = None
+
+    def connect(self):
+        # Включает TLS-рукопожатие
+        with tracing.span("connect", host=self.host):
+            super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(self.read_timeout)
+
+
+class PooledResponse:
+    """Response wrapper that hands its connection back to the pool on close."""
+
+    def __init__(self, pool, key, conn, resp, url, cancel=None):
+        self.status  = resp.status
+        self.reason  = resp.reason
+        self.headers = resp.headers
+        self.url     = url
+        self._pool   = pool
+        self._key    = key
+        self._conn   = conn
+        self._raw    = resp
+        self._cancel = cancel
+        self._finished  = False
+        self._abandoned = False
+        if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+            self._fp = gzip.GzipFile(fileobj=resp)
+        else:
+            self._fp = resp
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self._raw.getheader(name, default)
+
+    def read(self, amt=None):
+        if amt is None:
+            with tracing.span("read_body") as span:
+                data = self._fp.read()
+                span.set(bytes=len(data))
+            return data
+        return self._fp.read(amt)
+
+    def readline(self):
+        return self._fp.readline()
+
+    def __iter__(self):
+        while True:
+            line = self._fp.readline()
+            if not line:
+                return
+            yield line
+
+    def clip_read_timeout(self, seconds):
+        """Wait at most `seconds` in the following reads (stream readers: what is left of the deadline)."""
+        conn = self._conn
+        if conn is not None and conn.sock is not None:
+            if conn.read_timeout is not None:
+                seconds = min(seconds, conn.read_timeout)
+            conn.sock.settimeout(seconds)
+
+    def mark_finished(self):
+        """The reader saw the end-of-response event ([DONE], "done": true)."""
+        self._finished = True
+
+    def abandon(self):
+        """The reader stopped before the end; close() drops the connection without draining."""
+        self._abandoned = True
+
+    def _drain(self, conn):
+        # Потоковые читатели останавливаются на событии "done" / [DONE], а в сокете
+        # остаётся завершающий chunk: дочитываем короткий хвост, а не рвём соединение.
+        # Только после конца ответа: иначе сервер ещё генерирует, и мы дочитывали бы
+        # его поток вместо того, чтобы закрыть соединение и остановить генерацию
+        raw = self._raw
+        if raw.will_close or (not raw.chunked and (raw.length or 0) > DRAIN_BYTES):
+            return
+        try:
+            if conn.sock is not None:
+                conn.sock.settimeout(DRAIN_TIMEOUT)
+            total = 0
+            while not raw.isclosed() and total <= DRAIN_BYTES:
+                data = raw.read(8192)
+                if not data:
+                    break
+                total += len(data)
+        except (OSError, http.client.HTTPException):
+            pass
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        cancelled = False
+        if self._cancel is not None:
+            self._cancel.unbind()
+            cancelled = self._cancel.cancelled
+        if not cancelled and self._finished and not self._abandoned and not self._raw.isclosed():
+            self._drain(conn)
+        # Соединение можно вернуть в пул только если тело прочитано целиком,
+        # иначе в сокете останутся хвосты ответа.
+        if self._raw.isclosed() and not self._raw.will_close and not cancelled:
+            self._pool._release(self._key, conn)
+        else:
+            self._raw.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTTPPool:
+    """Thread-safe pool of http.client connections keyed by (scheme, host, port)."""
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+        self.created = 0
+        self.reused = 0
+
+    def _get_ssl_context(self):
+        # Загрузка системных сертификатов — десятки мс, не тратим их при импорте пакета
+        with self._lock:
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return self._ssl_context
+
+    def _acquire(self, key, timeout):
+        connect_timeout, read_timeout = _split_timeout(timeout)
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout and conn.sock is not None:
+                    self.reused += 1
+                    conn.read_timeout = read_timeout
+                    conn.sock.settimeout(read_timeout)
+                    return conn, True
+                conn.close()
+            self.created += 1
+
+        scheme, host, port = key
+        if scheme == "https":
+            conn = _HTTPSConnection(host, port, timeout=connect_timeout,
+                                    context=self._get_ssl_context())
+        else:
+            conn = _HTTPConnection(host, port, timeout=connect_timeout)
+        conn.read_timeout = read_timeout
+        return conn, False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            for conn, _ in idle:
+                conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=None, cancel=None):
+        """Send a request; `timeout` is seconds or a (connect, read) pair.
+
+        `cancel` is an optional CancelToken that aborts the request from another thread.
+        """
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {url}")
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        hdrs = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        hdrs.update(headers or {})
+        if isinstance(body, request_body.JSONBody):
+            # Куски тела уходят в сокет по очереди, длина известна заранее
+            hdrs["Content-Length"] = str(len(body))
+
+        while True:
+            conn, reused = self._acquire(key, timeout)
+            try:
+                if cancel is not None:
+                    cancel.bind(conn)
+                with tracing.span("send", bytes=len(body or b""), reused=reused):
+                    conn.request(method, path, body=body, headers=hdrs)
+                # От отправки тела до заголовков ответа — время обработки на сервере
+                with tracing.span("ttfb"):
+                    resp = conn.getresponse()
+            except _STALE_ERRORS:
+                conn.close()
+                if cancel is not None and cancel.cancelled:
+                    raise RequestCancelled("request cancelled")
+                if reused:
+                    logger.debug("HTTPPool: stale connection to %s:%s, reconnecting", key[1], key[2])
+                    continue
+                raise
+            except BaseException as e:
+                conn.close()
+                if cancel is not None and cancel.cancelled and not isinstance(e, RequestCancelled):
+                    raise RequestCancelled("request cancelled") from e
+                raise
+            break
+
+        pooled = PooledResponse(self, key, conn, resp, url, cancel)
+        if pooled.status >= 400:
+            # Тело ошибки читаем сразу, чтобы соединение вернулось в пул.
+            try:
+                err_body = pooled.read()
+            finally:
+                pooled.close()
+            raise urllib.error.HTTPError(url, pooled.status, pooled.reason,
+                                         pooled.headers, io.BytesIO(err_body))
+        return pooled
+
+    def urlopen(self, req, timeout=None, cancel=None):
+        """Drop-in replacement for urllib.request.urlopen(req)."""
+        if isinstance(req, str):
+            req = urllib.request.Request(req)
+        # Через прокси http.client не ходит — оставляем это urllib.
+        if _proxy_for(req.full_url):
+            if timeout is None:
+                return urllib.request.urlopen(req)
+            return urllib.request.urlopen(req, timeout=max(_split_timeout(timeout)))
+        return self.request(req.get_method(), req.full_url, body=req.data,
+                            headers=dict(req.header_items()), timeout=timeout, cancel=cancel)
+
+
+def _proxy_for(url):
+    parts = urllib.parse.urlsplit(url)
+    proxies = urllib.request.getproxies()
+    if parts.scheme not in proxies:
+        return None
+    if urllib.request.proxy_bypass(parts.hostname or ""):
+        return None
+    return proxies[parts.scheme]
+
+
+_POOL = HTTPPool()
+
+
+def get_pool():
+    return _POOL
+
+
+def urlopen(req, timeout=None, cancel=None):
+    return _POOL.urlopen(req, timeout=timeout, cancel=cancel)
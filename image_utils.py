@@ -0,0 +1,483 @@
+# image_utils.py
+#
+# Общая подготовка IMAGE для vision-нод.
+# Сначала уменьшаем (целочисленным усреднением блоков прямо на тензоре,
+# для torch — на его устройстве и сразу для всего батча), и только потом
+# переводим float -> uint8 и отдаём в PIL. Так полноразмерный кадр не
+# копируется трижды, как при (arr * 255).clip(0, 255).astype(np.uint8).
+#
+# Закодированные картинки (base64) кэшируются в памяти по быстрому хэшу
+# исходного кадра: один и тот же кадр в нескольких нодах или при повторном
+# запуске кодируется один раз.
+#
+# PIL и NumPy импортируются при первом кадре, а не при загрузке пакета:
+# текстовым нодам они не нужны, а старт ComfyUI от них заметно медленнее.
+
+import base64
+import io
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from . import batching, metrics, request_body, tracing
+
+DEFAULT_MAX_SIDE = 512
+
+IMAGE_FORMATS = ["JPEG", "WEBP", "PNG"]
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+MIN_QUALITY = 20
+MIN_SIDE = 64
+ENCODED_CACHE_BYTES = 64 * 1024 * 1024
+
+# Опциональные входы vision-нод
+ENCODE_INPUTS = {
+    "max_side":     ("INT", {"default": DEFAULT_MAX_SIDE, "min": 0, "max": 8192, "step": 8}),
+    "image_format": (IMAGE_FORMATS, {"default": "JPEG"}),
+    "quality":      ("INT", {"default": 75, "min": 1, "max": 100}),
+    # 0 — без лимита; иначе подбираются качество/размер под размер base64 в байтах
+    "target_bytes": ("INT", {"default": 0, "min": 0, "max": 50_000_000, "step": 1024}),
+}
+
+# Несколько картинок в одном сообщении: дополнительные входы и кадры батча
+# упаковываются в как можно меньше запросов (system и текст уходят один раз)
+MULTI_IMAGE_INPUTS = {
+    # 1 — запрос на каждый кадр; N — до N кадров в запросе; 0 — без ограничения
+    "images_per_request": ("INT", {"default": 1, "min": 0, "max": 64}),
+    # лимит суммарного base64 картинок в запросе; 0 — без лимита
+    "max_request_bytes":  ("INT", {"default": 0, "min": 0, "max": 200_000_000, "step": 1024}),
+    "img_2": ("IMAGE", {}),
+    "img_3": ("IMAGE", {}),
+    "img_4": ("IMAGE", {}),
+}
+
+# Пропуск почти одинаковых кадров (кадры видео): кадр, чей перцептивный хэш
+# отличается от уже отправленного не больше чем на dedup_distance бит из 64,
+# не отправляется — ему достаётся ответ того кадра
+DEDUP_INPUTS = {
+    "dedup_frames":   ("BOOLEAN", {"default": False}),
+    "dedup_distance": ("INT", {"default": 4, "min": 0, "max": 32}),
+}
+
+HASH_SIDE = 8        # dHash: 8x9 серых пикселей -> 64 бита
+HASH_SOURCE = 64     # до хэша кадр прореживается примерно до этой стороны
+
+_CHANNELS = (1, 3, 4)
+_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+
+def _layout(shape):
+    """Guess the axis layout; channels-last wins, as in ComfyUI IMAGE (B,H,W,C)."""
+    nd = len(shape)
+    if nd == 4:
+        if shape[-1] in _CHANNELS:
+            return "BHWC"
+        if shape[1] in _CHANNELS:
+            return "BCHW"
+    elif nd == 3:
+        if shape[-1] in _CHANNELS:
+            return "HWC"
+        if shape[0] in _CHANNELS:
+            return "CHW"
+        return "BHW"  # MASK-like батч
+    elif nd == 2:
+        return "HW"
+    raise TypeError(f"Cannot handle shape: {tuple(shape)}")
+
+
+def _is_pil(obj):
+    # Если PIL ещё не импортирован, obj заведомо не PIL.Image — не импортируем ради проверки.
+    # Модуль может быть в sys.modules недоимпортированным (импорт идёт в другом потоке):
+    # пока класса нет, экземпляров тоже нет.
+    cls = getattr(sys.modules.get("PIL.Image"), "Image", None)
+    return cls is not None and isinstance(obj, cls)
+
+
+def _permute(x, axes):
+    return x.permute(*axes) if hasattr(x, "permute") else x.transpose(axes)
+
+
+def _as_bhwc(x):
+    """View of x as (B,H,W,C) without copying (numpy array or torch tensor)."""
+    layout = _layout(tuple(x.shape))
+    if layout == "BCHW":
+        return _permute(x, (0, 2, 3, 1))
+    if layout == "HWC":
+        return x[None]
+    if layout == "CHW":
+        return _permute(x, (1, 2, 0))[None]
+    if layout == "BHW":
+        return x[..., None]
+    if layout == "HW":
+        return x[None, ..., None]
+    return x
+
+
+def _reduce_factor(h, w, max_side):
+    if not max_side or max_side <= 0:
+        return 1
+    return max(1, max(h, w) // max_side)
+
+
+def _block_mean(frame, k):
+    """Area downsample of an (H,W,C) ndarray by an integer factor; returns float32."""
+    import numpy as np
+
+    h, w, c = frame.shape
+    h2, w2 = h // k * k, w // k * k
+    # Сначала по строкам: срез по первой оси остаётся view, копируется уже 1/k данных
+    rows = frame[:h2].reshape(h2 // k, k, w, c).mean(axis=1, dtype=np.float32)
+    return rows[:, :w2].reshape(h2 // k, w2 // k, k, c).mean(axis=2, dtype=np.float32)
+
+
+def _to_uint8(arr, owned=False):
+    """float [0,1] -> uint8 in one scratch buffer (or in place if `owned`)."""
+    import numpy as np
+
+    if arr.dtype == np.uint8:
+        return arr
+    if np.issubdtype(arr.dtype, np.floating):
+        if owned and arr.dtype == np.float32:
+            np.multiply(arr, 255, out=arr)
+            tmp = arr
+        else:
+            tmp = np.multiply(arr, 255, dtype=np.float32)
+        np.clip(tmp, 0, 255, out=tmp)
+        return tmp.astype(np.uint8)
+    return np.clip(arr, 0, 255).astype(np.uint8)
+
+
+def _frame_to_pil(frame, max_side):
+    """(H,W,C) ndarray -> PIL.Image no larger than max_side."""
+    import numpy as np
+    from PIL import Image
+
+    owned = False
+    k = _reduce_factor(frame.shape[0], frame.shape[1], max_side)
+    if k > 1:
+        with tracing.span("resize", method="block_mean", factor=k):
+            frame = _block_mean(frame, k)
+        owned = True
+    with tracing.span("to_pil"):
+        arr = _to_uint8(frame, owned)
+        ch = arr.shape[2]
+        mode = _MODES.get(ch)
+        if mode is None:
+            raise TypeError(f"Unsupported channels: {ch}")
+        if ch == 1:
+            arr = arr[:, :, 0]
+        pil = Image.fromarray(np.ascontiguousarray(arr), mode)
+    if max_side and max_side > 0:
+        with tracing.span("resize", method="thumbnail"):
+            pil.thumbnail((max_side, max_side))
+    return pil
+
+
+def _pil_fit(img, max_side):
+    if max_side and max(img.size) > max_side:
+        img = img.copy()
+        img.thumbnail((max_side, max_side))
+    return img
+
+
+def _bin_matrix(n, bins):
+    """(bins, n) matrix that averages n samples into `bins` equal groups (n >= bins)."""
+    import numpy as np
+
+    groups = np.arange(n) * bins // n
+    m = (groups[None, :] == np.arange(bins)[:, None]).astype(np.float32)
+    return m / m.sum(axis=1, keepdims=True)
+
+
+def _dhash(arr):
+    """64-bit difference hash of an (H,W,C) ndarray as a bool vector."""
+    import numpy as np
+
+    h, w = arr.shape[:2]
+    step = max(1, min(h, w) // HASH_SOURCE)
+    small = arr[::step, ::step]
+    if small.shape[2] >= 3:
+        gray = small[..., :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], np.float32)
+    else:
+        gray = small[..., 0].astype(np.float32)
+    # Крошечный кадр растягиваем, чтобы в каждой ячейке был хоть один пиксель
+    gray = np.repeat(np.repeat(gray, -(-(HASH_SIDE + 1) // gray.shape[0]), axis=0),
+                     -(-(HASH_SIDE + 1) // gray.shape[1]), axis=1)
+    cells = _bin_matrix(gray.shape[0], HASH_SIDE) @ gray @ _bin_matrix(gray.shape[1], HASH_SIDE + 1).T
+    return (cells[:, 1:] > cells[:, :-1]).ravel()
+
+
+def _checksum(arr):
+    """Fast content fingerprint of an ndarray (crc32 releases the GIL on big buffers)."""
+    import numpy as np
+
+    arr = np.ascontiguousarray(arr)
+    return (arr.shape, arr.dtype.str, zlib.crc32(memoryview(arr).cast("B")))
+
+
+class Frame:
+    """One frame of an IMAGE input, converted to PIL lazily."""
+
+    def __init__(self, source, max_side):
+        self.source = source
+        self.max_side = max_side
+        self._fingerprint = None
+        self._phash = None
+
+    def phash(self):
+        """Perceptual hash (dHash) for near-duplicate detection, cached."""
+        if self._phash is None:
+            with tracing.span("phash"):
+                if _is_pil(self.source):
+                    import numpy as np
+                    self._phash = _dhash(np.asarray(self.source.convert("L"))[:, :, None])
+                else:
+                    self._phash = _dhash(self.source)
+        return self._phash
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            if _is_pil(self.source):
+                self._fingerprint = (self.source.size, self.source.mode,
+                                     zlib.crc32(self.source.tobytes()))
+            else:
+                self._fingerprint = _checksum(self.source)
+        return self._fingerprint
+
+    def pil(self):
+        if _is_pil(self.source):
+            return _pil_fit(self.source, self.max_side)
+        return _frame_to_pil(self.source, self.max_side)
+
+
+def _torch_frames(t, max_side):
+    """Downsample a torch batch on its own device, then hand numpy frames over."""
+    import torch.nn.functional as F
+
+    t = _as_bhwc(t.detach())
+    k = _reduce_factor(t.shape[1], t.shape[2], max_side)
+    if k > 1:
+        with tracing.span("resize", method="avg_pool2d", factor=k):
+            if not t.is_floating_point():
+                t = t.float()
+            t = F.avg_pool2d(t.permute(0, 3, 1, 2), k).permute(0, 2, 3, 1)
+    # Уменьшение уже сделано — дальше только конвертация и точный thumbnail
+    with tracing.span("tensor_to_numpy", device=str(t.device)):
+        return list(t.cpu().numpy())
+
+
+def split_frames(img, max_side=DEFAULT_MAX_SIDE):
+    """Split an IMAGE (batch, CHW/HWC tensor or ndarray), PIL.Image or list into Frames."""
+    if _is_pil(img):
+        return [Frame(img, max_side)]
+    if isinstance(img, (list, tuple)):
+        out = []
+        for item in img:
+            out.extend(split_frames(item, max_side))
+        return out
+    if hasattr(img, "detach"):
+        return [Frame(frame, max_side) for frame in _torch_frames(img, max_side)]
+    import numpy as np
+
+    arr = _as_bhwc(np.asarray(img))
+    return [Frame(frame, max_side) for frame in arr]
+
+
+def group_frames(frames, images_per_request=1, max_request_bytes=0, encoding=("JPEG", 75, 0),
+                 max_concurrency=1, backend="", model=""):
+    """Frames packed into as few requests as the count and byte caps allow (order kept).
+
+    The byte cap needs the encoded sizes, so frames are encoded here first;
+    the nodes then get them from the encoded-image cache.
+    """
+    if not max_request_bytes:
+        return batching.pack(frames, images_per_request)
+    sizes = batching.map_ordered(
+        lambda frame: len(encode(frame, *encoding, backend=backend, model=model).b64_bytes),
+                                 frames, max_concurrency)
+    size_of = dict(zip(map(id, frames), sizes))
+    return batching.pack(frames, images_per_request, max_request_bytes, lambda f: size_of[id(f)])
+
+
+def dedup_frames(frames, max_distance=4):
+    """Frames without near-duplicates, plus the kept-frame index for every input frame.
+
+    A frame is dropped when its hash is within max_distance bits of a frame
+    already kept (compared with all kept frames, so slow drift is not chained).
+    """
+    index = list(range(len(frames)))
+    if len(frames) < 2:
+        return frames, index
+    import numpy as np
+
+    with tracing.span("dedup", frames=len(frames)):
+        hashes = np.stack([frame.phash() for frame in frames])
+        kept = []
+        for i in range(len(frames)):
+            if kept:
+                dist = np.count_nonzero(hashes[kept] != hashes[i], axis=1)
+                j = int(dist.argmin())
+                if dist[j] <= max_distance:
+                    index[i] = j
+                    continue
+            index[i] = len(kept)
+            kept.append(i)
+    metrics.inc("frames_deduped_total", len(frames) - len(kept))
+    return [frames[i] for i in kept], index
+
+
+def to_pil_list(img, max_side=DEFAULT_MAX_SIDE):
+    """Convert an IMAGE (batch, CHW/HWC tensor or ndarray) or PIL.Image to a list of PIL.Image.
+
+    Every frame is downsampled to fit max_side x max_side (0 keeps the size).
+    """
+    return [frame.pil() for frame in split_frames(img, max_side)]
+
+
+class EncodedImage:
+    def __init__(self, b64, mime, size):
+        # ASCII-байты base64 — единственная копия картинки; в тело запроса
+        # они попадают как есть через url_blob()/b64_blob() (см. request_body)
+        self.b64_bytes = b64
+        self.mime = mime
+        self.size = size
+
+    @property
+    def b64(self):
+        return self.b64_bytes.decode("ascii")
+
+    @property
+    def data_url(self):
+        return f"data:{self.mime};base64,{self.b64}"
+
+    def b64_blob(self):
+        return request_body.Blob(self.b64_bytes)
+
+    def url_blob(self):
+        return request_body.Blob(f"data:{self.mime};base64,".encode("ascii"), self.b64_bytes)
+
+
+def _b64_len(n):
+    return (n + 2) // 3 * 4
+
+
+def _save(pil, fmt, quality):
+    buf = io.BytesIO()
+    with tracing.span("encode", format=fmt, quality=quality):
+        if fmt == "PNG":
+            pil.save(buf, format="PNG", optimize=False)
+        else:
+            pil.save(buf, format=fmt, quality=quality)
+    # Без копии: base64 читает прямо из буфера
+    return buf.getbuffer()
+
+
+def _encode_pil(pil, fmt, quality, target_bytes):
+    from PIL import Image
+
+    if fmt == "JPEG" and pil.mode not in ("RGB", "L"):
+        pil = pil.convert("RGB")
+    elif fmt == "WEBP" and pil.mode not in ("RGB", "RGBA"):
+        pil = pil.convert("RGB")
+
+    data = _save(pil, fmt, quality)
+    if not target_bytes or _b64_len(len(data)) <= target_bytes:
+        return data, pil
+
+    # Подбор под лимит: сначала качество (бинарный поиск), потом размер
+    while True:
+        smallest = data
+        if fmt != "PNG":
+            smallest = _save(pil, fmt, MIN_QUALITY)
+            lo, hi, best = MIN_QUALITY + 1, quality - 1, None
+            if _b64_len(len(smallest)) <= target_bytes:
+                best = smallest
+                while lo <= hi:
+                    mid = (lo + hi) // 2
+                    candidate = _save(pil, fmt, mid)
+                    if _b64_len(len(candidate)) <= target_bytes:
+                        best, lo = candidate, mid + 1
+                    else:
+                        hi = mid - 1
+                return best, pil
+        w, h = pil.size
+        # Размер файла примерно пропорционален площади
+        scale = min(0.9, max(0.5, 0.95 * (target_bytes / _b64_len(len(smallest))) ** 0.5))
+        if max(w, h) * scale < MIN_SIDE:
+            # Меньше не делаем — отдаём минимальный вариант как есть
+            return smallest, pil
+        with tracing.span("resize", method="lanczos", scale=round(scale, 3)):
+            pil = pil.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+        data = _save(pil, fmt, quality)
+        if _b64_len(len(data)) <= target_bytes:
+            return data, pil
+
+
+class _EncodedCache:
+    """Byte-bounded in-memory LRU of EncodedImage."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, key, item):
+        size = len(item.b64_bytes)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.b64_bytes)
+            self._items[key] = item
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted.b64_bytes)
+
+
+_ENCODED = _EncodedCache(ENCODED_CACHE_BYTES)
+
+
+def encode(frame, image_format="JPEG", quality=75, target_bytes=0, backend="", model=""):
+    """Encode a Frame to base64 (cached by frame content and encoding params).
+
+    backend/model only label the metrics, like the request series.
+    """
+    fmt = image_format.upper()
+    if fmt not in _MIME:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    key = (frame.fingerprint(), frame.max_side, fmt, quality, target_bytes)
+    cached = _ENCODED.get(key)
+    metrics.inc("encode_cache_total", result="miss" if cached is None else "hit")
+    if cached is not None:
+        return cached
+    started = time.perf_counter()
+    data, pil = _encode_pil(frame.pil(), fmt, quality, target_bytes)
+    with tracing.span("base64", bytes=len(data)):
+        item = EncodedImage(base64.b64encode(data), _MIME[fmt], pil.size)
+    metrics.observe("encode_seconds", time.perf_counter() - started,
+                    metrics.ENCODE_BUCKETS, backend=backend, model=model, format=fmt)
+    metrics.inc("encoded_bytes_total", len(item.b64_bytes), backend=backend, model=model, format=fmt)
+    _ENCODED.put(key, item)
+    return item
+
+
+def encoded_cache_stats():
+    return {"hits": _ENCODED.hits, "misses": _ENCODED.misses,
+            "entries": len(_ENCODED._items), "bytes": _ENCODED._bytes}
@@ -0,0 +1,106 @@
+# llm_async_node.py
+#
+# Пара нод submit/await. Submit-нода принимает те же входы, что и обычная
+# нода, ставит вызов в фоновый пул (async_requests) и сразу возвращает
+# LLM_HANDLE. LLMAwaitNode ждёт результат и отдаёт response/responses.
+# Вход `after` у await-ноды — только для порядка: подключите к нему выход
+# ветки, которая должна успеть выполниться, пока запрос в полёте.
+
+import logging
+
+from . import async_requests
+from .openrouter_node import OpenRouterNode
+from .openrouter_vision_node import OpenRouterVisionNode
+from .comfyui_ollama_node import OllamaNode
+from .comfyui_ollama_vision_node import OllamaVisionNode
+
+logger = logging.getLogger("LLMAsyncNode")
+logger.setLevel(logging.DEBUG)
+
+
+class _SubmitNode:
+    NODE = None   # обёрнутая нода: её входы, IS_CHANGED и функция вызова
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return cls.NODE.INPUT_TYPES()
+
+    RETURN_TYPES = ("LLM_HANDLE",)
+    RETURN_NAMES = ("handle",)
+    FUNCTION     = "submit"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return cls.NODE.IS_CHANGED(**kwargs)
+
+    def submit(self, **kwargs):
+        node = self.NODE()
+        return (async_requests.submit(getattr(node, node.FUNCTION), kwargs, self.NODE.__name__),)
+
+
+class OpenRouterSubmitNode(_SubmitNode):
+    NODE     = OpenRouterNode
+    CATEGORY = "OpenRouter"
+
+
+class OpenRouterVisionSubmitNode(_SubmitNode):
+    NODE     = OpenRouterVisionNode
+    CATEGORY = "OpenRouter"
+
+
+class OllamaSubmitNode(_SubmitNode):
+    NODE     = OllamaNode
+    CATEGORY = "Ollama"
+
+
+class OllamaVisionSubmitNode(_SubmitNode):
+    NODE     = OllamaVisionNode
+    CATEGORY = "Ollama"
+
+
+class LLMAwaitNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "handle": ("LLM_HANDLE", {}),
+            },
+            "optional": {
+                # 0 — ждать сколько потребуется
+                "timeout": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 7200.0, "step": 1.0}),
+                "after":   ("*", {}),
+            }
+        }
+
+    RETURN_TYPES   = ("STRING", "STRING")
+    RETURN_NAMES   = ("response", "responses")
+    OUTPUT_IS_LIST = (False, True)
+    FUNCTION       = "await_result"
+    CATEGORY       = "OpenRouter"
+
+    def await_result(self, handle, timeout=0.0, after=None):
+        if not isinstance(handle, async_requests.Handle):
+            err = "Error: handle must come from a submit node"
+            return (err, [err])
+        if not async_requests.wait(handle, timeout):
+            err = f"Error: {handle.label} is still running after {timeout:g}s"
+            return (err, [err])
+        try:
+            result = handle.future.result()
+        except Exception as e:
+            logger.error("LLMAwaitNode: %s failed", handle.label, exc_info=True)
+            err = f"Error: {e}"
+            return (err, [err])
+        # Текстовые ноды отдают один ответ, vision-ноды — ещё и список по запросам
+        response = result[0]
+        responses = list(result[1]) if len(result) > 1 else [response]
+        return (response, responses)
+
+# Регистрация нод
+NODE_CLASS_MAPPINGS = {
+    "OpenRouterSubmitNode":       OpenRouterSubmitNode,
+    "OpenRouterVisionSubmitNode": OpenRouterVisionSubmitNode,
+    "OllamaSubmitNode":           OllamaSubmitNode,
+    "OllamaVisionSubmitNode":     OllamaVisionSubmitNode,
+    "LLMAwaitNode":               LLMAwaitNode,
+}
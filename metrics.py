@@ -0,0 +1,273 @@
+# metrics.py
+#
+# Метрики вызовов LLM: задержки (гистограммы), байты, повторы, HTTP-статусы,
+# токены, попадания в кэши. Доступны через маршрут сервера ComfyUI:
+#   GET /openrouter/metrics                    — JSON
+#   GET /openrouter/metrics?format=prometheus  — текстовый формат Prometheus
+# и (опционально) периодически сбрасываются в JSON-файл:
+#   OPENROUTER_METRICS_FILE      — путь к файлу
+#   OPENROUTER_METRICS_INTERVAL  — период в секундах (по умолчанию 60)
+
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+
+logger = logging.getLogger("Metrics")
+logger.setLevel(logging.DEBUG)
+
+PREFIX = "comfyui_llm_"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+ENCODE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        out = []
+        for le, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += n
+            out.append((le, total))
+        return out
+
+
+class Registry:
+    """Thread-safe labelled counters and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "name":    name,
+                    "labels":  dict(labels),
+                    "count":   hist.count,
+                    "sum":     round(hist.sum, 6),
+                    "buckets": {str(le): n for le, n in hist.cumulative()},
+                }
+                for (name, labels), hist in sorted(self._histograms.items())
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+    def prometheus(self):
+        lines = []
+
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                            for k, v in items)
+            return "{" + body + "}"
+
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {PREFIX}{name} counter")
+                    seen.add(name)
+                lines.append(f"{PREFIX}{name}{fmt(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {PREFIX}{name} histogram")
+                    seen.add(name)
+                for le, n in hist.cumulative():
+                    lines.append(f"{PREFIX}{name}_bucket{fmt(labels, [('le', le)])} {n}")
+                lines.append(f"{PREFIX}{name}_sum{fmt(labels)} {hist.sum:.6f}")
+                lines.append(f"{PREFIX}{name}_count{fmt(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def inc(name, value=1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    REGISTRY.observe(name, value, buckets, **labels)
+
+
+class RequestMetrics:
+    """Context manager around one HTTP attempt of an LLM call.
+
+    with m, limiter.urlopen(...) as resp:
+        m.first_byte(resp)
+        ...
+        m.usage(usage)
+    """
+
+    def __init__(self, backend, model, body_bytes=0, attempt=1):
+        self.labels = {"backend": backend, "model": model}
+        self.body_bytes = body_bytes
+        self.attempt = attempt
+        self.started = None
+        self.queued = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        inc("request_bytes_total", self.body_bytes, **self.labels)
+        if self.attempt > 1:
+            inc("retries_total", **self.labels)
+        return self
+
+    def first_byte(self, resp):
+        # Ожидание в ограничителе частоты — не задержка сети
+        self.queued = getattr(resp, "queued", 0.0) or 0.0
+        if self.queued:
+            observe("queue_seconds", self.queued, **self.labels)
+        observe("ttfb_seconds", time.perf_counter() - self.started - self.queued, **self.labels)
+
+    def usage(self, usage):
+        """Token counts from an OpenAI-style `usage` block or an Ollama final chunk."""
+        if not usage:
+            return
+        prompt = usage.get("prompt_tokens", usage.get("prompt_eval_count"))
+        completion = usage.get("completion_tokens", usage.get("eval_count"))
+        if prompt:
+            inc("prompt_tokens_total", prompt, **self.labels)
+        if completion:
+            inc("completion_tokens_total", completion, **self.labels)
+        # Префикс промпта из кэша провайдера (см. prompt_caching)
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens")
+        if cached:
+            inc("cached_prompt_tokens_total", cached, **self.labels)
+            logger.info("Metrics: %s: %s/%s prompt tokens served from the provider cache",
+                        self.labels["model"], cached, prompt or "?")
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None:
+            status = "200"
+        elif isinstance(exc, urllib.error.HTTPError):
+            status = str(exc.code)
+        else:
+            status = type(exc).__name__
+        inc("requests_total", status=status, **self.labels)
+        observe("latency_seconds", time.perf_counter() - self.started - self.queued, **self.labels)
+        return False
+
+
+def request(backend, model, body_bytes=0, attempt=1):
+    return RequestMetrics(backend, model, body_bytes, attempt)
+
+
+def snapshot():
+    """Registry contents plus the stats of the caches, pools and limiters."""
+    from . import (
+        http_pool, response_cache, singleflight, rate_limit, ollama_balancer, ollama_residency,
+        image_utils, openrouter_models,
+    )
+    data = REGISTRY.snapshot()
+    data["time"] = time.time()
+    data["stats"] = {
+        "response_cache": response_cache.get_cache().stats(),
+        "encoded_images": image_utils.encoded_cache_stats(),
+        "singleflight":   singleflight.get_group().stats(),
+        "rate_limit":     rate_limit.stats(),
+        "ollama_hosts":   ollama_balancer.get_balancer().stats(),
+        "ollama_models":  ollama_residency.get_residency().stats(),
+        "model_catalog":  openrouter_models.stats(),
+        "http_pool":      {"created": http_pool.get_pool().created,
+                           "reused":  http_pool.get_pool().reused},
+    }
+    return data
+
+
+def dump(path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def _dump_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            dump(path)
+        except Exception as e:
+            logger.warning("Metrics: dump to %s failed: %s", path, e)
+
+
+def start_dumper(path, interval=60.0):
+    thread = threading.Thread(target=_dump_loop, args=(path, interval),
+                              name="llm-metrics-dump", daemon=True)
+    thread.start()
+    logger.info("Metrics: dumping to %s every %.0fs", path, interval)
+    return thread
+
+
+def register_routes():
+    """Add /openrouter/metrics to the ComfyUI server; no-op outside ComfyUI."""
+    try:
+        from aiohttp import web
+        from server import PromptServer
+        routes = PromptServer.instance.routes
+    except Exception:
+        return False
+
+    @routes.get("/openrouter/metrics")
+    async def _metrics(request):
+        if request.query.get("format") == "prometheus":
+            return web.Response(text=REGISTRY.prometheus(), content_type="text/plain")
+        return web.json_response(snapshot())
+
+    return True
+
+
+register_routes()
+
+if os.environ.get("OPENROUTER_METRICS_FILE"):
+    try:
+        _interval = float(os.environ.get("OPENROUTER_METRICS_INTERVAL", 60))
+    except ValueError:
+        _interval = 60.0
+    start_dumper(os.environ["OPENROUTER_METRICS_FILE"], _interval)
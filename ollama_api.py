@@ -0,0 +1,75 @@
+# ollama_api.py
+#
+# Помощники для нативного API Ollama (/api/chat): runtime-опции и keep_alive.
+# В отличие от /v1/chat/completions, здесь `options` и `keep_alive`
+# действительно применяются сервером.
+
+import logging
+
+logger = logging.getLogger("OllamaAPI")
+logger.setLevel(logging.DEBUG)
+
+# Дополнительные входы экспериментальных Ollama-нод (0 / -1 — значение Ollama по умолчанию)
+RUNTIME_INPUTS = {
+    "keep_alive": ("STRING", {"default": "5m", "multiline": False}),
+    "num_ctx":    ("INT",    {"default": 0, "min": 0, "max": 1048576}),
+    "num_batch":  ("INT",    {"default": 0, "min": 0, "max": 65536}),
+    "num_thread": ("INT",    {"default": 0, "min": 0, "max": 1024}),
+    "num_gpu":    ("INT",    {"default": -1, "min": -1, "max": 1024}),
+}
+
+
+def runtime_options(num_ctx=0, num_batch=0, num_thread=0, num_gpu=-1):
+    """Options that affect how the model is loaded (a change forces a reload)."""
+    options = {}
+    if num_ctx > 0:
+        options["num_ctx"] = num_ctx
+    if num_batch > 0:
+        options["num_batch"] = num_batch
+    if num_thread > 0:
+        options["num_thread"] = num_thread
+    if num_gpu >= 0:
+        options["num_gpu"] = num_gpu
+    return options
+
+
+def build_options(max_tokens, temperature, top_p,
+                  num_ctx=0, num_batch=0, num_thread=0, num_gpu=-1):
+    options = {
+        "num_predict": max_tokens,
+        "temperature": temperature,
+        "top_p":       top_p,
+    }
+    options.update(runtime_options(num_ctx, num_batch, num_thread, num_gpu))
+    return options
+
+
+def keep_alive_value(keep_alive="5m"):
+    """Top-level keep_alive; numbers are seconds.
+
+    hold_model=False is handled by ollama_residency, which unloads the model
+    after the last pending request instead of sending keep_alive=0 with each one.
+    """
+    keep_alive = (keep_alive or "").strip()
+    if not keep_alive:
+        return None
+    try:
+        return int(keep_alive)
+    except ValueError:
+        return keep_alive
+
+
+def log_timings(label, final):
+    """Log Ollama's own timings from the last /api/chat chunk (durations are in ns)."""
+    if not final:
+        return
+    ms = lambda key: final.get(key, 0) / 1e6
+    eval_count = final.get("eval_count", 0)
+    eval_ms = ms("eval_duration")
+    tps = eval_count / (eval_ms / 1000) if eval_ms else 0.0
+    logger.info(
+        "%s: load %.0f ms, prompt_eval %s tok / %.0f ms, eval %s tok / %.0f ms (%.1f tok/s), "
+        "total %.0f ms",
+        label, ms("load_duration"), final.get("prompt_eval_count", 0), ms("prompt_eval_duration"),
+        eval_count, eval_ms, tps, ms("total_duration"),
+    )
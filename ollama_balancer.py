@@ -0,0 +1,243 @@
+# ollama_balancer.py
+#
+# Распределение запросов по нескольким хостам Ollama.
+# В поле ip_port можно указать несколько адресов через запятую:
+#   "gpu1:11434, gpu2:11434, gpu3:11434"
+# Запрос уходит на наименее загруженный здоровый хост (по числу запросов
+# в полёте). Хост с уже загруженной model_name (по /api/ps) получает фору
+# в LOAD_PENALTY запросов: пока он не намного загруженнее остальных, идём
+# на него, а под нагрузкой запросы расходятся по всем хостам.
+# После нескольких ошибок подряд хост временно исключается (circuit breaker),
+# фоновая проверка /api/ps возвращает его обратно.
+
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from . import http_pool
+
+logger = logging.getLogger("OllamaBalancer")
+logger.setLevel(logging.DEBUG)
+
+FAILURE_THRESHOLD = 3      # ошибок подряд до исключения хоста
+OPEN_COOLDOWN     = 30.0   # секунд до пробного запроса на исключённый хост
+PROBE_INTERVAL    = 15.0   # период фоновой проверки /api/ps
+PROBE_TIMEOUT     = 3.0
+IDLE_FORGET       = 600.0  # хосты без запросов дольше этого не проверяются
+LOAD_PENALTY      = 2      # хост без модели "стоит" столько же, сколько запросов в очереди
+
+
+@functools.lru_cache(maxsize=256)
+def parse_endpoints(ip_port):
+    """Split "host1:port, host2:port" into a tuple of unique endpoints."""
+    seen = []
+    for part in ip_port.replace(";", ",").replace("\n", ",").split(","):
+        part = part.strip().rstrip("/")
+        if part.startswith("http://"):
+            part = part[len("http://"):]
+        if part and part not in seen:
+            seen.append(part)
+    if not seen:
+        raise ValueError("ip_port is empty")
+    return tuple(seen)
+
+
+def canonical_model(name):
+    """"llava" and "llava:latest" are the same model; loaded sets keep only the full name."""
+    name = name.strip()
+    return name if ":" in name else f"{name}:latest"
+
+
+def _is_host_failure(exc):
+    # 4xx — ошибка запроса, а не хоста
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code >= 500
+    return isinstance(exc, OSError)
+
+
+class Endpoint:
+    def __init__(self, host):
+        self.host = host
+        self.outstanding = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.half_open = False
+        self.loaded_models = set()
+        self.probed_at = 0.0
+        self.last_used = time.monotonic()
+
+    def available(self, now):
+        if self.failures < FAILURE_THRESHOLD:
+            return True
+        # После паузы пропускаем один пробный запрос
+        return now >= self.open_until and not self.half_open
+
+
+class Balancer:
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._rr = 0
+        self._prober = None
+
+    def _get(self, host):
+        ep = self._endpoints.get(host)
+        if ep is None:
+            ep = self._endpoints[host] = Endpoint(host)
+        return ep
+
+    def pick(self, hosts, model_name):
+        now = time.monotonic()
+        model = canonical_model(model_name)
+        with self._lock:
+            eps = [self._get(h) for h in hosts]
+            candidates = [ep for ep in eps if ep.available(now)]
+            if not candidates:
+                # Все хосты исключены — берём тот, что раньше всех вернётся
+                candidates = [min(eps, key=lambda ep: ep.open_until)]
+            self._rr += 1
+            offset = self._rr
+            best = min(
+                enumerate(candidates),
+                key=lambda item: (
+                    item[1].outstanding
+                    + (0 if model in item[1].loaded_models else LOAD_PENALTY),
+                    (item[0] + offset) % len(candidates),
+                ),
+            )[1]
+            if best.failures >= FAILURE_THRESHOLD:
+                best.half_open = True
+            best.outstanding += 1
+            best.last_used = now
+        if len(hosts) > 1:
+            self._ensure_prober()
+        return best
+
+    def release(self, ep, exc=None):
+        with self._lock:
+            ep.outstanding -= 1
+            ep.half_open = False
+            if exc is None:
+                ep.failures = 0
+            elif _is_host_failure(exc):
+                ep.failures += 1
+                if ep.failures >= FAILURE_THRESHOLD:
+                    ep.open_until = time.monotonic() + OPEN_COOLDOWN
+                    logger.warning("OllamaBalancer: %s ejected after %s consecutive failures",
+                                   ep.host, ep.failures)
+
+    @contextlib.contextmanager
+    def acquire(self, ip_port, model_name):
+        """Context manager yielding the chosen host; outcome feeds the circuit breaker."""
+        hosts = parse_endpoints(ip_port)
+        ep = self.pick(hosts, model_name)
+        if len(hosts) > 1:
+            logger.debug("OllamaBalancer: -> %s (outstanding=%s)", ep.host, ep.outstanding)
+        try:
+            yield ep.host
+        except BaseException as e:
+            self.release(ep, e)
+            raise
+        self.release(ep)
+        self.mark_loaded(ep.host, model_name)
+
+    def mark_loaded(self, host, model_name):
+        with self._lock:
+            self._get(host).loaded_models.add(canonical_model(model_name))
+
+    def mark_unloaded(self, host, model_name):
+        with self._lock:
+            self._get(host).loaded_models.discard(canonical_model(model_name))
+
+    def loaded_models(self, host, max_age=None):
+        """Models loaded on `host`; re-reads /api/ps when the last probe is older than max_age."""
+        with self._lock:
+            ep = self._get(host)
+            stale = max_age is not None and time.monotonic() - ep.probed_at > max_age
+            loaded = set(ep.loaded_models)
+        if stale:
+            probed = self.probe(host)
+            if probed is not None:
+                loaded = probed
+        return loaded
+
+    def probe(self, host):
+        """Refresh health and loaded models of one host via /api/ps."""
+        req = urllib.request.Request(f"http://{host}/api/ps", method="GET")
+        try:
+            with http_pool.urlopen(req, timeout=PROBE_TIMEOUT) as resp:
+                models = json.loads(resp.read().decode("utf-8")).get("models") or []
+        except Exception as e:
+            with self._lock:
+                ep = self._get(host)
+                ep.failures += 1
+                if ep.failures >= FAILURE_THRESHOLD:
+                    ep.open_until = time.monotonic() + OPEN_COOLDOWN
+            logger.debug("OllamaBalancer: probe %s failed: %s", host, e)
+            return None
+        loaded = set()
+        for m in models:
+            for key in ("name", "model"):
+                if m.get(key):
+                    loaded.add(canonical_model(m[key]))
+        with self._lock:
+            ep = self._get(host)
+            ep.loaded_models = loaded
+            ep.probed_at = time.monotonic()
+            if ep.failures:
+                logger.info("OllamaBalancer: %s is healthy again", host)
+            ep.failures = 0
+        return loaded
+
+    def _ensure_prober(self):
+        if self._prober is not None and self._prober.is_alive():
+            return
+        with self._lock:
+            if self._prober is not None and self._prober.is_alive():
+                return
+            self._prober = threading.Thread(target=self._probe_loop, name="ollama-probe",
+                                            daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                hosts = [ep.host for ep in self._endpoints.values()
+                         if now - ep.last_used < IDLE_FORGET]
+            if not hosts:
+                # Никто не пользуется — поток завершается, pick() запустит заново
+                with self._lock:
+                    self._prober = None
+                return
+            for host in hosts:
+                self.probe(host)
+            time.sleep(PROBE_INTERVAL)
+
+    def stats(self):
+        with self._lock:
+            return {
+                ep.host: {
+                    "outstanding":   ep.outstanding,
+                    "failures":      ep.failures,
+                    "ejected":       ep.failures >= FAILURE_THRESHOLD,
+                    "loaded_models": sorted(ep.loaded_models),
+                }
+                for ep in self._endpoints.values()
+            }
+
+
+_BALANCER = Balancer()
+
+
+def get_balancer():
+    return _BALANCER
+
+
+def acquire(ip_port, model_name):
+    return _BALANCER.acquire(ip_port, model_name)
@@ -0,0 +1,206 @@
+# ollama_residency.py
+#
+# Управление загрузкой моделей в память хостов Ollama.
+# Загрузка модели на наших хостах стоит в разы дороже самого ответа, поэтому:
+#   * hold_model=False выгружает модель только после последнего
+#     незавершённого запроса к ней (а не после каждой попытки);
+#   * max_resident > 0 — не больше стольких моделей в памяти хоста:
+#     под новую модель выгружаются самые давно использованные (LRU) из тех,
+#     к которым сейчас нет запросов, а отпущенные модели (hold_model=False)
+#     остаются в памяти, пока место не понадобится. Граф, чередующий
+#     две модели, так не перезагружает их на каждом шаге;
+#   * load() заранее прогревает модель (нода OllamaPreloadNode).
+# Какие модели загружены, берётся из /api/ps (через ollama_balancer).
+
+import contextlib
+import json
+import logging
+import threading
+import time
+import urllib.request
+
+from . import http_pool, ollama_balancer
+
+logger = logging.getLogger("OllamaResidency")
+logger.setLevel(logging.DEBUG)
+
+PS_MAX_AGE     = 5.0     # секунд, не чаще — перечитывать /api/ps перед вытеснением
+UNLOAD_TIMEOUT = 30.0
+LOAD_TIMEOUT   = 600.0   # загрузка большой модели с диска бывает долгой
+
+# Опциональные входы экспериментальных Ollama-нод (0 — без ограничения)
+RESIDENCY_INPUTS = {
+    "max_resident": ("INT", {"default": 0, "min": 0, "max": 64}),
+}
+
+
+def _canonical(model_name):
+    return ollama_balancer.canonical_model(model_name)
+
+
+class _Resident:
+    def __init__(self):
+        self.pending = 0      # запросов в работе (включая ожидающих в singleflight)
+        self.used = False     # запросы к модели уходили на этот хост
+        self.unloading = False
+        self.last_used = 0.0
+
+
+class Residency:
+    """Pending-request counts and LRU order of models per Ollama host."""
+
+    def __init__(self):
+        self._models = {}   # (host, model) -> _Resident
+        self._lock = threading.Lock()
+        # Ждать конца выгрузки: запрос, начатый во время keep_alive=0, остался бы без модели
+        self._unloaded = threading.Condition(self._lock)
+        self.loads = 0
+        self.unloads = 0
+        self.evictions = 0
+
+    def _get(self, host, model):
+        r = self._models.get((host, model))
+        if r is None:
+            r = self._models[(host, model)] = _Resident()
+        return r
+
+    @contextlib.contextmanager
+    def use(self, ip_port, model_name, hold_model=True, max_resident=0):
+        """Mark requests to model_name on every host of ip_port as pending for the block."""
+        try:
+            hosts = ollama_balancer.parse_endpoints(ip_port)
+        except ValueError:
+            hosts = ()  # ошибку вернёт сам запрос
+        model = _canonical(model_name)
+        with self._lock:
+            for host in hosts:
+                r = self._get(host, model)
+                self._unloaded.wait_for(lambda: not r.unloading)
+                r.pending += 1
+        try:
+            yield
+        finally:
+            self._release(hosts, model, hold_model, max_resident)
+
+    def _release(self, hosts, model, hold_model, max_resident):
+        idle = []
+        now = time.monotonic()
+        with self._lock:
+            for host in hosts:
+                r = self._get(host, model)
+                r.pending -= 1
+                r.last_used = now
+                if r.pending == 0 and r.used and not hold_model and not max_resident:
+                    idle.append(host)
+        for host in idle:
+            self.unload(host, model, only_if_idle=True)
+
+    def touch(self, host, model_name, max_resident=0):
+        """Called with the host chosen for an attempt: record the use and make room (LRU)."""
+        model = _canonical(model_name)
+        with self._lock:
+            r = self._get(host, model)
+            r.used = True
+            r.last_used = time.monotonic()
+        if max_resident > 0:
+            self._make_room(host, model, max_resident)
+
+    def _make_room(self, host, model, max_resident):
+        loaded = ollama_balancer.get_balancer().loaded_models(host, PS_MAX_AGE)
+        if model in loaded:
+            return
+        with self._lock:
+            victims = sorted(
+                (m for m in loaded if self._get(host, m).pending == 0),
+                key=lambda m: self._get(host, m).last_used,
+            )
+        # Модели, загруженные не через нас, — самые старые и уходят первыми
+        excess = len(loaded) + 1 - max_resident
+        for victim in victims[:max(0, excess)]:
+            logger.info("OllamaResidency: %s holds %s model(s), evicting least recently used %s for %s",
+                        host, len(loaded), victim, model)
+            with self._lock:
+                self.evictions += 1
+            self.unload(host, victim, only_if_idle=True)
+
+    def _post_generate(self, host, body, timeout):
+        # /api/generate без prompt только загружает (или, при keep_alive=0, выгружает) модель
+        req = urllib.request.Request(f"http://{host}/api/generate",
+                                     data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+        with http_pool.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+
+    def unload(self, host, model_name, only_if_idle=False):
+        model = _canonical(model_name)
+        with self._lock:
+            r = self._get(host, model)
+            # Пока шла проверка, к модели мог прийти новый запрос. Проверка и отметка
+            # "выгружается" — под одной блокировкой: новые запросы (use) ждут конца выгрузки
+            if r.unloading or (only_if_idle and r.pending):
+                return False
+            r.unloading = True
+        unloaded = False
+        try:
+            self._post_generate(host, {"model": model, "keep_alive": 0}, UNLOAD_TIMEOUT)
+            ollama_balancer.get_balancer().mark_unloaded(host, model)
+            unloaded = True
+        except Exception as e:
+            logger.warning("OllamaResidency: failed to unload %s on %s: %s", model, host, e)
+        finally:
+            # Состояние обновляем до того, как отпустить ждущие запросы
+            with self._lock:
+                if unloaded:
+                    r.used = False
+                    self.unloads += 1
+                r.unloading = False
+                self._unloaded.notify_all()
+        if unloaded:
+            logger.info("OllamaResidency: unloaded %s on %s", model, host)
+        return unloaded
+
+    def load(self, host, model_name, keep_alive=None, options=None, max_resident=0):
+        """Load model_name on host ahead of time; return seconds spent."""
+        model = _canonical(model_name)
+        with self._lock:
+            r = self._get(host, model)
+            self._unloaded.wait_for(lambda: not r.unloading)
+        self.touch(host, model, max_resident)
+        body = {"model": model}
+        if keep_alive is not None:
+            body["keep_alive"] = keep_alive
+        if options:
+            body["options"] = options
+        started = time.monotonic()
+        self._post_generate(host, body, LOAD_TIMEOUT)
+        elapsed = time.monotonic() - started
+        ollama_balancer.get_balancer().mark_loaded(host, model)
+        with self._lock:
+            self.loads += 1
+        logger.info("OllamaResidency: %s ready on %s in %.1fs", model, host, elapsed)
+        return elapsed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loads":     self.loads,
+                "unloads":   self.unloads,
+                "evictions": self.evictions,
+                "pending":   {f"{host} {model}": r.pending
+                              for (host, model), r in self._models.items() if r.pending},
+            }
+
+
+_RESIDENCY = Residency()
+
+
+def get_residency():
+    return _RESIDENCY
+
+
+def use(ip_port, model_name, hold_model=True, max_resident=0):
+    return _RESIDENCY.use(ip_port, model_name, hold_model, max_resident)
+
+
+def touch(host, model_name, max_resident=0):
+    _RESIDENCY.touch(host, model_name, max_resident)
@@ -0,0 +1,11 @@
+# openrouter_api.py
+#
+# Адреса API OpenRouter. Базовый URL можно переопределить переменной
+# окружения OPENROUTER_API_BASE (совместимый прокси или локальный
+# stub-сервер из benchmarks/stub_server.py).
+
+import os
+
+API_BASE = os.environ.get("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1").rstrip("/")
+CHAT_URL = f"{API_BASE}/chat/completions"
+MODELS_URL = f"{API_BASE}/models"
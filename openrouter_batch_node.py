@@ -0,0 +1,71 @@
+# openrouter_batch_node.py
+#
+# Пакетная текстовая нода: список user-промптов с общим system-промптом
+# и параметрами выполняется параллельно (не больше max_concurrency
+# запросов одновременно). Ошибка отдельного промпта не роняет весь пакет —
+# на его месте в ответах будет строка "Error: ...".
+
+import logging
+
+from . import response_cache, batching, tracing
+from .openrouter_node import OpenRouterNode
+
+logger = logging.getLogger("OpenRouterBatchNode")
+logger.setLevel(logging.DEBUG)
+
+
+class OpenRouterBatchNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        # Параметры те же, что у OpenRouterNode; потоковый режим для пакета не нужен
+        optional = {k: v for k, v in OpenRouterNode.INPUT_TYPES()["optional"].items()
+                    if k != "stream"}
+        return {
+            "required": {
+                "api_key":       ("STRING", {"multiline": False}),
+                "model_name":    ("STRING", {"multiline": False}),
+                "system_prompt": ("STRING", {"multiline": True}),
+                # по одному промпту на строку или JSON-массив строк
+                "user_prompts":  ("STRING", {"multiline": True}),
+            },
+            "optional": {
+                "max_concurrency": ("INT", {"default": 8, "min": 1, "max": 64}),
+                **optional,
+            }
+        }
+
+    RETURN_TYPES   = ("STRING", "STRING")
+    RETURN_NAMES   = ("response", "responses")
+    OUTPUT_IS_LIST = (False, True)
+    FUNCTION       = "call_openrouter"
+    CATEGORY       = "OpenRouter"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return response_cache.is_changed(**kwargs)
+
+    @tracing.traced("OpenRouterBatchNode")
+    def call_openrouter(self, api_key, model_name, system_prompt, user_prompts,
+                        max_concurrency=8, **params):
+        prompts = batching.parse_prompts(user_prompts)
+
+        node = OpenRouterNode()
+
+        def run_one(prompt):
+            try:
+                return node.call_openrouter(api_key, model_name, system_prompt, prompt, **params)[0]
+            except Exception as e:
+                logger.error("OpenRouterBatchNode: prompt failed", exc_info=True)
+                return f"Error: {e}"
+
+        logger.info("OpenRouterBatchNode: %s prompt(s), max_concurrency=%s", len(prompts), max_concurrency)
+        responses = batching.map_ordered(run_one, prompts, max_concurrency)
+        failed = sum(r.startswith("Error:") for r in responses)
+        if failed:
+            logger.warning("OpenRouterBatchNode: %s/%s prompt(s) failed", failed, len(responses))
+        return ("\n".join(responses), responses)
+
+# Регистрация ноды
+NODE_CLASS_MAPPINGS = {
+    "OpenRouterBatchNode": OpenRouterBatchNode
+}
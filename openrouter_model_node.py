@@ -0,0 +1,57 @@
+# openrouter_model_node.py
+#
+# Выбор модели OpenRouter из каталога (выпадающий список) вместо ввода
+# имени вручную. Кроме имени нода отдаёт длину контекста, цены и признак
+# поддержки изображений — их можно подать в другие ноды.
+# Список берётся из каталога на диске; если он устарел, обновляется в фоне
+# и появится при следующей загрузке списка нод.
+
+import logging
+
+from . import openrouter_models
+
+logger = logging.getLogger("OpenRouterModelSelector")
+logger.setLevel(logging.DEBUG)
+
+PER_MILLION = 1_000_000
+
+
+class OpenRouterModelSelector:
+    @classmethod
+    def INPUT_TYPES(cls):
+        # Не блокируем загрузку списка нод сетью: берём что есть и обновляем в фоне
+        catalog = openrouter_models.get_catalog()
+        names = openrouter_models.model_names(allow_fetch=False)
+        catalog.refresh_async()
+        return {
+            "required": {
+                "model": (names or list(openrouter_models.VIRTUAL_MODELS),),
+            },
+        }
+
+    RETURN_TYPES = ("STRING", "INT", "FLOAT", "FLOAT", "BOOLEAN")
+    RETURN_NAMES = ("model_name", "context_length", "prompt_price", "completion_price",
+                    "supports_images")
+    FUNCTION     = "select"
+    CATEGORY     = "OpenRouter"
+
+    @classmethod
+    def VALIDATE_INPUTS(cls, model):
+        # Сохранённый граф не должен ломаться, если список моделей с тех пор изменился:
+        # проверку имени делают сами ноды по актуальному каталогу
+        return True
+
+    def select(self, model):
+        info = openrouter_models.get_model(model)
+        if info is None:
+            logger.warning("OpenRouterModelSelector: '%s' is not in the catalog", model)
+            return (model, 0, 0.0, 0.0, False)
+        # Цены — в долларах за миллион токенов, как на сайте OpenRouter
+        return (info.id, info.context_length, info.prompt_price * PER_MILLION,
+                info.completion_price * PER_MILLION, info.supports_images)
+
+
+# Регистрация ноды
+NODE_CLASS_MAPPINGS = {
+    "OpenRouterModelSelector": OpenRouterModelSelector
+}
@@ -0,0 +1,277 @@
+# openrouter_models.py
+#
+# Каталог моделей OpenRouter (/api/v1/models) с кэшем на диске.
+# Каталог скачивается один раз и перепроверяется по истечении TTL
+# условным запросом (If-None-Match / ETag): если ничего не изменилось,
+# сервер отвечает 304 без тела. Без сети используется копия с диска,
+# даже устаревшая.
+#
+# По каталогу ноды ещё до отправки (и до кодирования картинок) проверяют,
+# что модель существует и принимает изображения. Отсюда же берутся длина
+# контекста и цены.
+#
+#   OPENROUTER_MODELS_TTL_HOURS — как часто перепроверять каталог (по умолчанию 12)
+
+import difflib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from . import http_pool, openrouter_api, response_cache
+
+logger = logging.getLogger("OpenRouterModels")
+logger.setLevel(logging.DEBUG)
+
+FETCH_TIMEOUT = 10.0
+RETRY_OFFLINE = 300.0   # после неудачной загрузки не пробуем снова столько секунд
+# Суффиксы маршрутизации OpenRouter, которых нет в каталоге как отдельных id
+ROUTING_SUFFIXES = (":nitro", ":floor", ":online", ":thinking")
+# Служебные id, которые каталог может не перечислять
+VIRTUAL_MODELS = ("openrouter/auto",)
+
+# Опциональный вход OpenRouter-нод
+CATALOG_INPUTS = {
+    "check_model": ("BOOLEAN", {"default": True}),
+}
+
+
+def _ttl():
+    try:
+        return float(os.environ.get("OPENROUTER_MODELS_TTL_HOURS", 12)) * 3600
+    except ValueError:
+        return 12 * 3600.0
+
+
+def _price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ModelInfo:
+    def __init__(self, entry):
+        self.id = entry["id"]
+        self.name = entry.get("name") or self.id
+        self.context_length = int(entry.get("context_length") or 0)
+        arch = entry.get("architecture") or {}
+        modalities = arch.get("input_modalities")
+        if not modalities:
+            # Старый формат: "text+image->text"
+            modalities = (arch.get("modality") or "text->text").split("->")[0].split("+")
+        self.input_modalities = tuple(modalities)
+        pricing = entry.get("pricing") or {}
+        # Цены в каталоге — доллары за токен
+        self.prompt_price = _price(pricing.get("prompt"))
+        self.completion_price = _price(pricing.get("completion"))
+        self.image_price = _price(pricing.get("image"))
+        top = entry.get("top_provider") or {}
+        self.max_completion_tokens = int(top.get("max_completion_tokens") or 0)
+
+    @property
+    def supports_images(self):
+        return "image" in self.input_modalities
+
+    def cost(self, prompt_tokens, completion_tokens=0):
+        return prompt_tokens * self.prompt_price + completion_tokens * self.completion_price
+
+
+class Catalog:
+    """In-memory copy of the model list, backed by a JSON file and revalidated by ETag."""
+
+    def __init__(self, path, url, ttl):
+        self.path = path
+        self.url = url
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._models = None
+        self._etag = None
+        self._fetched = 0.0
+        self._failed_at = None
+        self._loaded_disk = False
+        self.fetches = 0
+        self.not_modified = 0
+        self.offline = 0
+
+    def _load_disk(self):
+        self._loaded_disk = True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self._set(saved["data"], saved.get("etag"), saved.get("fetched", 0.0))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("OpenRouterModels: ignoring unreadable %s: %s", self.path, e)
+
+    def _save_disk(self, data):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"etag": self._etag, "fetched": self._fetched, "data": data}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("OpenRouterModels: cannot write %s: %s", self.path, e)
+
+    def _set(self, data, etag, fetched):
+        models = {}
+        for entry in data:
+            try:
+                info = ModelInfo(entry)
+            except (KeyError, TypeError, ValueError):
+                continue
+            models[info.id] = info
+        self._models = models
+        self._etag = etag
+        self._fetched = fetched
+
+    def _fetch(self):
+        headers = {"Accept": "application/json"}
+        if self._etag and self._models is not None:
+            headers["If-None-Match"] = self._etag
+        req = urllib.request.Request(self.url, headers=headers, method="GET")
+        self.fetches += 1
+        try:
+            with http_pool.urlopen(req, timeout=FETCH_TIMEOUT) as resp:
+                status = getattr(resp, "status", resp.getcode())
+                body = resp.read()
+                etag = resp.headers.get("ETag")
+        except urllib.error.HTTPError as e:
+            # Через прокси (urllib) 304 приходит исключением
+            if e.code != 304:
+                raise
+            status = 304
+        self._failed_at = None
+        if status == 304:
+            self.not_modified += 1
+            self._fetched = time.time()
+            self._save_disk_meta()
+            logger.debug("OpenRouterModels: catalog not modified")
+            return
+        data = json.loads(body.decode("utf-8"))["data"]
+        self._set(data, etag, time.time())
+        self._save_disk(data)
+        logger.info("OpenRouterModels: fetched %s models", len(self._models))
+
+    def _save_disk_meta(self):
+        # 304: обновляем только время проверки, тело берём из уже сохранённого файла
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            saved["fetched"] = self._fetched
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(saved, f)
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            logger.debug("OpenRouterModels: cannot update %s: %s", self.path, e)
+
+    def models(self, allow_fetch=True):
+        """{id: ModelInfo}, revalidated when older than the TTL; None if never available."""
+        with self._lock:
+            if not self._loaded_disk:
+                self._load_disk()
+            now = time.time()
+            stale = now - self._fetched > self.ttl
+            backoff = (self._failed_at is not None
+                       and time.monotonic() - self._failed_at < RETRY_OFFLINE)
+            if stale and allow_fetch and not backoff:
+                try:
+                    self._fetch()
+                except Exception as e:
+                    self._failed_at = time.monotonic()
+                    self.offline += 1
+                    if self._models is not None:
+                        logger.warning("OpenRouterModels: cannot refresh catalog (%s), using the copy from disk",
+                                       e)
+                    else:
+                        logger.warning("OpenRouterModels: catalog unavailable: %s", e)
+            return self._models
+
+    def refresh_async(self):
+        """Revalidate in the background (used where blocking is not an option, e.g. INPUT_TYPES)."""
+        threading.Thread(target=self.models, name="openrouter-models", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "models":       len(self._models or ()),
+                "age_s":        round(time.time() - self._fetched, 1) if self._fetched else None,
+                "fetches":      self.fetches,
+                "not_modified": self.not_modified,
+                "offline":      self.offline,
+            }
+
+
+_CATALOG = None
+_CATALOG_LOCK = threading.Lock()
+
+
+def get_catalog():
+    global _CATALOG
+    with _CATALOG_LOCK:
+        if _CATALOG is None:
+            # Отдельный файл на каждый API_BASE, чтобы прокси и stub не путались с openrouter.ai
+            suffix = hashlib.sha256(openrouter_api.API_BASE.encode("utf-8")).hexdigest()[:8]
+            path = os.path.join(response_cache.cache_dir(), f"models_{suffix}.json")
+            _CATALOG = Catalog(path, openrouter_api.MODELS_URL, _ttl())
+        return _CATALOG
+
+
+def _base_id(model_id):
+    model_id = model_id.strip()
+    for suffix in ROUTING_SUFFIXES:
+        if model_id.endswith(suffix):
+            return model_id[: -len(suffix)]
+    return model_id
+
+
+def get_model(model_id, allow_fetch=True):
+    """ModelInfo for model_id, or None if unknown or the catalog is unavailable."""
+    models = get_catalog().models(allow_fetch)
+    if not models:
+        return None
+    return models.get(model_id.strip()) or models.get(_base_id(model_id))
+
+
+def context_length(model_id, allow_fetch=True):
+    info = get_model(model_id, allow_fetch)
+    return info.context_length if info else 0
+
+
+def check_models(model_ids, need_images=False):
+    """Error message for the first unusable model, or None.
+
+    Without a catalog (offline and nothing on disk) nothing is rejected.
+    """
+    models = get_catalog().models()
+    if not models:
+        return None
+    for model_id in model_ids:
+        if model_id in VIRTUAL_MODELS:
+            continue
+        info = models.get(model_id) or models.get(_base_id(model_id))
+        if info is None:
+            hint = difflib.get_close_matches(_base_id(model_id), list(models), n=3, cutoff=0.6)
+            msg = f"unknown OpenRouter model '{model_id}'"
+            if hint:
+                msg += f" (did you mean: {', '.join(hint)}?)"
+            return msg
+        if need_images and not info.supports_images:
+            return (f"model '{model_id}' does not accept images "
+                    f"(input: {', '.join(info.input_modalities)})")
+    return None
+
+
+def model_names(allow_fetch=False):
+    models = get_catalog().models(allow_fetch)
+    return sorted(models) if models else []
+
+
+def stats():
+    return get_catalog().stats()
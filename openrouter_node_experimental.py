@@ -1,14 +1,20 @@
-import urllib.request
-import json
-import logging
-
-# Настраиваем логгер для этой ноды
+import urllib.request
+import json
+import logging
+import time
+
+from . import (
+    response_cache, streaming, retry, hedging, singleflight, rate_limit, metrics,
+    openrouter_api, openrouter_models, prompt_caching, token_budget, tracing,
+)
+
+# Настраиваем логгер для этой ноды
 logger = logging.getLogger("OpenRouterNodeExperimental")
-logger.setLevel(logging.DEBUG)
-
+logger.setLevel(logging.DEBUG)
+
 class OpenRouterNodeExperimental:
-    @classmethod
-    def INPUT_TYPES(cls):
+    @classmethod
+    def INPUT_TYPES(cls):
         return {
             "required": {
                 "api_key":       ("STRING", {"multiline": False}),
@@ -20,69 +26,142 @@ class OpenRouterNodeExperimental:
                 "max_tokens":  ("INT",   {"default": 1024}),
                 "temperature": ("FLOAT", {"default": 0.7}),
                 "top_p":       ("FLOAT", {"default": 0.9}),
+                "cache_mode":  (response_cache.CACHE_MODES, {"default": "use"}),
+                "stream":       ("BOOLEAN", {"default": False}),
+                "stop_strings": ("STRING",  {"multiline": True, "default": ""}),
+                "max_chars":    ("INT",     {"default": 0, "min": 0}),
+                **hedging.HEDGE_INPUTS,
+                **openrouter_models.CATALOG_INPUTS,
+                **prompt_caching.PROMPT_CACHE_INPUTS,
+                **token_budget.BUDGET_INPUTS,
+                **rate_limit.RATE_INPUTS,
+                **retry.RETRY_INPUTS,
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
-
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("response",)
-    FUNCTION     = "call_openrouter"
-    CATEGORY     = "OpenRouter"
-
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("response",)
+    FUNCTION     = "call_openrouter"
+    CATEGORY     = "OpenRouter"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return response_cache.is_changed(**kwargs)
+
+    @tracing.traced("OpenRouterNodeExperimental")
     def call_openrouter(self, api_key, model_name, system_prompt, user_prompt,
-                        max_tokens=1024, temperature=0.7, top_p=0.9):
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type":  "application/json",
-        }
+                        max_tokens=1024, temperature=0.7, top_p=0.9,
+                        cache_mode="use", stream=False, stop_strings="", max_chars=0,
+                        fallback_models="", hedge_after=0.0, hedge_percentile=95.0,
+                        server_fallback=False, check_model=True, prompt_cache="auto",
+                        truncate="off", max_prompt_tokens=0,
+                        rpm=0, tpm=0,
+                        max_attempts=3, connect_timeout=10.0, read_timeout=120.0, deadline=300.0,
+                        unique_id=None):
+        url = openrouter_api.CHAT_URL
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type":  "application/json",
+        }
+        models = hedging.parse_models(model_name, fallback_models)
+        if check_model:
+            # Опечатку в имени модели ловим до запроса (и до повторов)
+            problem = openrouter_models.check_models(models)
+            if problem:
+                return (f"Error: {problem}",)
+
+        # Промпт, который не влезет в контекст, обрезаем (или отклоняем) до сборки запроса
+        try:
+            user_prompt = token_budget.fit_prompt(
+                system_prompt, user_prompt,
+                lambda: token_budget.openrouter_limit(models, max_prompt_tokens, max_tokens), truncate,
+                "OpenRouterNodeExperimental")
+        except token_budget.PromptTooLong as e:
+            return (f"Error: {e}",)
+
         payload = {
             "model":    model_name,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user",   "content": user_prompt}
-            ],
+            # system всегда первым: общий префикс совпадает байт в байт между вызовами
+            "messages": prompt_caching.text_messages(system_prompt, user_prompt, models,
+                                                     prompt_cache),
             "max_tokens":  max_tokens,
             "temperature": temperature,
             "top_p":       top_p,
         }
-        data = json.dumps(payload).encode("utf-8")
-
-        # Попробовать до 3 раз
-        for attempt in range(1, 4):
-            logger.info(
-                f"OpenRouterExperimental: Attempt {attempt}/3 "
-                f"(max_tokens={max_tokens}, temperature={temperature}, top_p={top_p})"
-            )
-            logger.debug(f"OpenRouterNode: POST {url} (payload {len(data)} bytes)")
-
-            req = urllib.request.Request(url, data=data, headers=headers, method="POST")
-            try:
-                with urllib.request.urlopen(req) as resp:
-                    status = getattr(resp, "status", resp.getcode())
-                    logger.info(f"OpenRouterNode: HTTP {status}")
-
-                    raw = resp.read().decode("utf-8")
-                    logger.debug(f"OpenRouterNode: Raw response: {raw}")
-
-                    resp_json = json.loads(raw)
-                    content = resp_json["choices"][0]["message"]["content"]
-                    logger.info(f"OpenRouterNode: Got content length={len(content)}")
-                    return (content,)
-
-            except urllib.error.HTTPError as e:
-                err = f"HTTPError {e.code}: {e.reason}"
-                logger.warning(f"OpenRouterNode: {err} on attempt {attempt}")
-                if attempt == 3:
-                    return (f"Error: {err}",)
-                # иначе продолжаем цикл
-
-            except Exception as e:
-                logger.warning(f"OpenRouterNode: Exception on attempt {attempt}: {e}", exc_info=True)
-                if attempt == 3:
-                    return (f"Error: {e}",)
-                # иначе продолжаем цикл
-
-# Регистрация ноды
+        stops = streaming.parse_stop_strings(stop_strings)
+        if stops:
+            payload["stop"] = stops[:4]  # API принимает не больше 4 стоп-строк
+
+        if server_fallback and len(models) > 1:
+            # Перебор моделей делает OpenRouter, на клиенте один запрос
+            payload["models"] = models
+            models = models[:1]
+
+        cache_key = response_cache.make_key(url, payload, max_chars=max_chars,
+                                            fallback_models=models[1:])
+        cached = response_cache.lookup(cache_key, cache_mode)
+        if cached is not None:
+            return (cached,)
+
+        if stream:
+            payload["stream"] = True
+        prompt_caching.request_usage(payload, prompt_cache)
+
+        policy = retry.policy_from_inputs(max_attempts, connect_timeout, read_timeout, deadline)
+
+        tokens = rate_limit.estimate_tokens(payload)
+        limiter = rate_limit.get_limiter(rate_limit.openrouter_key(api_key), rpm, tpm)
+
+        def call(model, cancel):
+            with tracing.span("serialize"):
+                data = json.dumps(dict(payload, model=model)).encode("utf-8")
+
+            def send(attempt, timeout):
+                logger.info(
+                    "OpenRouterExperimental: Attempt %s/%s (max_tokens=%s, temperature=%s, top_p=%s)",
+                    attempt, policy.max_attempts, max_tokens, temperature, top_p,
+                )
+                logger.debug("OpenRouterNode: POST %s (payload %s bytes)", url, len(data))
+
+                req = urllib.request.Request(url, data=data, headers=headers, method="POST")
+                started = time.perf_counter()
+                m = metrics.request("openrouter", model, len(data), attempt)
+                with m, limiter.urlopen(req, timeout=timeout, tokens=tokens, cancel=cancel) as resp:
+                    m.first_byte(resp)
+                    status = getattr(resp, "status", resp.getcode())
+                    logger.info("OpenRouterNode: HTTP %s", status)
+
+                    if stream:
+                        content, stats = streaming.read_chat_stream(resp, stops, max_chars, unique_id,
+                                                                    "OpenRouterExperimental", started,
+                                                                    timeout.expires)
+                        m.usage(stats.usage)
+                    else:
+                        raw = resp.read()
+                        logger.debug("OpenRouterNode: response %d bytes", len(raw))
+                        with tracing.span("parse"):
+                            resp_json = json.loads(raw)
+                        m.usage(resp_json.get("usage"))
+                        content = resp_json["choices"][0]["message"]["content"]
+                        content, _ = streaming.apply_cutoff(content, stops, max_chars)
+                    logger.info("OpenRouterNode: Got content length=%s", len(content))
+                    return content
+
+            return policy.run(send, logger, f"OpenRouterExperimental [{model}]", cancel)
+
+        try:
+            content = singleflight.do(cache_key, lambda: hedging.run(
+                models, call, hedge_after, hedge_percentile, "OpenRouterExperimental"))
+        except Exception as e:
+            return (f"Error: {retry.describe_error(e)}",)
+
+        response_cache.store(cache_key, content, cache_mode)
+        return (content,)
+
+# Регистрация ноды
 NODE_CLASS_MAPPINGS = {
     "OpenRouterNodeExperimental": OpenRouterNodeExperimental
 }
@@ -1,20 +1,21 @@
-# noinspection PyPep8Naming
-import urllib.request
-import urllib.error
-import json
-import io
-import base64
-import logging
-
-from PIL import Image
-import numpy as np
-
+# noinspection PyPep8Naming
+import urllib.request
+import urllib.error
+import json
+import logging
+import time
+
+from . import (
+    response_cache, image_utils, batching, streaming, retry, singleflight, rate_limit,
+    metrics, openrouter_api, openrouter_models, prompt_caching, request_body, tracing,
+)
+
 logger = logging.getLogger("OpenRouterVisionNodeExperimental")
-logger.setLevel(logging.DEBUG)
-
+logger.setLevel(logging.DEBUG)
+
 class OpenRouterVisionNodeExperimental:
-    @classmethod
-    def INPUT_TYPES(cls):
+    @classmethod
+    def INPUT_TYPES(cls):
         return {
             "required": {
                 "api_key":       ("STRING", {"multiline": False}),
@@ -27,68 +28,112 @@ class OpenRouterVisionNodeExperimental:
                 "max_tokens":  ("INT",   {"default": 1024}),
                 "temperature": ("FLOAT", {"default": 0.7}),
                 "top_p":       ("FLOAT", {"default": 0.9}),
+                "cache_mode":  (response_cache.CACHE_MODES, {"default": "use"}),
+                "max_concurrency": ("INT", {"default": 4, "min": 1, "max": 64}),
+                "stream":       ("BOOLEAN", {"default": False}),
+                "stop_strings": ("STRING",  {"multiline": True, "default": ""}),
+                "max_chars":    ("INT",     {"default": 0, "min": 0}),
+                **image_utils.ENCODE_INPUTS,
+                **image_utils.MULTI_IMAGE_INPUTS,
+                **image_utils.DEDUP_INPUTS,
+                **openrouter_models.CATALOG_INPUTS,
+                **prompt_caching.PROMPT_CACHE_INPUTS,
+                **rate_limit.RATE_INPUTS,
+                **retry.RETRY_INPUTS,
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
-
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("response",)
-    FUNCTION     = "call_openrouter"
-    CATEGORY     = "OpenRouter"
-
-    @staticmethod
-    def _to_pil(img):
-        """Convert tensor/ndarray to PIL.Image."""
-        if isinstance(img, Image.Image):
-            return img
-
-        if hasattr(img, "cpu"):
-            arr = img.cpu().detach().numpy()
-        else:
-            arr = np.array(img)
-        arr = np.squeeze(arr)
-
-        if np.issubdtype(arr.dtype, np.floating):
-            arr = (arr * 255).clip(0, 255).astype(np.uint8)
-
-        if arr.ndim == 3 and arr.shape[0] in (1, 3, 4):
-            arr = np.transpose(arr, (1, 2, 0))
-
-        if arr.ndim == 3:
-            ch = arr.shape[2]
-            mode = {1: "L", 3: "RGB", 4: "RGBA"}.get(ch)
-            if mode is None:
-                raise TypeError(f"Unsupported channels: {ch}")
-        elif arr.ndim == 2:
-            mode = "L"
-        else:
-            raise TypeError(f"Cannot handle shape: {arr.shape}")
-
-        return Image.fromarray(arr, mode)
-
+
+    RETURN_TYPES   = ("STRING", "STRING")
+    RETURN_NAMES   = ("response", "responses")
+    OUTPUT_IS_LIST = (False, True)
+    FUNCTION       = "call_openrouter"
+    CATEGORY       = "OpenRouter"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return response_cache.is_changed(**kwargs)
+
+    @tracing.traced("OpenRouterVisionNodeExperimental")
     def call_openrouter(self, api_key, model_name, system_prompt, user_prompt,
-                        img, max_tokens=1024, temperature=0.7, top_p=0.9):
-        # 1) Convert to PIL
-        try:
-            pil = self._to_pil(img)
-        except Exception as e:
-            logger.error("Conversion to PIL failed", exc_info=True)
-            return (f"Error converting image: {e}",)
-
-        # 2) Resize & encode
-        pil.thumbnail((512, 512))
-        buf = io.BytesIO()
-        pil.save(buf, format="JPEG", quality=75)
-        data_url = "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode()
-        logger.debug(f"[VisionNode] data_url length={len(data_url)}")
-
-        # 3) Build structured messages
-        messages = [
-            {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
-            {"role": "user",   "content": [
-                {"type": "text",      "text": user_prompt},
-                {"type": "image_url", "image_url": {"url": data_url}}
-            ]}
-        ]
+                        img, max_tokens=1024, temperature=0.7, top_p=0.9,
+                        cache_mode="use", max_concurrency=4, stream=False, stop_strings="",
+                        max_chars=0,
+                        max_side=512, image_format="JPEG", quality=75, target_bytes=0,
+                        images_per_request=1, max_request_bytes=0, img_2=None, img_3=None, img_4=None,
+                        dedup_frames=False, dedup_distance=4,
+                        check_model=True, prompt_cache="auto",
+                        rpm=0, tpm=0,
+                        max_attempts=3, connect_timeout=10.0, read_timeout=120.0, deadline=300.0,
+                        unique_id=None):
+        if check_model:
+            # Модель без поддержки картинок отсекаем до кодирования и загрузки кадров
+            problem = openrouter_models.check_models([model_name], need_images=True)
+            if problem:
+                err = f"Error: {problem}"
+                return (err, [err])
+
+        # 1) Split into frames (каждый кадр батча отдельно)
+        try:
+            frames = image_utils.split_frames(
+                [i for i in (img, img_2, img_3, img_4) if i is not None], max_side)
+        except Exception as e:
+            logger.error("Conversion to PIL failed", exc_info=True)
+            err = f"Error converting image: {e}"
+            return (err, [err])
+
+        # Почти одинаковые кадры (статичная сцена видео) не отправляем
+        index = None
+        if dedup_frames:
+            total = len(frames)
+            frames, index = image_utils.dedup_frames(frames, dedup_distance)
+            logger.info("[VisionNodeExperimental] %s of %s frame(s) skipped as near-duplicates",
+                        total - len(frames), total)
+
+        # 2) Кадры по запросам (по одному или пачками), запросы параллельно,
+        # порядок ответов сохраняется
+        policy = retry.policy_from_inputs(max_attempts, connect_timeout, read_timeout, deadline)
+        encoding = (image_format, quality, target_bytes)
+        try:
+            groups = image_utils.group_frames(frames, images_per_request, max_request_bytes, encoding,
+                                              max_concurrency, backend="openrouter", model=model_name)
+        except Exception as e:
+            logger.error("[VisionNodeExperimental] Image encoding failed", exc_info=True)
+            err = f"Error encoding image: {e}"
+            return (err, [err])
+        logger.info("[VisionNodeExperimental] %s frame(s) in %s request(s), max_concurrency=%s",
+                    len(frames), len(groups), max_concurrency)
+        responses = batching.map_ordered(
+            lambda group: self._describe(api_key, model_name, system_prompt, user_prompt, group, encoding,
+                                         max_tokens, temperature, top_p, cache_mode,
+                                         stream, stop_strings, max_chars, prompt_cache, unique_id,
+                                         policy, (rpm, tpm)),
+            groups, max_concurrency,
+        )
+        if index is not None and images_per_request == 1:
+            # Ответ на каждый исходный кадр: дубликат получает ответ своего кадра-представителя
+            responses = [responses[i] for i in index]
+        return ("\n".join(responses), responses)
+
+    def _describe(self, api_key, model_name, system_prompt, user_prompt, group, encoding,
+                  max_tokens, temperature, top_p, cache_mode,
+                  stream, stop_strings, max_chars, prompt_cache, unique_id, policy, rate):
+        # Encode (кадр уменьшается в image_utils, результат кэшируется)
+        try:
+            data_urls = [image_utils.encode(frame, *encoding, backend="openrouter", model=model_name).url_blob()
+                         for frame in group]
+        except Exception as e:
+            logger.error("[VisionNodeExperimental] Image encoding failed", exc_info=True)
+            return f"Error encoding image: {e}"
+        logger.debug("[VisionNode] %s image(s), data_url length=%s",
+                     len(data_urls), sum(map(len, data_urls)))
+
+        # Build structured messages: system и текст пользователя — общий для всех запросов
+        # префикс, картинки последними
+        messages = prompt_caching.vision_messages(system_prompt, user_prompt, data_urls,
+                                                  [model_name], prompt_cache)
         payload = {
             "model":      model_name,
             "messages":   messages,
@@ -96,44 +141,66 @@ class OpenRouterVisionNodeExperimental:
             "temperature": temperature,
             "top_p":       top_p,
         }
-        body = json.dumps(payload).encode("utf-8")
-
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type":  "application/json"
-        }
-
-        # 4) Up to 3 attempts
-        for attempt in range(1, 4):
+
+        url = openrouter_api.CHAT_URL
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type":  "application/json"
+        }
+
+        stops = streaming.parse_stop_strings(stop_strings)
+        if stops:
+            payload["stop"] = stops[:4]  # API принимает не больше 4 стоп-строк
+
+        cache_key = response_cache.make_key(url, payload, max_chars=max_chars)
+        cached = response_cache.lookup(cache_key, cache_mode)
+        if cached is not None:
+            return cached
+
+        if stream:
+            payload["stream"] = True
+        prompt_caching.request_usage(payload, prompt_cache)
+        with tracing.span("serialize"):
+            body = request_body.JSONBody(payload)
+
+        tokens = rate_limit.estimate_tokens(payload)
+        limiter = rate_limit.get_limiter(rate_limit.openrouter_key(api_key), *rate)
+
+        def send(attempt, timeout):
             logger.info(
-                f"[VisionNodeExperimental] Attempt {attempt}/3 "
-                f"(max_tokens={max_tokens}, temperature={temperature}, top_p={top_p})"
+                "[VisionNodeExperimental] Attempt %s/%s (max_tokens=%s, temperature=%s, top_p=%s)",
+                attempt, policy.max_attempts, max_tokens, temperature, top_p,
             )
-            req = urllib.request.Request(url, data=body, headers=headers, method="POST")
-
-            try:
-                with urllib.request.urlopen(req) as resp:
-                    j = json.loads(resp.read().decode("utf-8"))
-                    text = j["choices"][0]["message"]["content"]
-                    logger.info(f"[VisionNode] Got content length={len(text)}")
-                    return (text,)
-
-            except urllib.error.HTTPError as e:
-                err = f"HTTPError {e.code}: {e.reason}"
-                logger.warning(f"[VisionNode] {err} on attempt {attempt}")
-                if attempt == 3:
-                    return (f"Error: {err}",)
-
-            except Exception as e:
-                logger.warning(f"[VisionNode] Exception on attempt {attempt}: {e}", exc_info=True)
-                if attempt == 3:
-                    return (f"Error: {e}",)
-
-        # fallback
-        return ("Error: exhausted retries",)
-
-# register node
+            req = urllib.request.Request(url, data=body, headers=headers, method="POST")
+
+            started = time.perf_counter()
+            m = metrics.request("openrouter", model_name, len(body), attempt)
+            with m, limiter.urlopen(req, timeout=timeout, tokens=tokens) as resp:
+                m.first_byte(resp)
+                if stream:
+                    text, stats = streaming.read_chat_stream(resp, stops, max_chars, unique_id,
+                                                             "[VisionNodeExperimental]", started,
+                                                             timeout.expires)
+                    m.usage(stats.usage)
+                else:
+                    raw = resp.read()
+                    with tracing.span("parse"):
+                        j = json.loads(raw)
+                    m.usage(j.get("usage"))
+                    text = j["choices"][0]["message"]["content"]
+                    text, _ = streaming.apply_cutoff(text, stops, max_chars)
+                logger.info("[VisionNode] Got content length=%s", len(text))
+                return text
+
+        try:
+            text = singleflight.do(cache_key, lambda: policy.run(send, logger, "[VisionNodeExperimental]"))
+        except Exception as e:
+            return f"Error: {retry.describe_error(e)}"
+
+        response_cache.store(cache_key, text, cache_mode)
+        return text
+
+# register node
 NODE_CLASS_MAPPINGS = {
     "OpenRouterVisionNodeExperimental": OpenRouterVisionNodeExperimental
 }
@@ -0,0 +1,39 @@
+# progress.py
+#
+# Отправка промежуточного текста в интерфейс ComfyUI.
+# Вне ComfyUI (или в старых версиях без send_progress_text) — ничего не делает.
+
+import time
+
+UPDATE_INTERVAL = 0.25
+
+
+def _prompt_server():
+    try:
+        from server import PromptServer
+        return PromptServer.instance
+    except Exception:
+        return None
+
+
+class TextReporter:
+    """Throttled partial-text updates for a single node."""
+
+    def __init__(self, unique_id, interval=UPDATE_INTERVAL):
+        self.unique_id = unique_id
+        self.interval = interval
+        self._last = 0.0
+        server = _prompt_server() if unique_id is not None else None
+        self._send = getattr(server, "send_progress_text", None)
+
+    def update(self, text, force=False):
+        if self._send is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        try:
+            self._send(text, self.unique_id)
+        except Exception:
+            self._send = None
@@ -0,0 +1,73 @@
+# prompt_caching.py
+#
+# Подсказки кэширования префикса промпта для OpenRouter.
+# Длинный system_prompt, одинаковый во всех вызовах, провайдер может не
+# пересчитывать (prefill), если префикс запроса совпадает байт в байт.
+# OpenAI, DeepSeek, Grok кэшируют такой префикс сами, а Anthropic и Gemini —
+# только по явной метке cache_control на последней части стабильного
+# префикса. Поэтому сообщения всегда строятся в одном порядке: system,
+# затем текст пользователя, затем картинки. Метка ставится в конце общей
+# для всех вызовов части.
+#
+# Сколько токенов пришло из кэша, видно в usage.prompt_tokens_details.cached_tokens
+# (метрика cached_prompt_tokens_total).
+
+PROMPT_CACHE_MODES = ["auto", "on", "off"]
+
+# Опциональный вход OpenRouter-нод:
+#   auto — метка только для провайдеров с явным кэшем и достаточно длинного префикса;
+#   on   — метка всегда; off — без метки и без запроса статистики usage
+PROMPT_CACHE_INPUTS = {
+    "prompt_cache": (PROMPT_CACHE_MODES, {"default": "auto"}),
+}
+
+# Anthropic не кэширует префиксы короче 1024 токенов (~4 символа на токен)
+MIN_PREFIX_CHARS = 4096
+EXPLICIT_CACHE_PREFIXES = ("anthropic/", "google/gemini")
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def use_breakpoint(models, prefix_chars, mode="auto"):
+    if mode == "off":
+        return False
+    if mode == "on":
+        return True
+    return (prefix_chars >= MIN_PREFIX_CHARS
+            and any(m.startswith(EXPLICIT_CACHE_PREFIXES) for m in models))
+
+
+def _text(text, cached):
+    part = {"type": "text", "text": text}
+    if cached:
+        part["cache_control"] = dict(CACHE_CONTROL)
+    return part
+
+
+def text_messages(system_prompt, user_prompt, models, mode="auto"):
+    """[system, user] with a cache breakpoint after the (shared) system prompt."""
+    if use_breakpoint(models, len(system_prompt), mode):
+        system = [_text(system_prompt, True)]
+    else:
+        # Без метки — прежняя форма, чтобы не менять ключи кэша ответов
+        system = system_prompt
+    return [
+        {"role": "system", "content": system},
+        {"role": "user",   "content": user_prompt},
+    ]
+
+
+def vision_messages(system_prompt, user_prompt, image_urls, models, mode="auto"):
+    """[system, user(text, images...)]; the breakpoint closes the prefix shared by every request."""
+    cached = use_breakpoint(models, len(system_prompt) + len(user_prompt), mode)
+    return [
+        {"role": "system", "content": [_text(system_prompt, False)]},
+        {"role": "user",   "content": [_text(user_prompt, cached)] + [
+            {"type": "image_url", "image_url": {"url": url}} for url in image_urls
+        ]},
+    ]
+
+
+def request_usage(payload, mode="auto"):
+    """Ask OpenRouter for detailed usage (cached tokens) unless prompt caching is off."""
+    if mode != "off":
+        payload["usage"] = {"include": True}
@@ -0,0 +1,270 @@
+# rate_limit.py
+#
+# Общий на процесс ограничитель частоты запросов (RPM) и токенов (TPM)
+# на клиенте: token bucket на каждый ключ (API-ключ OpenRouter или хост
+# Ollama). Вызовы не падают, а ждут своей очереди (FIFO), так что большой
+# пакет идёт ровным темпом вместо серии 429 и повторов.
+#
+# Лимиты задаются входами rpm/tpm и подстраиваются по заголовкам ответа
+# x-ratelimit-* (remaining/reset, а для *-requests/*-tokens — и limit).
+
+import hashlib
+import logging
+import re
+import threading
+import time
+import urllib.error
+
+from . import http_pool, request_body, retry, token_budget
+
+logger = logging.getLogger("RateLimit")
+logger.setLevel(logging.DEBUG)
+
+BURST_SECONDS = 2.0    # объём ведра — столько секунд лимита
+IMAGE_TOKENS = 1000    # грубая оценка картинки в токенах
+PENALTY_429 = 5.0      # пауза после 429 без Retry-After
+
+# Опциональные входы нод (0 — без лимита на клиенте, только по заголовкам сервера).
+# Лимит общий на ключ: действует значение из последнего вызова, 0 снимает прежний
+RATE_INPUTS = {
+    "rpm": ("INT", {"default": 0, "min": 0, "max": 100000}),
+    "tpm": ("INT", {"default": 0, "min": 0, "max": 100000000}),
+}
+
+
+class _Bucket:
+    def __init__(self):
+        self.configured = 0   # в минуту, из входов ноды
+        self.learned = 0      # в минуту, из заголовков
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    @property
+    def per_minute(self):
+        limits = [x for x in (self.configured, self.learned) if x > 0]
+        return min(limits) if limits else 0
+
+    @property
+    def capacity(self):
+        return max(1.0, self.per_minute * BURST_SECONDS / 60.0)
+
+    def set_rate(self, configured=None, learned=None):
+        was_limited = self.per_minute > 0
+        if configured is not None:
+            self.configured = max(0, configured)
+        if learned:
+            self.learned = learned
+        if self.per_minute and not was_limited:
+            self.level = self.capacity
+            self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.per_minute:
+            self.level = min(self.capacity,
+                             self.level + (now - self.updated) * self.per_minute / 60.0)
+        self.updated = now
+
+    def delay(self, amount, now):
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.per_minute and amount:
+            amount = min(amount, self.capacity)
+            if self.level < amount:
+                wait = max(wait, (amount - self.level) * 60.0 / self.per_minute)
+        return wait
+
+    def take(self, amount):
+        # Запрос больше ведра пропускаем при полном ведре и уходим в минус:
+        # следующие вызовы ждут, пока долг не восполнится
+        if self.per_minute and amount:
+            self.level -= amount
+
+    def observe(self, remaining, reset, now):
+        if remaining is None:
+            return
+        if self.per_minute:
+            self._refill(now)
+            self.level = min(self.level, remaining)
+        if remaining <= 0 and reset:
+            self.blocked_until = max(self.blocked_until, now + reset)
+
+
+def _parse_duration(value):
+    """Reset value: seconds, epoch (s or ms), or a Go-style duration like "6m0s" / "20ms"."""
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        x = float(value)
+    except ValueError:
+        total = 0.0
+        parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+        if not parts:
+            return None
+        for num, unit in parts:
+            total += float(num) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+        return total
+    if x > 1e12:
+        return max(0.0, x / 1000.0 - time.time())
+    if x > 1e9:
+        return max(0.0, x - time.time())
+    return x
+
+
+def _int_header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Limiter:
+    """Request and token buckets for one key; callers are served in arrival order."""
+
+    def __init__(self, key):
+        self.key = key
+        self.requests = _Bucket()
+        self.tokens = _Bucket()
+        self._lock = threading.Lock()
+        self._turn = threading.Condition(self._lock)
+        self._next_ticket = 0
+        self._serving = 0
+        self.waited = 0.0
+        self.throttled = 0
+
+    def configure(self, rpm=0, tpm=0):
+        """Set the client-side limits; 0 clears an earlier value (header limits stay)."""
+        with self._lock:
+            self.requests.set_rate(configured=rpm)
+            self.tokens.set_rate(configured=tpm)
+
+    def acquire(self, tokens=0):
+        """Block until one request with ~`tokens` tokens fits; return seconds waited."""
+        started = time.monotonic()
+        with self._lock:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving:
+                self._turn.wait()
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    wait = max(self.requests.delay(1, now), self.tokens.delay(tokens, now))
+                    if wait <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        break
+                time.sleep(wait)
+        finally:
+            with self._lock:
+                self._serving += 1
+                self._turn.notify_all()
+        waited = time.monotonic() - started
+        if waited > 0.05:
+            with self._lock:
+                self.waited += waited
+                self.throttled += 1
+            logger.info("RateLimit: %s waited %.2fs", self.key, waited)
+        return waited
+
+    def observe(self, headers):
+        """Adapt to x-ratelimit-* headers of a response (or of an HTTPError)."""
+        if headers is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for bucket, suffix in ((self.requests, "-requests"), (self.tokens, "-tokens")):
+                limit = _int_header(headers, f"x-ratelimit-limit{suffix}")
+                if limit:
+                    # OpenAI-совместимые заголовки — лимит в минуту
+                    bucket.set_rate(learned=limit)
+                bucket.observe(_int_header(headers, f"x-ratelimit-remaining{suffix}"),
+                               _parse_duration(headers.get(f"x-ratelimit-reset{suffix}")), now)
+            # OpenRouter: X-RateLimit-Limit/Remaining/Reset без суффикса, интервал не указан
+            self.requests.observe(_int_header(headers, "x-ratelimit-remaining"),
+                                  _parse_duration(headers.get("x-ratelimit-reset")), now)
+
+    def penalize(self, seconds):
+        with self._lock:
+            self.requests.blocked_until = max(self.requests.blocked_until,
+                                              time.monotonic() + seconds)
+
+    def urlopen(self, req, timeout=None, tokens=0, cancel=None):
+        """http_pool.urlopen paced by this limiter; learns from the response headers."""
+        waited = self.acquire(tokens)
+        try:
+            resp = http_pool.urlopen(req, timeout=timeout, cancel=cancel)
+        except urllib.error.HTTPError as e:
+            self.observe(e.headers)
+            if e.code == 429:
+                self.penalize(retry.retry_after(e) or PENALTY_429)
+            raise
+        self.observe(resp.headers)
+        resp.queued = waited
+        return resp
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rpm":       self.requests.per_minute,
+                "tpm":       self.tokens.per_minute,
+                "throttled": self.throttled,
+                "waited_s":  round(self.waited, 3),
+            }
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(key, rpm=0, tpm=0):
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(key)
+        if limiter is None:
+            limiter = _LIMITERS[key] = Limiter(key)
+    limiter.configure(rpm, tpm)
+    return limiter
+
+
+def openrouter_key(api_key):
+    # Сам ключ в логах и статистике не светим
+    return "openrouter:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def ollama_key(host):
+    return f"ollama:{host}"
+
+
+def estimate_tokens(payload):
+    """Rough token count of a chat payload (token_budget estimate) plus the completion budget."""
+    text = 0
+    images = 0
+
+    def walk(node, key=None):
+        nonlocal text, images
+        if isinstance(node, str):
+            if key == "images" or node.startswith("data:"):
+                images += 1
+            else:
+                text += token_budget.count_tokens(node)
+        elif isinstance(node, request_body.Blob):
+            images += 1
+        elif isinstance(node, dict):
+            for k, v in node.items():
+                walk(v, k)
+        elif isinstance(node, list):
+            for v in node:
+                walk(v, key)
+
+    walk(payload.get("messages") or [])
+    completion = payload.get("max_tokens") or (payload.get("options") or {}).get("num_predict") or 0
+    return text + images * IMAGE_TOKENS + max(0, int(completion))
+
+
+def stats():
+    with _LIMITERS_LOCK:
+        limiters = list(_LIMITERS.values())
+    return {limiter.key: limiter.stats() for limiter in limiters}
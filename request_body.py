@@ -0,0 +1,107 @@
+# request_body.py
+#
+# Тело JSON-запроса без лишних копий больших строк.
+# Картинка в base64 — самый большой объект запроса, и раньше она копировалась
+# на каждом шаге: decode в str, склейка data URL, json.dumps, .encode("utf-8").
+# Здесь картинка лежит в payload как Blob — ссылка на уже закодированные байты
+# base64. Тело запроса собирается как последовательность кусков: мелкие
+# сегменты JSON-конверта и сами байты картинок. Длина известна заранее
+# (Content-Length), и куски уходят в сокет по очереди.
+
+import json
+import uuid
+
+COALESCE_BYTES = 16 * 1024   # куски меньше этого склеиваются, чтобы не слать пакет на каждый
+
+
+class Blob:
+    """JSON string given as ASCII byte parts that need no escaping (base64, data URL prefix)."""
+
+    __slots__ = ("parts", "length")
+
+    def __init__(self, *parts):
+        self.parts = parts
+        self.length = sum(len(p) for p in parts)
+
+    def __len__(self):
+        return self.length
+
+    def text(self):
+        # Копия — только для отладки и совместимости
+        return b"".join(self.parts).decode("ascii")
+
+
+def segments(payload, **dumps_kwargs):
+    """JSON of payload as a list of encoded bytes segments and Blob objects, in order.
+
+    Joining the segments (Blobs quoted) gives exactly json.dumps(payload, **dumps_kwargs)
+    with every Blob replaced by its text.
+    """
+    blobs = []
+    nonce = uuid.uuid4().hex
+
+    def default(obj):
+        if isinstance(obj, Blob):
+            blobs.append(obj)
+            return f"{nonce}:{len(blobs) - 1}"
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    text = json.dumps(payload, default=default, **dumps_kwargs)
+    out = []
+    pos = 0
+    for i, blob in enumerate(blobs):
+        marker = f'"{nonce}:{i}"'
+        idx = text.index(marker, pos)
+        out.append(text[pos:idx].encode("utf-8"))
+        out.append(blob)
+        pos = idx + len(marker)
+    out.append(text[pos:].encode("utf-8"))
+    return out
+
+
+class JSONBody:
+    """Request body for http_pool: iterates over chunks, len() is the Content-Length.
+
+    Can be sent any number of times (retries re-iterate the same chunks).
+    """
+
+    def __init__(self, payload):
+        chunks = []
+        small = []
+        small_bytes = 0
+
+        def flush():
+            nonlocal small_bytes
+            if small:
+                chunks.append(b"".join(small))
+                small.clear()
+                small_bytes = 0
+
+        def add(part):
+            nonlocal small_bytes
+            if len(part) >= COALESCE_BYTES:
+                flush()
+                chunks.append(part)
+                return
+            small.append(part)
+            small_bytes += len(part)
+            if small_bytes >= COALESCE_BYTES:
+                flush()
+
+        for seg in segments(payload):
+            if isinstance(seg, Blob):
+                add(b'"')
+                for part in seg.parts:
+                    add(part)
+                add(b'"')
+            else:
+                add(seg)
+        flush()
+        self.chunks = chunks
+        self.length = sum(len(c) for c in chunks)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.chunks)
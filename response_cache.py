@@ -0,0 +1,221 @@
+# response_cache.py
+#
+# Персистентный кэш ответов LLM на диске (sqlite) с LRU-вытеснением
+# по суммарному размеру и опциональным TTL. Ключ — sha256 от канонического
+# JSON запроса (url, модель, сообщения вместе с картинкой, параметры).
+#
+# Настройки через переменные окружения:
+#   OPENROUTER_CACHE_DIR        — каталог для cache.sqlite
+#   OPENROUTER_CACHE_MAX_MB     — лимит размера (по умолчанию 256)
+#   OPENROUTER_CACHE_TTL_HOURS  — время жизни записи (0 = бессрочно)
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from . import metrics, request_body, tracing
+
+logger = logging.getLogger("ResponseCache")
+logger.setLevel(logging.DEBUG)
+
+CACHE_MODES = ["use", "bypass", "refresh"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key      TEXT PRIMARY KEY,
+    value    TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    created  REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed);
+"""
+
+
+def cache_dir():
+    """Directory for the on-disk caches of this package."""
+    env = os.environ.get("OPENROUTER_CACHE_DIR")
+    if env:
+        return env
+    try:
+        import folder_paths
+        return os.path.join(folder_paths.get_user_directory(), "openrouter_cache")
+    except Exception:
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return float(default)
+
+
+class ResponseCache:
+    """Size-bounded LRU store of response strings keyed by request hash."""
+
+    def __init__(self, path, max_bytes, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl or None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._total = 0
+
+    def _conn(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript(_SCHEMA)
+            row = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            self._total = row[0]
+        return self._db
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            row = db.execute("SELECT value, size, created FROM responses WHERE key = ?",
+                             (key,)).fetchone()
+            if row is not None and self.ttl and now - row[2] > self.ttl:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                db.commit()
+                self._total -= row[1]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            db = self._conn()
+            old = db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._total += size - (old[0] if old else 0)
+            self.stores += 1
+            self._evict(db)
+            db.commit()
+
+    def _evict(self, db):
+        while self._total > self.max_bytes:
+            rows = db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._total = 0
+                return
+            for key, size in rows:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total -= size
+                self.evictions += 1
+                if self._total <= self.max_bytes:
+                    break
+
+    def clear(self):
+        with self._lock:
+            db = self._conn()
+            db.execute("DELETE FROM responses")
+            db.commit()
+            self._total = 0
+
+    def stats(self):
+        return {
+            "hits":      self.hits,
+            "misses":    self.misses,
+            "stores":    self.stores,
+            "evictions": self.evictions,
+            "bytes":     self._total,
+        }
+
+
+def make_key(url, payload, **extra):
+    """Content hash of a request: url + canonical JSON of the payload.
+
+    Non-empty `extra` values (client-side options that change the result)
+    are mixed into the key as well.
+    """
+    with tracing.span("cache_key"):
+        h = hashlib.sha256(url.encode("utf-8"))
+        # Картинки (request_body.Blob) хэшируются по частям, без сборки строки JSON целиком;
+        # ключ тот же, что от json.dumps с картинками-строками
+        for seg in request_body.segments(payload, sort_keys=True, separators=(",", ":"),
+                                         ensure_ascii=False):
+            if isinstance(seg, request_body.Blob):
+                h.update(b'"')
+                for part in seg.parts:
+                    h.update(part)
+                h.update(b'"')
+            else:
+                h.update(seg)
+        extra = {k: v for k, v in extra.items() if v}
+        if extra:
+            h.update(json.dumps(extra, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ResponseCache(
+                os.path.join(cache_dir(), "cache.sqlite"),
+                max_bytes=int(_env_float("OPENROUTER_CACHE_MAX_MB", 256) * 1024 * 1024),
+                ttl=_env_float("OPENROUTER_CACHE_TTL_HOURS", 0) * 3600,
+            )
+        return _CACHE
+
+
+def lookup(key, cache_mode):
+    """Cached response for `key`, or None when missing or not allowed by cache_mode."""
+    if cache_mode != "use":
+        return None
+    try:
+        value = get_cache().get(key)
+    except Exception as e:
+        logger.warning("ResponseCache: lookup failed: %s", e)
+        return None
+    metrics.inc("cache_lookups_total", result="miss" if value is None else "hit")
+    if value is not None:
+        logger.info("ResponseCache: hit %s", key[:12])
+    return value
+
+
+def store(key, value, cache_mode):
+    if cache_mode == "bypass":
+        return
+    try:
+        get_cache().put(key, value)
+    except Exception as e:
+        logger.warning("ResponseCache: store failed: %s", e)
+
+
+def is_changed(cache_mode="use", **inputs):
+    """IS_CHANGED helper: fingerprint of the plain inputs; NaN forces a re-run on refresh."""
+    if cache_mode == "refresh":
+        return float("nan")
+    plain = {k: v for k, v in inputs.items() if isinstance(v, (str, int, float, bool))}
+    return make_key(cache_mode, plain)
@@ -0,0 +1,143 @@
+# retry.py
+#
+# Общая политика повторов для всех нод: повторяем только то, что имеет
+# смысл повторять (сетевые ошибки, 408/429/5xx), с экспоненциальной
+# задержкой и jitter, учитываем Retry-After и общий дедлайн на вызов.
+
+import email.utils
+import http.client
+import json
+import random
+import time
+import urllib.error
+
+from . import tracing
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 520, 522, 524}
+
+# Опциональные входы нод
+RETRY_INPUTS = {
+    "max_attempts":    ("INT",   {"default": 3, "min": 1, "max": 10}),
+    "connect_timeout": ("FLOAT", {"default": 10.0, "min": 0.5, "max": 300.0, "step": 0.5}),
+    "read_timeout":    ("FLOAT", {"default": 120.0, "min": 1.0, "max": 3600.0, "step": 1.0}),
+    "deadline":        ("FLOAT", {"default": 300.0, "min": 0.0, "max": 7200.0, "step": 1.0}),
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Timeout(tuple):
+    """(connect, read) pair for http_pool.urlopen; `expires` is the call's deadline
+    as a time.monotonic() value (None without a deadline) for the stream readers."""
+
+    def __new__(cls, connect, read, expires=None):
+        self = super().__new__(cls, (connect, read))
+        self.expires = expires
+        return self
+
+
+def describe_error(exc):
+    """Short error text in the format the nodes return to the graph."""
+    if isinstance(exc, urllib.error.HTTPError):
+        return f"HTTPError {exc.code}: {exc.reason}"
+    return str(exc) or type(exc).__name__
+
+
+def retry_after(exc):
+    """Seconds from a Retry-After header (delta or HTTP date), or None."""
+    headers = getattr(exc, "headers", None)
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def is_retryable(exc):
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code in RETRYABLE_STATUS
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    # URLError, socket.timeout, ConnectionError и т.п. — подклассы OSError
+    if isinstance(exc, (OSError, http.client.HTTPException)):
+        return True
+    # Обрезанный или ошибочный ответ с кодом 200 (нет "choices", ошибка в потоке)
+    return isinstance(exc, (KeyError, IndexError, json.JSONDecodeError, RuntimeError))
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, connect_timeout=10.0, read_timeout=120.0,
+                 deadline=300.0, base_delay=0.5, max_delay=30.0):
+        self.max_attempts = max(1, int(max_attempts))
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline or None
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt, exc=None):
+        """Full-jitter exponential delay; Retry-After wins when the server sends it."""
+        hinted = retry_after(exc) if exc is not None else None
+        if hinted is not None:
+            return hinted
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+    def run(self, fn, logger, label, cancel=None):
+        """Call fn(attempt, timeout) until it succeeds; re-raise the last error.
+
+        `timeout` is a (connect, read) Timeout for http_pool.urlopen, already
+        clipped to what is left of the deadline; pass `timeout.expires` to the
+        streaming readers so a slow stream cannot run past it. A cancelled
+        `cancel` token (http_pool.CancelToken) stops further attempts.
+        """
+        started = time.monotonic()
+        expires = started + self.deadline if self.deadline else None
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = None
+            if self.deadline:
+                remaining = self.deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"deadline of {self.deadline:.0f}s exceeded")
+            connect = self.connect_timeout
+            read = self.read_timeout
+            if remaining is not None:
+                connect = min(connect, remaining)
+                read = min(read, remaining)
+
+            try:
+                with tracing.span("attempt", cat="request", attempt=attempt):
+                    return fn(attempt, Timeout(connect, read, expires))
+            except Exception as e:
+                if cancel is not None and cancel.cancelled:
+                    raise
+                err = describe_error(e)
+                if not is_retryable(e) or attempt == self.max_attempts:
+                    logger.warning("%s: %s on attempt %s, giving up", label, err, attempt)
+                    raise
+                delay = self.backoff(attempt, e)
+                if self.deadline:
+                    left = self.deadline - (time.monotonic() - started)
+                    if delay >= left:
+                        logger.warning("%s: %s on attempt %s, retry in %.1fs would pass the deadline",
+                                       label, err, attempt, delay)
+                        raise
+                logger.warning("%s: %s on attempt %s, retrying in %.2fs", label, err, attempt, delay,
+                               exc_info=not isinstance(e, urllib.error.HTTPError))
+                with tracing.span("backoff", delay=round(delay, 3)):
+                    time.sleep(delay)
+
+
+def policy_from_inputs(max_attempts=3, connect_timeout=10.0, read_timeout=120.0, deadline=300.0):
+    return RetryPolicy(max_attempts=max_attempts, connect_timeout=connect_timeout,
+                       read_timeout=read_timeout, deadline=deadline)
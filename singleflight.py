@@ -0,0 +1,85 @@
+# singleflight.py
+#
+# Склейка одинаковых запросов в полёте: если несколько нод (или промптов
+# в очереди) одновременно отправляют один и тот же запрос, к серверу уходит
+# только первый, остальные ждут и получают его результат (или его ошибку).
+# Ключ — тот же хэш канонического запроса, что и у кэша ответов.
+
+import logging
+import threading
+
+from . import metrics
+
+logger = logging.getLogger("Singleflight")
+logger.setLevel(logging.DEBUG)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class Group:
+    """Runs fn() once per key among concurrent callers."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+        metrics.inc("upstream_calls_total" if leader else "coalesced_total")
+
+        if not leader:
+            logger.info("Singleflight: joined in-flight request %s (%s waiting)",
+                        key[:12], call.waiters)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls":     self.calls,
+                "upstream":  self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+_GROUP = Group()
+
+
+def get_group():
+    return _GROUP
+
+
+def do(key, fn):
+    return _GROUP.do(key, fn)
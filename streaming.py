@@ -0,0 +1,242 @@
+# streaming.py
+#
+# Потоковое чтение ответов chat/completions (server-sent events)
+# с ранней остановкой по стоп-строкам и лимиту символов.
+
+import json
+import logging
+import time
+
+from . import progress, retry, tracing
+
+logger = logging.getLogger("Streaming")
+logger.setLevel(logging.DEBUG)
+
+
+def parse_stop_strings(stop_strings):
+    """One stop string per line; empty lines are ignored."""
+    if not stop_strings:
+        return []
+    return [s for s in stop_strings.splitlines() if s]
+
+
+def apply_cutoff(text, stops, max_chars):
+    """Cut text at the first stop string and at max_chars (0 = no limit)."""
+    cut = len(text)
+    for stop in stops:
+        idx = text.find(stop)
+        if idx != -1:
+            cut = min(cut, idx)
+    if max_chars and max_chars > 0:
+        cut = min(cut, max_chars)
+    return text[:cut], cut < len(text)
+
+
+def _notify(resp, method, *args):
+    # Есть только у http_pool.PooledResponse; ответ urllib (через прокси) их не знает
+    fn = getattr(resp, method, None)
+    if fn is not None:
+        fn(*args)
+
+
+class IncompleteStream(RuntimeError):
+    """The stream ended before its terminal event (connection cut mid-answer); retryable."""
+
+
+def _lines(resp, expires):
+    # Таймаут сокета ограничивает одно чтение, а не весь ответ: поток, где чанки
+    # идут раз в несколько секунд, растянулся бы за дедлайн вызова. Поэтому дедлайн
+    # проверяем на каждой строке, а таймаут сокета урезаем до остатка
+    if expires is None:
+        yield from resp
+        return
+    lines = iter(resp)
+    while True:
+        left = expires - time.monotonic()
+        if left > 0:
+            _notify(resp, "clip_read_timeout", left)
+            try:
+                line = next(lines, None)
+            except TimeoutError:
+                if time.monotonic() < expires:
+                    raise
+                left = 0
+        if left <= 0:
+            _notify(resp, "abandon")
+            raise retry.DeadlineExceeded("deadline exceeded while reading the stream")
+        if line is None:
+            return
+        yield line
+
+
+def iter_sse_data(resp, expires=None):
+    """Yield the `data:` payload of every SSE event until [DONE].
+
+    `expires` is a time.monotonic() deadline (retry.Timeout.expires); past it
+    the read aborts with retry.DeadlineExceeded.
+    """
+    for data in _sse_events(resp, expires):
+        if data == "[DONE]":
+            return
+        yield data
+
+
+def _sse_events(resp, expires=None):
+    # Как iter_sse_data, но отдаёт и сам [DONE]: читателю надо отличить конец ответа от обрыва
+    data_lines = []
+    for raw in _lines(resp, expires):
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if line.startswith(":"):
+            # keep-alive комментарии (": OPENROUTER PROCESSING")
+            continue
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip(" "))
+            continue
+        if line == "" and data_lines:
+            data = "\n".join(data_lines)
+            data_lines = []
+            if data == "[DONE]":
+                _notify(resp, "mark_finished")
+                yield data
+                return
+            yield data
+    if data_lines:
+        data = "\n".join(data_lines)
+        if data == "[DONE]":
+            _notify(resp, "mark_finished")
+        yield data
+
+
+class StreamStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ttft = None
+        self.chunks = 0
+        self.stopped_early = False
+        self.finish_reason = None
+        self.usage = None
+
+
+def read_chat_stream(resp, stops=(), max_chars=0, unique_id=None, label="Stream", started=None,
+                     expires=None):
+    """Consume an OpenAI-compatible SSE stream and return (text, StreamStats).
+
+    Returns as soon as a stop string or max_chars is reached; the caller then
+    closes the response, which drops the connection and stops generation.
+    `started` is the perf_counter() value when the request was sent; past
+    `expires` (retry.Timeout.expires) the read raises retry.DeadlineExceeded.
+    """
+    with tracing.span("read_stream") as span:
+        text, stats = _read_chat_stream(resp, stops, max_chars, unique_id, label, started, expires)
+        span.set(chunks=stats.chunks, chars=len(text), stopped_early=stats.stopped_early)
+    return text, stats
+
+
+def _read_chat_stream(resp, stops, max_chars, unique_id, label, started, expires):
+    stats = StreamStats()
+    if started is not None:
+        stats.started = started
+    text = ""
+    # Стоп-строка может прийти разрезанной между чанками, поэтому
+    # проверяем хвост длиной в самую длинную стоп-строку.
+    overlap = max((len(s) for s in stops), default=0)
+    checked = 0
+    reporter = progress.TextReporter(unique_id)
+
+    done = False
+    for data in _sse_events(resp, expires):
+        if data == "[DONE]":
+            done = True
+            break
+        chunk = json.loads(data)
+        if "error" in chunk:
+            err = chunk["error"]
+            raise RuntimeError(f"Stream error: {err.get('message', err) if isinstance(err, dict) else err}")
+        if chunk.get("usage"):
+            stats.usage = chunk["usage"]
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        choice = choices[0]
+        if choice.get("finish_reason"):
+            stats.finish_reason = choice["finish_reason"]
+        delta = (choice.get("delta") or {}).get("content") or ""
+        if not delta:
+            continue
+
+        if stats.ttft is None:
+            stats.ttft = time.perf_counter() - stats.started
+            tracing.record("first_token", stats.started)
+            logger.info("%s: time to first token %.0f ms", label, stats.ttft * 1000)
+        stats.chunks += 1
+        text += delta
+
+        if stops or max_chars:
+            start = max(0, checked - overlap)
+            head, cut = apply_cutoff(text[start:], stops, 0)
+            if cut:
+                text = text[:start] + head
+            if max_chars and len(text) >= max_chars:
+                text = text[:max_chars]
+                cut = True
+            checked = len(text)
+            if cut:
+                stats.stopped_early = True
+                # Соединение закрывается без дочитывания — так сервер прекращает генерацию
+                _notify(resp, "abandon")
+                logger.info("%s: stopped early after %d chars", label, len(text))
+                reporter.update(text, force=True)
+                return text, stats
+
+        reporter.update(text)
+
+    if not done and stats.finish_reason is None:
+        # Обрыв на середине ответа: не отдаём (и не кэшируем) обрезанный текст как успех
+        raise IncompleteStream(f"stream ended after {len(text)} chars without [DONE]")
+    reporter.update(text, force=True)
+    return text, stats
+
+
+def iter_ndjson(resp, expires=None):
+    """Yield one decoded JSON object per non-empty line (Ollama native API)."""
+    for raw in _lines(resp, expires):
+        line = raw.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_ollama_stream(resp, unique_id=None, label="Ollama", started=None, expires=None):
+    """Consume an Ollama /api/chat NDJSON stream; return (text, final chunk with timings).
+
+    Past `expires` (retry.Timeout.expires) the read raises retry.DeadlineExceeded.
+    """
+    with tracing.span("read_stream") as span:
+        text, final = _read_ollama_stream(resp, unique_id, label, started, expires)
+        span.set(chars=len(text), eval_count=final.get("eval_count"))
+    return text, final
+
+
+def _read_ollama_stream(resp, unique_id, label, started, expires):
+    reporter = progress.TextReporter(unique_id)
+    started = time.perf_counter() if started is None else started
+    text = ""
+    final = {}
+    for chunk in iter_ndjson(resp, expires):
+        if "error" in chunk:
+            raise RuntimeError(f"Ollama error: {chunk['error']}")
+        delta = (chunk.get("message") or {}).get("content") or ""
+        if delta:
+            if not text:
+                tracing.record("first_token", started)
+                logger.info("%s: time to first token %.0f ms",
+                            label, (time.perf_counter() - started) * 1000)
+            text += delta
+            reporter.update(text)
+        if chunk.get("done"):
+            final = chunk
+            _notify(resp, "mark_finished")
+            break
+    if not final:
+        raise IncompleteStream(f"Ollama stream ended after {len(text)} chars without \"done\"")
+    reporter.update(text, force=True)
+    return text, final
@@ -0,0 +1,159 @@
+# token_budget.py
+#
+# Локальная оценка числа токенов и проверка, что промпт помещается
+# в контекст модели, — до отправки запроса. Слишком длинный user_prompt
+# иначе загружается целиком и получает 400 от сервера.
+#
+# Оценка по умолчанию — байты UTF-8 / 4: для английского это близко
+# к настоящим токенизаторам, для кириллицы немного завышено (безопасно).
+# Точный подсчёт — через tiktoken, если он установлен:
+#   OPENROUTER_TOKENIZER=tiktoken
+# или через set_tokenizer(fn).
+#
+# Лимит: max_prompt_tokens, иначе длина контекста модели из каталога
+# OpenRouter (или num_ctx для Ollama) минус запас на ответ.
+
+import logging
+import math
+import os
+import threading
+
+from . import metrics, openrouter_models
+
+logger = logging.getLogger("TokenBudget")
+logger.setLevel(logging.DEBUG)
+
+TRUNCATE_MODES = ["off", "error", "keep_head", "keep_tail", "cut_middle"]
+
+# Опциональные входы текстовых нод:
+#   off — без проверки; error — не отправлять слишком длинный промпт;
+#   keep_head / keep_tail — оставить начало / конец user_prompt;
+#   cut_middle — оставить начало и конец, вырезав середину
+BUDGET_INPUTS = {
+    "truncate":          (TRUNCATE_MODES, {"default": "off"}),
+    # 0 — по длине контекста модели
+    "max_prompt_tokens": ("INT", {"default": 0, "min": 0, "max": 10_000_000}),
+}
+
+MESSAGE_OVERHEAD = 4     # служебные токены на сообщение
+DEFAULT_RESERVE = 1024   # запас на ответ, если max_tokens не задан
+MARKER = "\n[…]\n"
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+class PromptTooLong(ValueError):
+    pass
+
+
+def _heuristic(text):
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def set_tokenizer(fn):
+    """Use fn(text) -> int for every estimate (None restores the default)."""
+    global _tokenizer
+    with _tokenizer_lock:
+        _tokenizer = fn
+
+
+def _get_tokenizer():
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            _tokenizer = _heuristic
+            if os.environ.get("OPENROUTER_TOKENIZER", "").lower() == "tiktoken":
+                try:
+                    import tiktoken
+                    encoding = tiktoken.get_encoding("o200k_base")
+                    _tokenizer = lambda text: len(encoding.encode(text, disallowed_special=()))
+                except Exception as e:
+                    logger.warning("TokenBudget: tiktoken unavailable (%s), using the heuristic", e)
+        return _tokenizer
+
+
+def count_tokens(text):
+    return _get_tokenizer()(text) if text else 0
+
+
+def _cut(text, keep_chars, from_start):
+    """Prefix (or suffix) of about keep_chars characters, cut at whitespace when one is near."""
+    if from_start:
+        piece = text[:keep_chars]
+        space = piece.rfind(" ", max(0, keep_chars - 200))
+        return piece[:space] if space > 0 else piece
+    piece = text[len(text) - keep_chars:] if keep_chars else ""
+    space = piece.find(" ", 0, 200)
+    return piece[space + 1:] if space >= 0 else piece
+
+
+def truncate(text, max_tokens, mode):
+    """Shorten text to at most ~max_tokens; return (text, tokens removed)."""
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text, 0
+    if max_tokens <= 0:
+        return "", total
+    ratio = max_tokens / total
+    # Оценка не линейна по символам (разные алфавиты) — ужимаем, пока не влезет
+    for _ in range(8):
+        keep = int(len(text) * ratio)
+        if mode == "keep_head":
+            result = _cut(text, keep, True)
+        elif mode == "keep_tail":
+            result = _cut(text, keep, False)
+        else:
+            half = max(0, keep - len(MARKER)) // 2
+            result = _cut(text, half, True) + MARKER + _cut(text, half, False)
+        tokens = count_tokens(result)
+        if tokens <= max_tokens:
+            return result, total - tokens
+        ratio *= 0.9 * max_tokens / tokens
+    return "", total
+
+
+def openrouter_limit(models, max_prompt_tokens=0, reserve=0):
+    """Prompt budget for an OpenRouter call: explicit cap, or the smallest known context."""
+    if max_prompt_tokens:
+        return max_prompt_tokens
+    contexts = [c for c in (openrouter_models.context_length(m) for m in models) if c]
+    if not contexts:
+        return 0
+    return max(0, min(contexts) - (reserve or DEFAULT_RESERVE))
+
+
+def ollama_limit(num_ctx=0, max_prompt_tokens=0, reserve=0):
+    if max_prompt_tokens:
+        return max_prompt_tokens
+    if num_ctx:
+        return max(0, num_ctx - (reserve or DEFAULT_RESERVE))
+    return 0
+
+
+def fit_prompt(system_prompt, user_prompt, limit, mode="off", label="TokenBudget"):
+    """user_prompt shortened to fit `limit` prompt tokens (system prompt is kept whole).
+
+    `limit` may be a callable, evaluated only when `mode` is not "off"
+    (the OpenRouter limit needs the model catalog).
+    Raises PromptTooLong in "error" mode, or when even the system prompt does not fit.
+    """
+    if mode == "off":
+        return user_prompt
+    if callable(limit):
+        limit = limit()
+    if not limit:
+        return user_prompt
+    fixed = count_tokens(system_prompt) + 2 * MESSAGE_OVERHEAD
+    user_tokens = count_tokens(user_prompt)
+    if fixed + user_tokens <= limit:
+        return user_prompt
+    if mode == "error":
+        raise PromptTooLong(f"prompt is ~{fixed + user_tokens} tokens, the limit is {limit}")
+    if fixed >= limit:
+        raise PromptTooLong(f"system prompt alone is ~{fixed} tokens, the limit is {limit}")
+    shortened, removed = truncate(user_prompt, limit - fixed, mode)
+    metrics.inc("truncated_tokens_total", removed, mode=mode)
+    logger.info("%s: user_prompt truncated (%s) from ~%s to ~%s tokens to fit %s",
+                label, mode, user_tokens, user_tokens - removed, limit)
+    return shortened
@@ -0,0 +1,284 @@
+# tracing.py
+#
+# Трассировка вызовов нод: у каждого вызова свой trace id, внутри — отрезки
+# времени (spans) по стадиям: конвертация тензора, уменьшение, кодирование,
+# base64, сериализация JSON, соединение, ожидание первого байта, чтение тела,
+# разбор ответа. Трасса пишется в формате Chrome trace JSON и открывается
+# в chrome://tracing или https://ui.perfetto.dev — по пакетному прогону
+# сразу видно, какая стадия занимает время.
+#
+#   OPENROUTER_TRACE_FILE      — файл трассы (без него трассировка выключена)
+#   OPENROUTER_TRACE_SAMPLE    — доля трассируемых вызовов нод, 0..1 (по умолчанию 1)
+#   OPENROUTER_TRACE_INTERVAL  — период записи в файл, секунды (по умолчанию 30)
+#   GET /openrouter/trace      — текущий буфер (маршрут сервера ComfyUI)
+#
+# Выключенная трассировка стоит одной проверки на span.
+
+import atexit
+import collections
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger("Tracing")
+logger.setLevel(logging.DEBUG)
+
+MAX_EVENTS = 200_000   # кольцевой буфер: старые события вытесняются
+
+_local = threading.local()
+_events = collections.deque(maxlen=MAX_EVENTS)
+_thread_names = {}
+_ids = itertools.count(1)
+_PID = os.getpid()
+_T0 = time.perf_counter()
+
+_enabled = False
+_sample = 1.0
+_last_written = None   # последнее событие на момент записи в файл
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL = _NullSpan()
+
+
+def _thread_id():
+    tid = threading.get_ident()
+    if tid not in _thread_names:
+        _thread_names[tid] = threading.current_thread().name
+    return tid
+
+
+def _emit(name, cat, start, end, args):
+    _events.append({
+        "name": name, "cat": cat, "ph": "X", "pid": _PID, "tid": _thread_id(),
+        "ts": round((start - _T0) * 1e6, 1), "dur": round((end - start) * 1e6, 1),
+        "args": args,
+    })
+
+
+class Span:
+    """Timed stage of the current trace; recorded when the block exits."""
+
+    __slots__ = ("name", "cat", "args", "start")
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.args["trace_id"] = _local.trace_id
+        _emit(self.name, self.cat, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class _Trace(Span):
+    """Root span: assigns the trace id (or 0 when sampled out) for this thread."""
+
+    __slots__ = ("trace_id", "prev")
+
+    def __init__(self, name, trace_id, args):
+        super().__init__(name, "node", args)
+        self.trace_id = trace_id
+        self.prev = None
+
+    def __enter__(self):
+        self.prev = getattr(_local, "trace_id", None)
+        _local.trace_id = self.trace_id
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.trace_id:
+                super().__exit__(exc_type, exc, tb)
+        finally:
+            _local.trace_id = self.prev
+        return False
+
+
+def span(name, cat="stage", **args):
+    """`with span("encode"):` — a no-op unless the current thread is inside a sampled trace."""
+    if not _enabled or not getattr(_local, "trace_id", None):
+        return _NULL
+    return Span(name, cat, args)
+
+
+def trace(name, **args):
+    """Root of a trace (one node call); nested calls become spans of the outer trace."""
+    if not _enabled:
+        return _NULL
+    current = getattr(_local, "trace_id", None)
+    if current is not None:
+        return Span(name, "node", args) if current else _NULL
+    trace_id = next(_ids) if random.random() < _sample else 0
+    return _Trace(name, trace_id, args)
+
+
+def traced(name):
+    """Decorator form of trace() for node entry points."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+def record(name, start, end=None, cat="stage", **args):
+    """Add a span measured by hand (perf_counter timestamps)."""
+    if not _enabled or not getattr(_local, "trace_id", None):
+        return
+    args["trace_id"] = _local.trace_id
+    _emit(name, cat, start, time.perf_counter() if end is None else end, args)
+
+
+def bind(fn):
+    """Wrap fn so that it runs inside the caller's trace on another thread."""
+    trace_id = getattr(_local, "trace_id", None)
+    if not _enabled or trace_id is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        prev = getattr(_local, "trace_id", None)
+        _local.trace_id = trace_id
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.trace_id = prev
+    return bound
+
+
+def enable(sample=1.0):
+    global _enabled, _sample
+    _sample = max(0.0, min(1.0, float(sample)))
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def clear():
+    _events.clear()
+
+
+def export():
+    """Buffered events as a Chrome trace dict (JSON Object Format)."""
+    events = list(_events)
+    meta = [{"name": "thread_name", "ph": "M", "pid": _PID, "tid": tid, "args": {"name": name}}
+            for tid, name in list(_thread_names.items())]
+    return {"traceEvents": meta + events, "displayTimeUnit": "ms"}
+
+
+def summary():
+    """Time per span name over the buffer: {name: {count, total_ms, mean_ms, max_ms}}, slowest first."""
+    stages = {}
+    for event in list(_events):
+        entry = stages.setdefault(event["name"], [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += event["dur"]
+        entry[2] = max(entry[2], event["dur"])
+    return {
+        name: {"count": n, "total_ms": round(total / 1000, 3),
+               "mean_ms": round(total / n / 1000, 3), "max_ms": round(top / 1000, 3)}
+        for name, (n, total, top) in sorted(stages.items(), key=lambda kv: -kv[1][1])
+    }
+
+
+def _last_event():
+    try:
+        return _events[-1]
+    except IndexError:
+        return None
+
+
+def dump(path):
+    global _last_written
+    last = _last_event()
+    data = export()
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    _last_written = last
+
+
+def _dump_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        if _last_event() is not _last_written:
+            _dump_quietly(path)
+
+
+def _dump_quietly(path):
+    try:
+        dump(path)
+    except Exception as e:
+        logger.warning("Tracing: dump to %s failed: %s", path, e)
+
+
+def start_dumper(path, interval=30.0):
+    thread = threading.Thread(target=_dump_loop, args=(path, interval),
+                              name="llm-trace-dump", daemon=True)
+    thread.start()
+    # Короткий прогон может закончиться раньше первой периодической записи
+    atexit.register(_dump_quietly, path)
+    logger.info("Tracing: writing Chrome trace to %s every %.0fs", path, interval)
+    return thread
+
+
+def register_routes():
+    """Add /openrouter/trace to the ComfyUI server; no-op outside ComfyUI."""
+    try:
+        from aiohttp import web
+        from server import PromptServer
+        routes = PromptServer.instance.routes
+    except Exception:
+        return False
+
+    @routes.get("/openrouter/trace")
+    async def _trace(request):
+        return web.json_response(export())
+
+    return True
+
+
+register_routes()
+
+if os.environ.get("OPENROUTER_TRACE_FILE"):
+    try:
+        enable(float(os.environ.get("OPENROUTER_TRACE_SAMPLE", 1)))
+    except ValueError:
+        enable()
+    try:
+        _interval = float(os.environ.get("OPENROUTER_TRACE_INTERVAL", 30))
+    except ValueError:
+        _interval = 30.0
+    start_dumper(os.environ["OPENROUTER_TRACE_FILE"], _interval)